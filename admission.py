@@ -0,0 +1,226 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+import anyio.to_thread
+from logging_config import setup_logging
+from metrics import REGISTRY, Counter
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+# Per-user limits: concurrent requests and a token bucket (requests/second with a burst)
+USER_MAX_CONCURRENCY = int(os.getenv("ADMISSION_USER_CONCURRENCY", "4"))
+USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "5"))
+USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "20"))
+# Global shedding: in-flight cap, event-loop lag and threadpool backlog
+MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "256"))
+MAX_LOOP_LAG_MS = float(os.getenv("ADMISSION_MAX_LOOP_LAG_MS", "200"))
+MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "64"))
+LAG_SAMPLE_INTERVAL = 0.1
+# Health, metrics and monitoring stay reachable while the service sheds load
+EXEMPT_PREFIXES = ("/health", "/metrics", "/monitoring", "/docs", "/openapi.json")
+# Users tracked for the per-user rejection report
+MAX_TRACKED_USERS = 10000
+
+admission_rejections = REGISTRY.register(Counter(
+    "eoxs_admission_rejections_total", "Requests rejected by admission control", ["reason"]))
+
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted; carries the HTTP status and Retry-After seconds.
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Refills at rate tokens per second up to burst; each admitted request takes one.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes a token and returns 0, or returns the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class UserLimiter:
+    """
+    Per-user concurrency and rate limits, with rejection counts per user.
+    """
+
+    def __init__(self, max_concurrency: int = USER_MAX_CONCURRENCY, rate: float = USER_RATE,
+                 burst: float = USER_BURST):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._rejections: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _reject(self, user_id: str, reason: str, retry_after: float) -> Rejected:
+        counts = self._rejections.get(user_id)
+        if counts is None and len(self._rejections) < MAX_TRACKED_USERS:
+            counts = self._rejections[user_id] = {}
+        if counts is not None:
+            counts[reason] = counts.get(reason, 0) + 1
+        admission_rejections.inc(reason=reason)
+        return Rejected(429, reason, max(1, math.ceil(retry_after)))
+
+    def acquire(self, user_id: str) -> None:
+        with self._lock:
+            if self._in_flight.get(user_id, 0) >= self.max_concurrency:
+                raise self._reject(user_id, "user_concurrency", 1)
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            wait = bucket.take()
+            if wait > 0:
+                raise self._reject(user_id, "user_rate", wait)
+            self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+
+    def release(self, user_id: str) -> None:
+        with self._lock:
+            remaining = self._in_flight.get(user_id, 0) - 1
+            if remaining > 0:
+                self._in_flight[user_id] = remaining
+            else:
+                self._in_flight.pop(user_id, None)
+
+    @contextmanager
+    def admit(self, user_id: str) -> Iterator[None]:
+        """
+        Holds one of the user's concurrency slots for the duration of the block.
+        Raises Rejected (429) if the user is over their concurrency or rate limit.
+        """
+        self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def stats(self, top: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            rejected = sorted(
+                ((user_id, sum(counts.values()), dict(counts)) for user_id, counts in self._rejections.items()),
+                key=lambda item: item[1], reverse=True,
+            )[:top]
+            in_flight = sum(self._in_flight.values())
+            active = len(self._in_flight)
+        return {
+            "maxConcurrency": self.max_concurrency,
+            "rate": self.rate,
+            "burst": self.burst,
+            "inFlight": in_flight,
+            "activeUsers": active,
+            "topRejectedUsers": [
+                {"userId": user_id, "rejected": total, "byReason": counts} for user_id, total, counts in rejected
+            ],
+        }
+
+
+class LoadShedder:
+    """
+    Global admission: rejects new requests with 503 while too many are in flight,
+    the event loop is lagging or the threadpool has a backlog, instead of queueing them.
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, max_loop_lag_ms: float = MAX_LOOP_LAG_MS,
+                 max_queue_depth: int = MAX_QUEUE_DEPTH):
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.max_queue_depth = max_queue_depth
+        self.in_flight = 0
+        self.loop_lag_ms = 0.0
+        self.rejections: Dict[str, int] = {}
+        self._lag_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def queue_depth() -> int:
+        """
+        Number of tasks waiting for a threadpool worker (run_in_threadpool).
+        """
+        return anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+    def _reject(self, reason: str) -> Rejected:
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+        admission_rejections.inc(reason=reason)
+        return Rejected(503, reason, 1)
+
+    def enter(self) -> None:
+        """
+        Admits a request or raises Rejected (503). Called on the event loop only.
+        """
+        if self.in_flight >= self.max_in_flight:
+            raise self._reject("in_flight")
+        if self.loop_lag_ms > self.max_loop_lag_ms:
+            raise self._reject("loop_lag")
+        if self.queue_depth() > self.max_queue_depth:
+            raise self._reject("queue_depth")
+        self.in_flight += 1
+
+    def exit(self) -> None:
+        self.in_flight -= 1
+
+    async def _measure_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            lag = max(0.0, (loop.time() - start - LAG_SAMPLE_INTERVAL) * 1000)
+            # Rise immediately, decay smoothly so one quiet tick does not reopen the gate
+            self.loop_lag_ms = lag if lag > self.loop_lag_ms else 0.8 * self.loop_lag_ms + 0.2 * lag
+
+    def start(self) -> None:
+        """
+        Starts the event-loop lag monitor on the running loop.
+        """
+        if self._lag_task is None:
+            self._lag_task = asyncio.get_running_loop().create_task(self._measure_lag())
+
+    def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inFlight": self.in_flight,
+            "maxInFlight": self.max_in_flight,
+            "loopLagMs": round(self.loop_lag_ms, 2),
+            "maxLoopLagMs": self.max_loop_lag_ms,
+            "queueDepth": self.queue_depth(),
+            "maxQueueDepth": self.max_queue_depth,
+            "rejections": dict(self.rejections),
+        }
+
+
+def is_exempt(path: str) -> bool:
+    return path.startswith(EXEMPT_PREFIXES)
+
+
+user_limiter = UserLimiter()
+load_shedder = LoadShedder()
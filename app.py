@@ -1,20 +1,150 @@
 import os
 import time
 import uuid
+import tempfile
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from models import EmbedRequest, EmbedResponse, AIResponseRequest, AIResponseResponse, QueryRequest, QueryResponse, QueryMatch
-from embedding import generate_embedding
-from db import add_document, query_similar_any_thread, get_or_create_collection
-from utils import current_utc_timestamp
+from fastapi.responses import PlainTextResponse, JSONResponse, ORJSONResponse, StreamingResponse
+from models import (
+    EmbedRequest, EmbedResponse, AIResponseRequest, AIResponseResponse, BaseQueryRequest, QueryRequest, QueryResponse,
+    MigrationRequest, MultiUserQueryRequest, MultiUserQueryResponse, GroupedQueryRequest, GroupedQueryResponse,
+)
+from embedding import (
+    generate_embedding, prime_embeddings, model_label, get_client as get_embedding_client, EMBEDDING_PROVIDER,
+)
+from db import (
+    add_document, query_similar_any_thread, get_or_create_collection, result_cache,
+    collection_size, warm_collection, get_client, embedding_spec_for, get_route, load_context,
+    users_with_collection,
+)
+from utils import current_utc_timestamp, to_epoch
 from openai import OpenAI, OpenAIError
-from logging_config import setup_logging
-from monitoring import log_api_call, get_api_stats, get_average_latency, latency_collection
+from logging_config import setup_logging, sample, start_logging, stop_logging
+import monitoring
+from monitoring import (
+    log_api_call, log_slow_request, record_latency, get_api_stats,
+    get_average_latency, get_latency_percentiles, SLOW_REQUEST_MS,
+)
+from request_context import begin_request, annotate_request, server_timing_header
+from singleflight import query_flight, make_key
+import metrics
+from metrics import timed, llm_tokens, provider_errors, REGISTRY, GaugeCallback
+import profiling
+import migration
+import retention
+import export
+import snapshot
+import scatter
+from dedup import deduplicator, DEDUP_ENABLED
+from thread_log import thread_log
+from rerank import reranker, RERANK_CANDIDATES, RERANK_TOP_K
+from admission import user_limiter, load_shedder, is_exempt, Rejected
 
 # Initialize logger
 logger = setup_logging(__name__)
 
-app = FastAPI(title="EOXS AI Embedding Microservice")
+# Grouped retrieval starts by fetching this many times the matches it returns,
+# doubling (up to GROUPED_MAX_CANDIDATES) while a group is still short
+GROUPED_OVERFETCH = int(os.getenv("GROUPED_OVERFETCH", "3"))
+GROUPED_MAX_CANDIDATES = int(os.getenv("GROUPED_MAX_CANDIDATES", "1000"))
+
+# Optional warm-up before the worker reports ready
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() in ("1", "true", "yes")
+WARMUP_USER_IDS = [user_id.strip() for user_id in os.getenv("WARMUP_USER_IDS", "").split(",") if user_id.strip()]
+WARMUP_USERS = int(os.getenv("WARMUP_USERS", "20"))
+WARMUP_QUERIES = int(os.getenv("WARMUP_QUERIES", "50"))
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "120"))
+
+# Startup state reported by /health/ready
+readiness = {"status": "starting", "warmup": None, "error": None}
+
+
+def _init_clients() -> None:
+    """
+    Creates the Chroma and OpenAI clients so the first request does not pay for it.
+    MongoDB is connected lazily by the monitoring writer. Without an OpenAI key
+    only /rag-generate is unavailable, so that does not fail startup.
+    """
+    get_client()
+    if EMBEDDING_PROVIDER != "fake":
+        get_embedding_client()
+    try:
+        get_chat_client()
+    except RuntimeError as e:
+        logger.warning("Chat client unavailable, /rag-generate will fail: %s", e)
+
+
+def _warm_up() -> dict:
+    """
+    Preloads the hottest user collections and primes the embedding cache with
+    their most frequent recent queries.
+    """
+    start = time.perf_counter()
+    user_ids = WARMUP_USER_IDS or monitoring.get_hot_users(limit=WARMUP_USERS)
+    warmed, documents = 0, 0
+    users_by_spec: Dict[tuple, List[str]] = {}
+    for user_id in user_ids:
+        try:
+            documents += warm_collection(user_id)
+            warmed += 1
+        except Exception as e:
+            logger.warning("Skipping warm-up for user %s: %s", user_id, e)
+        spec = embedding_spec_for(user_id)
+        users_by_spec.setdefault((spec["model"], spec["dimensions"]), []).append(user_id)
+    # Queries are embedded with the model of the users who sent them
+    primed = 0
+    for (model, dimensions), spec_users in users_by_spec.items():
+        queries = monitoring.get_frequent_queries(spec_users, limit=WARMUP_QUERIES)
+        primed += prime_embeddings(queries, model=model, dimensions=dimensions)
+    summary = {
+        "collections": warmed,
+        "documents": documents,
+        "embeddingsPrimed": primed,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+    logger.info("Warm-up finished: %s", summary)
+    return summary
+
+
+async def _startup() -> None:
+    try:
+        await run_in_threadpool(_init_clients)
+        if WARMUP_ENABLED:
+            readiness["status"] = "warming"
+            try:
+                readiness["warmup"] = await asyncio.wait_for(run_in_threadpool(_warm_up), WARMUP_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.warning("Warm-up did not finish within %ss; continuing cold", WARMUP_TIMEOUT_SECONDS)
+                readiness["warmup"] = {"timedOut": True}
+        readiness["status"] = "ready"
+    except Exception as e:
+        logger.error(f"Startup failed: {e}", exc_info=True)
+        readiness["status"] = "failed"
+        readiness["error"] = str(e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_logging()
+    # Initialize in the background so liveness answers while the worker warms up
+    startup_task = asyncio.create_task(_startup())
+    load_shedder.start()
+    if retention.RETENTION_ENABLED:
+        retention.compactor.start()
+    yield
+    retention.compactor.stop()
+    load_shedder.stop()
+    startup_task.cancel()
+    monitoring.shutdown()
+    stop_logging()
+
+
+app = FastAPI(title="EOXS AI Embedding Microservice", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,88 +154,287 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _route_label(request: Request) -> str:
+    """
+    Route template (e.g. /debug-docs/{user_id}) so metric labels stay low-cardinality.
+    """
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def _log_slow_request(endpoint: str, info: dict, timings: dict, duration_ms: float) -> None:
+    """
+    Writes a slow-request entry; runs off the event loop because it counts the collection.
+    """
+    try:
+        user_id = info.get("user_id")
+        size = collection_size(user_id) if user_id and info.get("search") else None
+        log_slow_request(endpoint, user_id, duration_ms, timings, info.get("search"), size)
+    except Exception as e:
+        logger.error(f"Failed to log slow request: {e}", exc_info=True)
+
+
+def _finish_request(endpoint: str, route: str, info: dict, status: str, error, duration_ms: float) -> None:
+    """
+    Records a finished request in the monitoring pipeline: API call log,
+    per-stage latency rollups and, if over the threshold, the slow-request log.
+    """
+    timings = {stage: round(duration, 3) for stage, duration in info["timings"].items()}
+    record_latency(route, status, "total", duration_ms)
+    for stage, duration in timings.items():
+        record_latency(route, status, stage, duration)
+
+    # Log the API call
+    log_api_call(
+        endpoint=endpoint,
+        user_id=info.get("user_id"),
+        message_id=info.get("message_id"),
+        thread_id=info.get("thread_id"),
+        query=info.get("query"),
+        duration_ms=duration_ms,
+        status=status,
+        error=error,
+        timings=timings
+    )
+
+    if duration_ms >= SLOW_REQUEST_MS:
+        asyncio.get_running_loop().run_in_executor(None, _log_slow_request, route, info, timings, duration_ms)
+
+
+def _rejected_response(rejected: Rejected) -> JSONResponse:
+    return JSONResponse(
+        status_code=rejected.status_code,
+        content={"detail": "Too many requests" if rejected.status_code == 429 else "Service overloaded",
+                 "reason": rejected.reason},
+        headers={"Retry-After": str(rejected.retry_after)},
+    )
+
+
+@app.exception_handler(Rejected)
+async def rejected_handler(request: Request, exc: Rejected):
+    return _rejected_response(exc)
+
+
+async def _call_admitted(request: Request, call_next):
+    """
+    Global load shedding: answers 503 immediately instead of queueing when the
+    worker is saturated. Health, metrics and monitoring routes are never shed.
+    """
+    if is_exempt(request.url.path):
+        return await call_next(request)
+    try:
+        load_shedder.enter()
+    except Rejected as rejected:
+        return _rejected_response(rejected)
+    try:
+        return await call_next(request)
+    finally:
+        load_shedder.exit()
+
+
 # Monitoring middleware
 @app.middleware("http")
 async def monitor_api_calls(request: Request, call_next):
-    start_time = time.time()
-    
-    # Extract request data
     endpoint = request.url.path
-    user_id = None
-    message_id = None
-    thread_id = None
-    query = None
-    
-    # Try to extract data from request body for specific endpoints
-    if endpoint in ["/embed", "/rag-context", "/rag-generate", "/query"]:
-        try:
-            body = await request.body()
-            if body:
-                import json
-                request_data = json.loads(body)
-                user_id = request_data.get("userId")
-                message_id = request_data.get("messageId")
-                thread_id = request_data.get("threadId")
-                query = request_data.get("query")
-        except:
-            pass
-    
+
+    # Handlers record userId/threadId/etc. from their already-parsed models;
+    # timed stages append to the same per-request timeline
+    info = begin_request()
+    start_time = info["_start"]
+
     # Process the request
     try:
-        response = await call_next(request)
-        duration_ms = (time.time() - start_time) * 1000
+        response = await _call_admitted(request, call_next)
+        duration_ms = (time.perf_counter() - start_time) * 1000
         status = "success" if response.status_code < 400 else "failure"
         error = None if response.status_code < 400 else f"HTTP {response.status_code}"
-        
-        # Log the API call
-        log_api_call(
-            endpoint=endpoint,
-            user_id=user_id,
-            message_id=message_id,
-            thread_id=thread_id,
-            query=query,
-            duration_ms=duration_ms,
-            status=status,
-            error=error
-        )
-        
+        route = _route_label(request)
+        metrics.http_requests.inc(endpoint=route, status=response.status_code)
+        metrics.http_request_seconds.observe(duration_ms / 1000, endpoint=route)
+        response.headers["Server-Timing"] = server_timing_header(info["timings"], duration_ms)
+        _finish_request(endpoint, route, info, status, error, duration_ms)
         return response
         
     except Exception as e:
-        duration_ms = (time.time() - start_time) * 1000
-        error_msg = str(e)
-        
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        route = _route_label(request)
+        metrics.http_requests.inc(endpoint=route, status=500)
+        metrics.http_request_seconds.observe(duration_ms / 1000, endpoint=route)
         # Log the failed API call
-        log_api_call(
-            endpoint=endpoint,
-            user_id=user_id,
-            message_id=message_id,
-            thread_id=thread_id,
-            query=query,
-            duration_ms=duration_ms,
-            status="failure",
-            error=error_msg
-        )
-        
+        _finish_request(endpoint, route, info, "failure", str(e), duration_ms)
         raise
 
-# OpenAI client
-openai_api_key = os.getenv("OPENAI_API_KEY")
-logger.info(f"OPENAI_API_KEY: {openai_api_key}")
-if not openai_api_key:
-    logger.error("OPENAI_API_KEY environment variable not set")
-    raise RuntimeError("OPENAI_API_KEY environment variable not set")
 
-client = OpenAI(api_key=openai_api_key)
-logger.info("OpenAI client initialized")
+# OpenAI chat client (created on first use)
+_chat_client: Optional[OpenAI] = None
+
+
+def get_chat_client() -> OpenAI:
+    """
+    Returns the OpenAI client used for chat completions, creating it on first use.
+    """
+    global _chat_client
+    if _chat_client is None:
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        if not openai_api_key:
+            logger.error("OPENAI_API_KEY environment variable not set")
+            raise RuntimeError("OPENAI_API_KEY environment variable not set")
+        _chat_client = OpenAI(api_key=openai_api_key)
+        logger.info("OpenAI client initialized")
+    return _chat_client
+
+
+async def _coalesced(endpoint: str, req: BaseQueryRequest, fn, *extra):
+    """
+    Runs a blocking query handler in the threadpool, sharing one in-flight
+    computation between concurrent identical requests (same endpoint and
+    request fields). Each request counts against the user's admission limits.
+    """
+    annotate_request(user_id=req.userId, thread_id=req.threadId, query=req.query)
+    key = make_key(endpoint, req.model_dump(), *extra)
+    with user_limiter.admit(req.userId):
+        return await query_flight.do(key, lambda: run_in_threadpool(fn, req, *extra))
+
+
+def _time_options(req: BaseQueryRequest) -> Dict[str, Any]:
+    """
+    Time window and recency ranking options of a query, as db query keyword arguments.
+    """
+    return {
+        "since": to_epoch(req.since),
+        "until": to_epoch(req.until),
+        "recency_half_life_days": req.recencyHalfLifeDays,
+        "recency_weight": req.recencyWeight,
+    }
+
+
+# Fields a query match can carry, see QueryRequest.include
+MATCH_FIELDS = ("content", "score", "metadata")
+
+
+def _projection(include: Optional[List[str]]):
+    """
+    Resolves QueryRequest.include into the ChromaDB fields to fetch, the match
+    fields to return and the metadata keys to keep (None keeps all of them).
+    """
+    fields = set()
+    metadata_keys = set()
+    all_metadata = False
+    for item in include or MATCH_FIELDS:
+        if item == "metadata":
+            all_metadata = True
+        elif item.startswith("metadata.") and len(item) > len("metadata."):
+            metadata_keys.add(item[len("metadata."):])
+        elif item in MATCH_FIELDS:
+            fields.add(item)
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown include field: {item}")
+
+    chroma_include = []
+    # metadata["content"] is rehydrated from the stored document
+    if "content" in fields or all_metadata or "content" in metadata_keys:
+        chroma_include.append("documents")
+    if all_metadata or metadata_keys:
+        fields.add("metadata")
+        chroma_include.append("metadatas")
+    if "score" in fields:
+        chroma_include.append("distances")
+    return chroma_include, fields, None if all_metadata else metadata_keys
+
+
+def _build_matches(results: Dict[str, Any], fields: set, metadata_keys: Optional[set]) -> Dict[str, Any]:
+    """
+    Builds the query response payload as plain dicts, with only the requested fields.
+    """
+    ids = results["ids"][0]
+    documents = (results.get("documents") or [[]])[0]
+    metadatas = (results.get("metadatas") or [[]])[0]
+    distances = (results.get("distances") or [[]])[0]
+
+    matches = [
+        _project_match({}, documents[i] if documents else None, 1 - distances[i] if distances else None,
+                       metadatas[i] if metadatas else None, fields, metadata_keys)
+        for i in range(len(ids))
+    ]
+    return {"status": "success", "matches": matches}
+
+
+def _project_match(match: Dict[str, Any], document: Optional[str], score: Optional[float],
+                   meta: Optional[Dict[str, Any]], fields: set, metadata_keys: Optional[set]) -> Dict[str, Any]:
+    """
+    Adds the requested fields of one hit to match.
+    """
+    if "content" in fields:
+        match["content"] = document
+    if "score" in fields:
+        match["score"] = score
+    if "metadata" in fields:
+        meta = meta or {}
+        if metadata_keys is None:
+            match["metadata"] = meta
+        else:
+            match["metadata"] = {k: meta[k] for k in metadata_keys if k in meta}
+            # Contexts live in the blob store and are only read when asked for
+            if "context" in metadata_keys:
+                match["metadata"]["context"] = load_context(meta)
+    return match
+
+
+def _orjson(payload: Dict[str, Any]) -> ORJSONResponse:
+    # Rendering happens in the constructor, so this times the whole serialization
+    with timed("serialize"):
+        return ORJSONResponse(payload)
+
+
+def _store_document(user_id: str, doc_id: str, metadata: dict, spec: dict) -> Optional[str]:
+    """
+    Embeds and stores a document unless it duplicates one the user already has.
+    Exact duplicates are caught before calling the embedding provider; the
+    content hash is reserved first, so concurrent copies store one vector.
+    Returns the canonical document id for a duplicate, None when stored.
+    """
+    reserved = False
+    if DEDUP_ENABLED:
+        canonical_id, reserved = deduplicator.claim_exact(user_id, doc_id, metadata)
+        if canonical_id:
+            deduplicator.record_duplicate(user_id, doc_id, canonical_id, "exact", metadata)
+            # Not stored as a vector, but still part of the conversation
+            thread_log.append(user_id, [doc_id], [metadata])
+            return canonical_id
+
+    try:
+        embedding_vector = generate_embedding(metadata["content"], **spec)
+
+        if DEDUP_ENABLED:
+            near = deduplicator.find_near(user_id, doc_id, metadata, embedding_vector)
+            if near:
+                if reserved:
+                    deduplicator.release(user_id, doc_id, metadata)
+                deduplicator.record_duplicate(user_id, doc_id, near[0], "near", metadata, similarity=near[1])
+                thread_log.append(user_id, [doc_id], [metadata])
+                return near[0]
+
+        # The dedup index is updated by its db write hook
+        add_document(user_id, doc_id, embedding_vector, metadata)
+    except Exception:
+        if reserved:
+            deduplicator.release(user_id, doc_id, metadata)
+        raise
+    return None
 
 
 @app.post("/embed", response_model=EmbedResponse)
 async def embed_message(req: EmbedRequest) -> EmbedResponse:
-    try:
-        logger.info(f"Embed request: user={req.userId}, message={req.messageId}")
-        embedding_vector = generate_embedding(req.content)
+    annotate_request(user_id=req.userId, thread_id=req.threadId, message_id=req.messageId)
+    with user_limiter.admit(req.userId):
+        # Embedding, dedup lookups and the upsert block: keep them off the event loop
+        return await run_in_threadpool(_embed_message, req)
 
+
+def _embed_message(req: EmbedRequest) -> EmbedResponse:
+    try:
+        logger.info("Embed request: user=%s, message=%s", req.userId, req.messageId, extra=sample())
+        spec = embedding_spec_for(req.userId)
         metadata = {
             "userId": req.userId,
             "messageId": req.messageId,
@@ -113,14 +442,15 @@ async def embed_message(req: EmbedRequest) -> EmbedResponse:
             "createdAt": current_utc_timestamp(),
             "threadId": req.threadId or None,
             "type": "user_message",  # Mark this as a user message
+            "embeddingModel": model_label(**spec),
         }
-        
+
         # Add any additional metadata from the request
         if req.metadata:
             metadata.update(req.metadata)
 
-        add_document(req.userId, req.messageId, embedding_vector, metadata)
-        return EmbedResponse()
+        duplicate_of = _store_document(req.userId, req.messageId, metadata, spec)
+        return EmbedResponse(duplicateOf=duplicate_of)
     except Exception as e:
         logger.error(f"Error embedding message: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to embed message")
@@ -128,10 +458,15 @@ async def embed_message(req: EmbedRequest) -> EmbedResponse:
 
 @app.post("/embed-ai-response", response_model=AIResponseResponse)
 async def embed_ai_response(req: AIResponseRequest) -> AIResponseResponse:
-    try:
-        logger.info(f"Embed AI response: user={req.userId}, response={req.responseId}")
-        embedding_vector = generate_embedding(req.content)
+    annotate_request(user_id=req.userId, thread_id=req.threadId, message_id=req.responseId)
+    with user_limiter.admit(req.userId):
+        return await run_in_threadpool(_embed_ai_response, req)
+
 
+def _embed_ai_response(req: AIResponseRequest) -> AIResponseResponse:
+    try:
+        logger.info("Embed AI response: user=%s, response=%s", req.userId, req.responseId, extra=sample())
+        spec = embedding_spec_for(req.userId)
         metadata = {
             "userId": req.userId,
             "responseId": req.responseId,
@@ -141,32 +476,53 @@ async def embed_ai_response(req: AIResponseRequest) -> AIResponseResponse:
             "threadId": req.threadId or None,
             "type": "ai_response",  # Mark this as an AI response
             "context": req.context or None,
+            "embeddingModel": model_label(**spec),
         }
-        
+
         # Add any additional metadata from the request
         if req.metadata:
             metadata.update(req.metadata)
 
-        add_document(req.userId, req.responseId, embedding_vector, metadata)
-        return AIResponseResponse()
+        duplicate_of = _store_document(req.userId, req.responseId, metadata, spec)
+        return AIResponseResponse(duplicateOf=duplicate_of)
     except Exception as e:
         logger.error(f"Error embedding AI response: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to embed AI response")
 
 
+def _rerank_candidates(req: QueryRequest, query_text: str, documents: List[str], distances: List[float]):
+    """
+    Applies the optional cross-encoder stage to RAG candidates. Returns the kept
+    documents, their distances, the rerank outcome and the cross-encoder scores.
+    """
+    if not req.rerank:
+        return documents, distances, None, None
+    # Drop echoes of the query before they take one of the kept slots
+    query_lower = query_text.lower().strip()
+    candidates = [i for i, doc in enumerate(documents) if doc.lower().strip() != query_lower]
+    order, scores, outcome = reranker.rerank(query_text, [documents[i] for i in candidates],
+                                             top_k=req.rerankTopK or RERANK_TOP_K, budget_ms=req.latencyBudgetMs)
+    kept = [candidates[i] for i in order]
+    return [documents[i] for i in kept], [distances[i] for i in kept], outcome, scores
+
+
 @app.post("/rag-context")
 async def get_rag_context(req: QueryRequest, similarity_threshold: float = 0):
     """
     RAG Phase 1: Retrieve similar messages as plain text context.
     """
+    return await _coalesced("/rag-context", req, _rag_context, similarity_threshold)
+
+
+def _rag_context(req: QueryRequest, similarity_threshold: float):
     try:
-        logger.info(f"RAG context request: userId={req.userId}, filters={req.filters}, query={req.query}, threshold={similarity_threshold}")
+        logger.info("RAG context request: userId=%s, filters=%s, query=%s, threshold=%s", req.userId, req.filters, req.query, similarity_threshold, extra=sample())
         query_text = req.query[0] if isinstance(req.query, list) else req.query
 
         if not isinstance(query_text, str):
             raise HTTPException(status_code=400, detail="Invalid query type")
 
-        query_embedding = generate_embedding(query_text)
+        query_embedding = generate_embedding(query_text, **embedding_spec_for(req.userId))
 
         where_filter = {}
 
@@ -179,38 +535,46 @@ async def get_rag_context(req: QueryRequest, similarity_threshold: float = 0):
         # Add filter to exclude AI responses and query-like content
         where_filter["type"] = "user_message"
 
-        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=10)
-        documents = results.get("documents", [[]])[0]
-        distances = results.get("distances", [[]])[0]
+        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter,
+                                           top_k=RERANK_CANDIDATES if req.rerank else 10,
+                                           include=["documents", "distances"], **_time_options(req))
+        documents, distances, rerank_outcome, rerank_scores = _rerank_candidates(
+            req, query_text, results.get("documents", [[]])[0], results.get("distances", [[]])[0])
         
         # Apply threshold filtering and query similarity filtering
         relevant_documents = []
         relevant_scores = []
+        relevant_rerank_scores = []
         relevant_count = 0
         query_lower = query_text.lower().strip()
         
-        for doc, dist in zip(documents, distances):
-            similarity_score = 1 - dist  # Convert distance to similarity
-            doc_lower = doc.lower().strip()
-            
-            # Only skip if document is exactly the same as the query
-            if (similarity_score >= similarity_threshold and 
-                doc_lower != query_lower):
-                relevant_documents.append(doc)
-                relevant_scores.append(round(similarity_score, 4))
-                relevant_count += 1
+        with timed("post_filter"):
+            for i, (doc, dist) in enumerate(zip(documents, distances)):
+                similarity_score = 1 - dist  # Convert distance to similarity
+                doc_lower = doc.lower().strip()
+                
+                # Only skip if document is exactly the same as the query
+                if (similarity_score >= similarity_threshold and 
+                    doc_lower != query_lower):
+                    relevant_documents.append(doc)
+                    relevant_scores.append(round(similarity_score, 4))
+                    if rerank_scores is not None:
+                        relevant_rerank_scores.append(round(rerank_scores[i], 4))
+                    relevant_count += 1
         
         # Return filtered documents
         context = "\n---\n".join(relevant_documents) if relevant_documents else ""
         
-        logger.info(f"Returning {relevant_count}/{len(documents)} documents for context (threshold: {similarity_threshold})")
+        logger.info("Returning %d/%d documents for context (threshold: %s)", relevant_count, len(documents), similarity_threshold, extra=sample())
         
         return {
             "context": context,
             "totalFound": len(documents),
             "relevantCount": relevant_count,
             "threshold": similarity_threshold,
-            "similarityScores": relevant_scores if relevant_scores else []
+            "similarityScores": relevant_scores if relevant_scores else [],
+            "rerank": rerank_outcome,
+            "rerankScores": relevant_rerank_scores if rerank_scores is not None else None,
         }
     except Exception as e:
         logger.exception(f"Error building RAG context: {e}")
@@ -222,14 +586,18 @@ async def rag_generate(req: QueryRequest = Body(...)):
     """
     RAG Phase 2: Retrieve context and generate response.
     """
+    return await _coalesced("/rag-generate", req, _rag_generate)
+
+
+def _rag_generate(req: QueryRequest):
     try:
-        logger.info(f"RAG generate request: userId={req.userId}, filters={req.filters}, query={req.query}")
+        logger.info("RAG generate request: userId=%s, filters=%s, query=%s", req.userId, req.filters, req.query, extra=sample())
         query_text = req.query[0] if isinstance(req.query, list) else req.query
 
         if not isinstance(query_text, str):
             raise HTTPException(status_code=400, detail="Invalid query type")
 
-        query_embedding = generate_embedding(query_text)
+        query_embedding = generate_embedding(query_text, **embedding_spec_for(req.userId))
 
         where_filter = {}
 
@@ -242,67 +610,97 @@ async def rag_generate(req: QueryRequest = Body(...)):
         # Add filter to exclude AI responses and query-like content
         where_filter["type"] = "user_message"
 
-        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=10)
-        documents = results.get("documents", [[]])[0]
-        distances = results.get("distances", [[]])[0]
+        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter,
+                                           top_k=RERANK_CANDIDATES if req.rerank else 10,
+                                           include=["documents", "distances"], **_time_options(req))
+        documents, distances, rerank_outcome, _ = _rerank_candidates(
+            req, query_text, results.get("documents", [[]])[0], results.get("distances", [[]])[0])
 
-        # Debug: print raw documents and distances
-        logger.error(f"[DEBUG] Raw documents from similarity search: {documents}")
-        logger.error(f"[DEBUG] Raw distances from similarity search: {distances}")
+        # Debug: raw documents and distances (only formatted when DEBUG is enabled)
+        logger.debug("Raw documents from similarity search: %s", documents)
+        logger.debug("Raw distances from similarity search: %s", distances)
         
+        # Recent window of the thread, read from the ordered log (no vector query)
+        recent_messages = []
+        if req.threadId and req.recentMessages:
+            with timed("thread_log"):
+                recent_messages, _ = thread_log.recent(req.userId, req.threadId, limit=req.recentMessages)
+            recent_messages.reverse()
+        recent_contents = {message["content"] for message in recent_messages}
+
         # Apply the same filtering logic as rag-context
         relevant_documents = []
         query_lower = query_text.lower().strip()
         
-        for doc, dist in zip(documents, distances):
-            doc_lower = doc.lower().strip()
-            # Only skip if document is exactly the same as the query
-            if doc_lower != query_lower:
-                relevant_documents.append(doc)
+        with timed("post_filter"):
+            for doc, dist in zip(documents, distances):
+                doc_lower = doc.lower().strip()
+                # Only skip if document is exactly the same as the query or already in the recent window
+                if doc_lower != query_lower and doc not in recent_contents:
+                    relevant_documents.append(doc)
         
         context = "\n---\n".join(relevant_documents) if relevant_documents else ""
 
+        conversation = ""
+        if recent_messages:
+            lines = [
+                f"{'Assistant' if message['type'] == 'ai_response' else 'User'}: {message['content']}"
+                for message in recent_messages
+            ]
+            conversation = "Recent conversation:\n" + "\n".join(lines) + "\n\n"
+
         prompt = (
             f"Use the following context to answer the question.\n\n"
+            f"{conversation}"
             f"Context:\n{context}\n\n"
             f"Question: {query_text}\n"
             f"Answer:"
         )
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-            max_tokens=512,
-        )
+        with timed("llm"):
+            response = get_chat_client().chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2,
+                max_tokens=512,
+            )
+        if response.usage is not None:
+            llm_tokens.inc(response.usage.prompt_tokens, model="gpt-4o", kind="prompt")
+            llm_tokens.inc(response.usage.completion_tokens, model="gpt-4o", kind="completion")
 
         ai_response_content = response.choices[0].message.content.strip()
         
         # Generate a unique response ID
         response_id = str(uuid.uuid4())
         
+        duplicate_of = None
         # Store the AI response (temporarily disabled for debugging)
         try:
-            ai_response_embedding = generate_embedding(ai_response_content)
-            
-            ai_response_metadata = {
-                "userId": req.userId,
-                "responseId": response_id,
-                "userMessageId": f"query_{int(time.time())}",  # Generate a message ID for the query
-                "content": ai_response_content,
-                "createdAt": current_utc_timestamp(),
-                "threadId": req.threadId or None,
-                "type": "ai_response",
-                "context": context,
-                "model": "gpt-4o-mini",
-                "query": query_text,
-            }
-            
-            add_document(req.userId, response_id, ai_response_embedding, ai_response_metadata)
-            logger.info(f"Stored AI response: {response_id}")
+            with timed("persist"):
+                spec = embedding_spec_for(req.userId)
+                ai_response_metadata = {
+                    "userId": req.userId,
+                    "responseId": response_id,
+                    "userMessageId": f"query_{int(time.time())}",  # Generate a message ID for the query
+                    "content": ai_response_content,
+                    "createdAt": current_utc_timestamp(),
+                    "threadId": req.threadId or None,
+                    "type": "ai_response",
+                    "context": context,
+                    "model": "gpt-4o-mini",
+                    "query": query_text,
+                    "embeddingModel": model_label(**spec),
+                }
+
+                duplicate_of = _store_document(req.userId, response_id, ai_response_metadata, spec)
+                if duplicate_of:
+                    # Nothing was stored under the new id; point the caller at the stored answer
+                    response_id = duplicate_of
+                else:
+                    logger.info("Stored AI response: %s", response_id, extra=sample())
             
         except Exception as e:
             logger.warning(f"Failed to store AI response: {e}")
@@ -311,10 +709,14 @@ async def rag_generate(req: QueryRequest = Body(...)):
         return {
             "answer": ai_response_content,
             "context": context,
-            "responseId": response_id
+            "recentMessages": len(recent_messages),
+            "rerank": rerank_outcome,
+            "responseId": response_id,
+            "duplicateOf": duplicate_of,
         }
 
     except OpenAIError as oe:
+        provider_errors.inc(operation="chat_completion")
         logger.error(f"OpenAI API error: {oe}")
         raise HTTPException(status_code=502, detail="OpenAI API error")
     except Exception as e:
@@ -323,14 +725,20 @@ async def rag_generate(req: QueryRequest = Body(...)):
 
 
 @app.post("/query", response_model=QueryResponse)
-async def query_similar_messages(req: QueryRequest) -> QueryResponse:
+async def query_similar_messages(req: QueryRequest):
+    return _orjson(await _coalesced("/query", req, _query_similar_messages))
+
+
+def _query_similar_messages(req: QueryRequest) -> Dict[str, Any]:
     try:
-        logger.info(f"Query request: userId={req.userId}, filters={req.filters}, query={req.query}")
+        logger.info("Query request: userId=%s, filters=%s, query=%s", req.userId, req.filters, req.query, extra=sample())
         query_text = req.query[0] if isinstance(req.query, list) else req.query
 
         if not isinstance(query_text, str):
             raise HTTPException(status_code=400, detail="Invalid query type")
 
+        chroma_include, fields, metadata_keys = _projection(req.include)
+
         where_filter = {}
 
         if req.threadId:
@@ -339,20 +747,11 @@ async def query_similar_messages(req: QueryRequest) -> QueryResponse:
         if req.filters:
             where_filter.update(req.filters)
 
-        query_embedding = generate_embedding(query_text)
+        query_embedding = generate_embedding(query_text, **embedding_spec_for(req.userId))
 
-        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=5)
-
-        documents = results.get("documents", [[]])[0]
-        metadatas = results.get("metadatas", [[]])[0]
-        distances = results.get("distances", [[]])[0]
-
-        matches = [
-            QueryMatch(content=doc, score=1 - dist, metadata=meta)
-            for doc, meta, dist in zip(documents, metadatas, distances)
-        ]
-
-        return QueryResponse(matches=matches)
+        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=5,
+                                           include=chroma_include, **_time_options(req))
+        return _build_matches(results, fields, metadata_keys)
 
     except HTTPException:
         raise
@@ -362,17 +761,23 @@ async def query_similar_messages(req: QueryRequest) -> QueryResponse:
 
 
 @app.post("/query-ai-responses", response_model=QueryResponse)
-async def query_ai_responses(req: QueryRequest) -> QueryResponse:
+async def query_ai_responses(req: QueryRequest):
     """
     Query specifically for AI responses in the user's history
     """
+    return _orjson(await _coalesced("/query-ai-responses", req, _query_ai_responses))
+
+
+def _query_ai_responses(req: QueryRequest) -> Dict[str, Any]:
     try:
-        logger.info(f"Query AI responses: userId={req.userId}, filters={req.filters}, query={req.query}")
+        logger.info("Query AI responses: userId=%s, filters=%s, query=%s", req.userId, req.filters, req.query, extra=sample())
         query_text = req.query[0] if isinstance(req.query, list) else req.query
 
         if not isinstance(query_text, str):
             raise HTTPException(status_code=400, detail="Invalid query type")
 
+        chroma_include, fields, metadata_keys = _projection(req.include)
+
         where_filter = {"type": "ai_response"}  # Only search AI responses
 
         if req.threadId:
@@ -381,20 +786,11 @@ async def query_ai_responses(req: QueryRequest) -> QueryResponse:
         if req.filters:
             where_filter.update(req.filters)
 
-        query_embedding = generate_embedding(query_text)
+        query_embedding = generate_embedding(query_text, **embedding_spec_for(req.userId))
 
-        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=5)
-
-        documents = results.get("documents", [[]])[0]
-        metadatas = results.get("metadatas", [[]])[0]
-        distances = results.get("distances", [[]])[0]
-
-        matches = [
-            QueryMatch(content=doc, score=1 - dist, metadata=meta)
-            for doc, meta, dist in zip(documents, metadatas, distances)
-        ]
-
-        return QueryResponse(matches=matches)
+        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=5,
+                                           include=chroma_include, **_time_options(req))
+        return _build_matches(results, fields, metadata_keys)
 
     except HTTPException:
         raise
@@ -404,17 +800,23 @@ async def query_ai_responses(req: QueryRequest) -> QueryResponse:
 
 
 @app.post("/query-user-messages", response_model=QueryResponse)
-async def query_user_messages(req: QueryRequest) -> QueryResponse:
+async def query_user_messages(req: QueryRequest):
     """
     Query specifically for user messages (excluding AI responses)
     """
+    return _orjson(await _coalesced("/query-user-messages", req, _query_user_messages))
+
+
+def _query_user_messages(req: QueryRequest) -> Dict[str, Any]:
     try:
-        logger.info(f"Query user messages: userId={req.userId}, filters={req.filters}, query={req.query}")
+        logger.info("Query user messages: userId=%s, filters=%s, query=%s", req.userId, req.filters, req.query, extra=sample())
         query_text = req.query[0] if isinstance(req.query, list) else req.query
 
         if not isinstance(query_text, str):
             raise HTTPException(status_code=400, detail="Invalid query type")
 
+        chroma_include, fields, metadata_keys = _projection(req.include)
+
         # For ChromaDB, we'll query for user_message type specifically
         where_filter = {"type": "user_message"}
 
@@ -424,38 +826,245 @@ async def query_user_messages(req: QueryRequest) -> QueryResponse:
         if req.filters:
             where_filter.update(req.filters)
 
-        query_embedding = generate_embedding(query_text)
+        query_embedding = generate_embedding(query_text, **embedding_spec_for(req.userId))
 
-        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=5)
+        results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=5,
+                                           include=chroma_include, **_time_options(req))
+        return _build_matches(results, fields, metadata_keys)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Unhandled error in query user messages endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to query user messages")
 
-        documents = results.get("documents", [[]])[0]
-        metadatas = results.get("metadatas", [[]])[0]
-        distances = results.get("distances", [[]])[0]
 
-        matches = [
-            QueryMatch(content=doc, score=1 - dist, metadata=meta)
-            for doc, meta, dist in zip(documents, metadatas, distances)
-        ]
+@app.post("/query-grouped", response_model=GroupedQueryResponse)
+async def query_grouped(req: GroupedQueryRequest):
+    """
+    Top-k matches per document type (and optionally per thread) from one embedding and one search
+    """
+    return _orjson(await _coalesced("/query-grouped", req, _query_grouped, req.types, req.topK, req.groupByThread))
 
-        return QueryResponse(matches=matches)
+
+def _hits(results: Dict[str, Any]) -> List[tuple]:
+    """
+    (id, document, distance, metadata) rows of a single-query result.
+    """
+    ids = results["ids"][0]
+    documents = results["documents"][0] if results.get("documents") else [None] * len(ids)
+    return list(zip(ids, documents, results["distances"][0], results["metadatas"][0]))
+
+
+def _query_grouped(req: GroupedQueryRequest, types: List[str], top_k: int, group_by_thread: bool) -> Dict[str, Any]:
+    try:
+        logger.info("Grouped query: userId=%s, types=%s, filters=%s, query=%s", req.userId, types, req.filters, req.query, extra=sample())
+        query_text = req.query[0] if isinstance(req.query, list) else req.query
+
+        if not isinstance(query_text, str):
+            raise HTTPException(status_code=400, detail="Invalid query type")
+        if req.filters and "type" in req.filters:
+            raise HTTPException(status_code=400, detail="Use types instead of a type filter")
+
+        chroma_include, fields, metadata_keys = _projection(req.include)
+        # Grouping needs the type and threadId of every candidate
+        chroma_include = sorted(set(chroma_include) | {"metadatas", "distances"})
+
+        where_filter = {"type": {"$in": types} if len(types) > 1 else types[0]}
+        if req.threadId:
+            where_filter["threadId"] = req.threadId
+        if req.filters:
+            where_filter.update(req.filters)
+
+        query_embedding = generate_embedding(query_text, **embedding_spec_for(req.userId))
+        total = collection_size(req.userId)
+        wanted = top_k * len(types)
+        fetch = min(wanted * GROUPED_OVERFETCH, total, GROUPED_MAX_CANDIDATES)
+
+        # Over-fetch until every type has top_k matches or the collection is exhausted
+        while True:
+            results = query_similar_any_thread(req.userId, query_embedding, metadata_filter=where_filter, top_k=max(fetch, 1),
+                                               include=chroma_include, **_time_options(req))
+            metadatas = results["metadatas"][0]
+            counts = {doc_type: 0 for doc_type in types}
+            for meta in metadatas:
+                doc_type = (meta or {}).get("type")
+                if doc_type in counts:
+                    counts[doc_type] += 1
+            short = [doc_type for doc_type, count in counts.items() if count < top_k]
+            if not short or fetch >= total or len(metadatas) < fetch or fetch >= GROUPED_MAX_CANDIDATES:
+                break
+            fetch = min(fetch * 2, total, GROUPED_MAX_CANDIDATES)
+
+        candidates = len(metadatas)
+        hits = _hits(results)
+        # Types the shared search could not fill within GROUPED_MAX_CANDIDATES get their own search
+        if short and fetch >= GROUPED_MAX_CANDIDATES and len(metadatas) == fetch:
+            fetched = {hit[0] for hit in hits}
+            for doc_type in short:
+                extra = query_similar_any_thread(req.userId, query_embedding, metadata_filter={**where_filter, "type": doc_type},
+                                                 top_k=top_k, include=chroma_include, **_time_options(req))
+                candidates += len(extra["ids"][0])
+                hits.extend(hit for hit in _hits(extra) if hit[0] not in fetched)
+
+        groups: Dict[str, Any] = {doc_type: {} if group_by_thread else [] for doc_type in types}
+        seen: Dict[str, int] = {doc_type: 0 for doc_type in types}
+        with timed("post_filter"):
+            for _, document, distance, meta in sorted(hits, key=lambda hit: hit[2]):
+                doc_type = (meta or {}).get("type")
+                if doc_type not in groups or (not group_by_thread and seen[doc_type] >= top_k):
+                    continue
+                match = _project_match({}, document, 1 - distance, meta, fields, metadata_keys)
+                if group_by_thread:
+                    thread = groups[doc_type].setdefault(str(meta.get("threadId")), [])
+                    if len(thread) < top_k:
+                        thread.append(match)
+                else:
+                    groups[doc_type].append(match)
+                    seen[doc_type] += 1
+        return {"status": "success", "groups": groups, "candidates": candidates}
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception(f"Unhandled error in query user messages endpoint: {e}")
-        raise HTTPException(status_code=500, detail="Failed to query user messages")
+        logger.exception(f"Unhandled error in grouped query endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to query groups")
+
+
+@app.post("/query-multi", response_model=MultiUserQueryResponse)
+async def query_multiple_users(req: MultiUserQueryRequest):
+    """
+    Search several users' collections (userIds and/or a group) in parallel and
+    return the global top-k; collections missing the deadline are reported, not awaited
+    """
+    annotate_request(user_id=req.callerId, query=req.query)
+    try:
+        user_ids = scatter.resolve_users(req.userIds, req.group)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    chroma_include, fields, metadata_keys = _projection(req.include)
+    caller = req.callerId or (f"group:{req.group}" if req.group else user_ids[0])
+    key = make_key("/query-multi", user_ids, req.query, req.filters, req.topK, req.timeoutMs, req.include,
+                   req.since, req.until)
+    with user_limiter.admit(caller):
+        return _orjson(await query_flight.do(key, lambda: run_in_threadpool(
+            _query_multiple_users, req, user_ids, chroma_include, fields, metadata_keys)))
+
+
+def _query_multiple_users(req: MultiUserQueryRequest, user_ids: List[str], chroma_include: List[str],
+                          fields: set, metadata_keys: Optional[set]) -> Dict[str, Any]:
+    try:
+        # Unknown users are reported rather than given an empty collection
+        existing = users_with_collection(user_ids)
+        missing = sorted(set(user_ids) - set(existing))
+        # One query embedding per embedding model in use among the users
+        embeddings: Dict[str, List[float]] = {}
+        by_spec: Dict[tuple, List[float]] = {}
+        for user_id in existing:
+            spec = embedding_spec_for(user_id)
+            key = (spec["model"], spec["dimensions"])
+            if key not in by_spec:
+                by_spec[key] = generate_embedding(req.query, **spec)
+            embeddings[user_id] = by_spec[key]
+
+        with timed("scatter_gather"):
+            merged = scatter.scatter_search(
+                embeddings,
+                req.topK,
+                timeout_ms=req.timeoutMs or scatter.SCATTER_TIMEOUT_MS,
+                metadata_filter=req.filters,
+                include=sorted(set(chroma_include) | {"distances"}),
+                since=to_epoch(req.since),
+                until=to_epoch(req.until),
+            )
+
+        matches = [
+            _project_match({"userId": hit["userId"], "id": hit["id"]}, hit["document"], hit["score"],
+                           hit["metadata"], fields, metadata_keys)
+            for hit in merged["hits"]
+        ]
+        return {
+            "status": "success",
+            "matches": matches,
+            "partial": bool(merged["timedOut"] or merged["failed"]),
+            "searched": merged["searched"],
+            "timedOut": merged["timedOut"],
+            "failed": merged["failed"],
+            "missing": missing,
+        }
+    except Exception as e:
+        logger.exception(f"Unhandled error in multi-user query endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to query users")
+
+
+# Scrape-time gauges for component state; nothing is computed between scrapes
+REGISTRY.register(GaugeCallback(
+    "eoxs_result_cache_entries", "Entries in the retrieval-result cache", [],
+    lambda: {(): result_cache.stats()["size"]}))
+REGISTRY.register(GaugeCallback(
+    "eoxs_result_cache_hit_ratio", "Hit ratio of the retrieval-result cache", [],
+    lambda: {(): result_cache.stats()["hitRate"]}))
+REGISTRY.register(GaugeCallback(
+    "eoxs_coalesced_requests", "Requests served by an identical in-flight computation", ["endpoint"],
+    lambda: {(endpoint,): counts["coalesced"] for endpoint, counts in query_flight.stats()["byEndpoint"].items()}))
+REGISTRY.register(GaugeCallback(
+    "eoxs_monitoring_buffered_events", "Monitoring events waiting to be written", [],
+    lambda: {(): monitoring.event_buffer.stats()["buffered"]}))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus text-format metrics: per-stage timers, provider tokens, result counts and cache hits
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
+    """
+    Liveness: the process is up and serving the event loop
+    """
     return {"status": "ok"}
 
 
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Readiness: clients are initialized and the optional warm-up has finished
+    """
+    if readiness["status"] != "ready":
+        return JSONResponse(status_code=503, content=readiness)
+    return readiness
+
+
+@app.get("/threads/{thread_id}/recent")
+async def get_recent_thread_messages(thread_id: str, user_id: str, limit: int = 20, cursor: str = None,
+                                     type: str = None):
+    """
+    Get a thread's messages newest first from the ordered thread log.
+    Pass the returned next_cursor to fetch older messages; type filters by message type.
+    """
+    annotate_request(user_id=user_id, thread_id=thread_id)
+    with user_limiter.admit(user_id):
+        try:
+            types = [item.strip() for item in type.split(",") if item.strip()] if type else None
+            messages, next_cursor = await run_in_threadpool(thread_log.recent, user_id, thread_id, limit, cursor, types)
+            return {"messages": messages, "count": len(messages), "next_cursor": next_cursor}
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error fetching thread messages: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Failed to fetch thread messages")
+
+
 @app.get("/debug-docs/{user_id}")
 async def debug_docs(user_id: str):
     try:
         collection = get_or_create_collection(user_id)
-        results = collection.query(query_embeddings=None, n_results=10)
+        # A plain read of the first rows; a query without an embedding is not a scan
+        results = await run_in_threadpool(collection.get, limit=10, include=["documents", "metadatas"])
         return results
     except Exception as e:
         logger.error(f"Error fetching debug docs: {e}", exc_info=True)
@@ -463,57 +1072,278 @@ async def debug_docs(user_id: str):
 
 
 @app.get("/monitoring/stats")
-async def get_monitoring_stats(endpoint: str = None, user_id: str = None, limit: int = 100):
+async def get_monitoring_stats(endpoint: str = None, user_id: str = None, limit: int = 100,
+                               cursor: str = None, fields: str = None):
     """
-    Get API call statistics from MongoDB
+    Get API call statistics from MongoDB, newest first.
+    Pass the returned next_cursor to fetch the following page; fields is a comma-separated projection.
     """
     try:
-        stats = get_api_stats(endpoint=endpoint, user_id=user_id, limit=limit)
-        return {"stats": stats, "count": len(stats)}
+        field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        stats, next_cursor = await run_in_threadpool(
+            get_api_stats, endpoint=endpoint, user_id=user_id, limit=limit, cursor=cursor, fields=field_list
+        )
+        return {"stats": stats, "count": len(stats), "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching monitoring stats: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch monitoring stats")
 
 
 @app.get("/monitoring/latency")
-async def get_latency_stats(endpoint: str = None, user_id: str = None):
+async def get_latency_stats(endpoint: str = None, user_id: str = None,
+                            since: Optional[datetime] = None, until: Optional[datetime] = None):
     """
-    Get average latency statistics from MongoDB
+    Get latency statistics. Percentiles come from the per-minute rollups;
+    per-user averages still aggregate the raw latency collection.
     """
     try:
-        latency_stats = get_average_latency(endpoint=endpoint, user_id=user_id)
+        if user_id:
+            latency_stats = get_average_latency(endpoint=endpoint, user_id=user_id)
+        else:
+            latency_stats = get_latency_percentiles(endpoint=endpoint, since=since, until=until)
         return {"latency_stats": latency_stats}
     except Exception as e:
         logger.error(f"Error fetching latency stats: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch latency stats")
 
 
+@app.get("/monitoring/coalescing")
+async def get_coalescing_stats():
+    """
+    Get counters for query requests that were coalesced onto an in-flight computation
+    """
+    return {"coalescing": query_flight.stats()}
+
+
+@app.get("/monitoring/cache")
+async def get_cache_stats():
+    """
+    Get hit-rate statistics for the retrieval-result cache
+    """
+    return {"result_cache": result_cache.stats()}
+
+
+@app.get("/monitoring/admission")
+async def get_admission_stats():
+    """
+    Get global load-shedding state and the users rejected most often by admission control
+    """
+    return {"global": load_shedder.stats(), "users": user_limiter.stats()}
+
+
+@app.get("/monitoring/dedup")
+async def get_dedup_stats(user_id: str = None, limit: int = 20):
+    """
+    Get per-user deduplication counters and ratio (one user, or the highest ratios)
+    """
+    try:
+        return {"dedup": await run_in_threadpool(deduplicator.stats, user_id, limit)}
+    except Exception as e:
+        logger.error(f"Error fetching dedup stats: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to fetch dedup stats")
+
+
+@app.get("/monitoring/retention")
+async def get_retention_stats():
+    """
+    Get retention policies and the report of the last compaction pass
+    """
+    try:
+        return {"retention": retention.compactor.stats()}
+    except Exception as e:
+        logger.error(f"Error fetching retention stats: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to fetch retention stats")
+
+
+@app.get("/monitoring/rerank")
+async def get_rerank_stats():
+    """
+    Get reranker state, per-pair cost estimate and score-cache hit rate
+    """
+    return {"rerank": reranker.stats()}
+
+
+@app.get("/monitoring/pipeline")
+async def get_pipeline_stats():
+    """
+    Get buffer and writer statistics for the batched monitoring pipeline
+    """
+    return {"pipeline": monitoring.event_buffer.stats()}
+
+
+def _require_profiling():
+    if not profiling.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (set ENABLE_PROFILING=true)")
+
+
+@app.get("/monitoring/profile/cpu")
+async def profile_cpu(seconds: float = 10.0, interval_ms: float = 10.0, include_idle: bool = False,
+                      format: str = "collapsed"):
+    """
+    Run a sampling CPU profiler for N seconds and return collapsed stacks for a flamegraph
+    """
+    _require_profiling()
+    try:
+        profile = await run_in_threadpool(profiling.sample_cpu, seconds, interval_ms, include_idle)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "json":
+        return profile
+    return PlainTextResponse(profile["collapsed"] + "\n")
+
+
+@app.get("/monitoring/profile/memory")
+async def profile_memory(seconds: float = 10.0, top: int = 25, group_by: str = "lineno"):
+    """
+    Return top allocation sites and their growth between two tracemalloc snapshots N seconds apart
+    """
+    _require_profiling()
+    try:
+        return await run_in_threadpool(profiling.allocation_diff, seconds, top, group_by)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/monitoring/endpoints")
-async def get_endpoint_summary():
+async def get_endpoint_summary(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                               stage: str = "total"):
     """
-    Get summary of all endpoints and their performance
+    Get summary of all endpoints and their performance (p50/p90/p99) over a
+    time window, served from the per-minute latency rollups (default: last hour)
     """
     try:
-        # Get all unique endpoints
-        endpoints = latency_collection.distinct("endpoint")
-        summary = {}
-        
-        for endpoint in endpoints:
-            stats = get_average_latency(endpoint=endpoint)
-            if stats:
-                summary[endpoint] = {
-                    "avgLatency": round(stats["avgLatency"], 2),
-                    "count": stats["count"],
-                    "minLatency": stats["minLatency"],
-                    "maxLatency": stats["maxLatency"]
-                }
-        
+        summary = get_latency_percentiles(stage=stage, since=since, until=until)
         return {"endpoint_summary": summary}
     except Exception as e:
         logger.error(f"Error fetching endpoint summary: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch endpoint summary")
 
 
+@app.post("/admin/migrations", status_code=202)
+async def start_embedding_migration(req: MigrationRequest):
+    """
+    Start re-embedding users' collections with a new model into shadow collections;
+    each user is switched over once counts and sampled recall check out
+    """
+    options = {
+        key: value for key, value in (
+            ("batch_size", req.batchSize), ("max_docs_per_sec", req.maxDocsPerSec), ("min_recall", req.minRecall),
+        ) if value is not None
+    }
+    try:
+        job = await run_in_threadpool(migration.start_migration, req.userIds, req.model, req.dimensions, **options)
+    except migration.MigrationRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"migration": job.stats()}
+
+
+@app.get("/admin/migrations")
+async def get_embedding_migration():
+    """
+    Get progress and ETA of the current (or last) embedding migration
+    """
+    job = migration.current_migration()
+    return {"migration": job.stats() if job else None}
+
+
+@app.post("/admin/migrations/cancel")
+async def cancel_embedding_migration():
+    """
+    Stop the running migration; users not yet switched keep their current collection
+    """
+    job = migration.current_migration()
+    if job is None or not job.running:
+        raise HTTPException(status_code=404, detail="No migration is running")
+    job.cancel()
+    return {"migration": job.stats()}
+
+
+@app.get("/admin/routes/{user_id}")
+async def get_user_route(user_id: str):
+    """
+    Get the collection and embedding model serving a user
+    """
+    return {"userId": user_id, "route": get_route(user_id)}
+
+
+@app.post("/admin/retention/run")
+async def run_retention(user_id: str = None):
+    """
+    Run a retention pass now (all users, or one) and return what was reclaimed
+    """
+    try:
+        report = await run_in_threadpool(retention.compactor.run_once, [user_id] if user_id else None)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Retention pass failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Retention pass failed")
+    return {"retention": report}
+
+
+@app.get("/admin/export/{user_id}")
+async def export_user_memory(user_id: str, page_size: int = export.EXPORT_PAGE_SIZE, include_context: bool = True):
+    """
+    Stream a user's documents and vectors as a tar of NDJSON and float32 .npy parts
+    """
+    if page_size < 1:
+        raise HTTPException(status_code=400, detail="page_size must be positive")
+    return StreamingResponse(
+        export.iter_export_tar(user_id, page_size, include_context),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{user_id}-memory.tar"'},
+    )
+
+
+@app.post("/admin/import/{user_id}")
+async def import_user_memory(user_id: str, request: Request, force: bool = False):
+    """
+    Import an export tar (request body) into a user's collection
+    """
+    # Spooled to disk past 64 MB; the tar is then read sequentially in the threadpool
+    body = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+    try:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        return {"import": await run_in_threadpool(export.import_stream, user_id, body, force)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Import failed for user {user_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Import failed")
+    finally:
+        body.close()
+
+
+@app.post("/admin/snapshots")
+async def create_snapshot():
+    """
+    Take an online snapshot of the persist directory; returns its manifest with duration and size
+    """
+    try:
+        return {"snapshot": await run_in_threadpool(snapshot.create_snapshot)}
+    except snapshot.SnapshotRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Snapshot failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Snapshot failed")
+
+
+@app.get("/admin/snapshots")
+async def get_snapshots():
+    """
+    List the snapshots in SNAPSHOT_PATH, newest first
+    """
+    return {"snapshots": await run_in_threadpool(snapshot.list_snapshots)}
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT"))
@@ -0,0 +1,64 @@
+"""
+Adds the numeric createdAtTs field (epoch seconds, see db.compact_metadata) to
+documents written before it existed, so since/until filters can match them.
+
+ChromaDB merges metadata on update, so only the new key is written and
+existing vectors are untouched. Safe to re-run.
+
+Run it while the service is stopped: a Chroma persist directory must only
+have one writing process, and a running service would keep serving cached
+query results that predate the backfill.
+
+    python backfill_timestamps.py [--collection user_<id>_collection]
+"""
+import time
+import argparse
+from typing import Dict
+import db
+from logging_config import setup_logging
+from utils import to_epoch
+
+# Initialize logger
+logger = setup_logging("backfill_timestamps")
+
+
+def backfill_collection(collection, batch_size: int) -> Dict[str, int]:
+    ids = collection.get(include=[])["ids"]
+    updated, unparseable = 0, 0
+    for start in range(0, len(ids), batch_size):
+        page = collection.get(ids=ids[start:start + batch_size], include=["metadatas"])
+        batch_ids, batch_metadatas = [], []
+        for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+            if not metadata or "createdAtTs" in metadata:
+                continue
+            created_ts = to_epoch(metadata.get("createdAt"))
+            if created_ts is None:
+                unparseable += 1
+                continue
+            batch_ids.append(doc_id)
+            batch_metadatas.append({"createdAtTs": created_ts})
+        if batch_ids:
+            collection.update(ids=batch_ids, metadatas=batch_metadatas)
+            updated += len(batch_ids)
+    return {"documents": len(ids), "updated": updated, "unparseable": unparseable}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill createdAtTs on existing documents")
+    parser.add_argument("--collection", action="append", help="Collection to backfill (default: all)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents updated per batch")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    names = args.collection or [collection.name for collection in db.get_client().list_collections()]
+    totals = {"documents": 0, "updated": 0, "unparseable": 0}
+    for name in names:
+        result = backfill_collection(db.get_client().get_collection(name), args.batch_size)
+        logger.info("Backfilled %s: %s", name, result)
+        for key, value in result.items():
+            totals[key] += value
+    logger.info("Backfill finished: %s collections, %s (%.1fs)", len(names), totals, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
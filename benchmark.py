@@ -0,0 +1,432 @@
+"""
+Offline retrieval benchmark.
+
+Generates a deterministic corpus per size, embeds it with the fake provider
+(embedding.EMBEDDING_PROVIDER=fake, 3072-dim like text-embedding-3-large),
+ingests it through db.add_documents and measures:
+
+    ingest       docs/sec, split into embedding and upsert time
+    latency      p50/p95/p99 of db.query_similar_any_thread per top_k and
+                 filter selectivity (fraction of the corpus the filter keeps)
+    memory       disk and RSS growth per vector, next to the raw vector size
+    recall       overlap of the returned ids with an exact numpy search
+
+Results are written as JSON together with the git commit, so runs on
+different commits can be compared (--baseline prints the differences).
+
+    python benchmark.py                                  # 1k and 10k documents
+    python benchmark.py --sizes 1k,10k,100k,1m --queries 200
+    python benchmark.py --baseline benchmark_results/<earlier run>.json
+
+The data directory is wiped at the start of every run; it must be empty or
+a directory created by an earlier run.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+BENCHMARK_DATA_PATH = os.getenv("BENCHMARK_DATA_PATH", "./benchmark_data")
+BENCHMARK_RESULTS_PATH = os.getenv("BENCHMARK_RESULTS_PATH", "./benchmark_results")
+
+# Never touch the service's data or call the provider: the modules below read these on import
+os.environ["CHROMA_PERSIST_PATH"] = BENCHMARK_DATA_PATH
+os.environ["EMBEDDING_PROVIDER"] = "fake"
+for _name in ("COLLECTION_ROUTES_PATH", "BLOB_STORE_PATH"):
+    os.environ.pop(_name, None)
+
+import numpy as np  # noqa: E402
+import chromadb  # noqa: E402
+import db  # noqa: E402
+from embedding import generate_embeddings, model_label, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, NATIVE_DIMENSIONS  # noqa: E402
+from logging_config import setup_logging  # noqa: E402
+
+# Initialize logger
+logger = setup_logging("benchmark")
+
+MARKER_NAME = ".benchmark"
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+TOP_KS = [1, 5, 10, 50]
+# Fraction of the corpus a query filter keeps (1.0 = no filter)
+SELECTIVITIES = [1.0, 0.1, 0.01]
+BUCKETS = 100
+TOPICS = 200
+WORDS_PER_TOPIC = 40
+COMMON_WORDS = 300
+THREADS_PER_USER = 500
+
+
+class Corpus:
+    """
+    Deterministic synthetic messages: each belongs to a topic (Zipf-distributed)
+    and mixes topic words with common words, so embeddings form clusters the
+    way real conversations do. Every document gets a bucket in [0, BUCKETS)
+    used for filters of known selectivity.
+    """
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        weights = 1.0 / np.arange(1, TOPICS + 1)
+        self.topic_weights = weights / weights.sum()
+
+    def _texts(self, rng: np.random.Generator, count: int) -> List[str]:
+        topics = rng.choice(TOPICS, size=count, p=self.topic_weights)
+        lengths = rng.integers(8, 17, size=count)
+        texts = []
+        for topic, length in zip(topics, lengths):
+            topical = rng.random(length) < 0.7
+            words = [
+                f"t{topic}w{rng.integers(WORDS_PER_TOPIC)}" if is_topical else f"c{rng.integers(COMMON_WORDS)}"
+                for is_topical in topical
+            ]
+            texts.append(" ".join(words))
+        return texts
+
+    def documents(self, size: int, batch_size: int):
+        """
+        Yields (ids, texts, metadatas, buckets) batches of a corpus of the given size.
+        """
+        rng = np.random.default_rng([self.seed, size])
+        start = datetime(2025, 1, 1)
+        for offset in range(0, size, batch_size):
+            count = min(batch_size, size - offset)
+            texts = self._texts(rng, count)
+            buckets = rng.integers(BUCKETS, size=count)
+            threads = rng.integers(THREADS_PER_USER, size=count)
+            ages = rng.integers(365 * 86400, size=count)
+            types = np.where(rng.random(count) < 0.8, "user_message", "ai_response")
+            ids = [f"doc_{offset + i}" for i in range(count)]
+            metadatas = [
+                {
+                    "content": texts[i],
+                    "type": str(types[i]),
+                    "threadId": f"thread_{threads[i]}",
+                    "createdAt": (start + timedelta(seconds=int(ages[i]))).isoformat() + "Z",
+                    "bucket": int(buckets[i]),
+                }
+                for i in range(count)
+            ]
+            yield ids, texts, metadatas, buckets
+
+    def queries(self, count: int) -> List[str]:
+        return self._texts(np.random.default_rng([self.seed, 0]), count)
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # Peak rather than current RSS where /proc is unavailable (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _percentiles(latencies_ms: List[float]) -> Dict[str, float]:
+    values = np.asarray(latencies_ms)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3), "mean": round(values.mean(), 3)}
+
+
+def _filter_for(selectivity: float) -> Optional[Dict[str, Any]]:
+    if selectivity >= 1.0:
+        return None
+    return {"bucket": {"$lt": max(int(round(selectivity * BUCKETS)), 1)}}
+
+
+def ingest(user_id: str, corpus: Corpus, size: int, batch_size: int, vectors_path: Optional[str],
+           dimensions: int) -> Tuple[Dict[str, Any], np.ndarray, Optional[np.memmap]]:
+    """
+    Embeds and upserts the corpus. Returns the ingest stats, the bucket of every
+    document and (for recall) a memmap of all vectors in insertion order.
+    """
+    vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32,
+                                        shape=(size, dimensions)) if vectors_path else None
+    buckets = np.empty(size, dtype=np.int16)
+    # Embedded and labelled like /embed does, with the model of the user's collection
+    spec = db.embedding_spec_for(user_id)
+    label = model_label(**spec)
+    embed_seconds = upsert_seconds = 0.0
+    done = 0
+    start = time.perf_counter()
+    for ids, texts, metadatas, batch_buckets in corpus.documents(size, batch_size):
+        for metadata in metadatas:
+            metadata["embeddingModel"] = label
+        embed_start = time.perf_counter()
+        embeddings = generate_embeddings(texts, use_cache=False, **spec)
+        upsert_start = time.perf_counter()
+        db.add_documents(user_id, ids, embeddings, metadatas)
+        upsert_seconds += time.perf_counter() - upsert_start
+        embed_seconds += upsert_start - embed_start
+        if vectors is not None:
+            vectors[done:done + len(ids)] = embeddings
+        buckets[done:done + len(ids)] = batch_buckets
+        done += len(ids)
+        if done % max(size // 10, batch_size) < batch_size:
+            logger.info("Ingested %d/%d documents (%.0f docs/sec)", done, size, done / (time.perf_counter() - start))
+    elapsed = time.perf_counter() - start
+    if vectors is not None:
+        vectors.flush()
+    stats = {
+        "documents": done,
+        "seconds": round(elapsed, 2),
+        "docsPerSec": round(done / elapsed, 1),
+        "embedSeconds": round(embed_seconds, 2),
+        "upsertSeconds": round(upsert_seconds, 2),
+        "upsertDocsPerSec": round(done / upsert_seconds, 1) if upsert_seconds else None,
+    }
+    return stats, buckets, vectors
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, mask: Optional[np.ndarray], k: int,
+                chunk_size: int = 65536) -> List[List[int]]:
+    """
+    Exact nearest neighbours by inner product (the vectors are unit length, so
+    this is the L2 and cosine order), scanning vectors in chunks to bound memory.
+    """
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        scores = queries @ np.asarray(vectors[start:start + chunk_size]).T
+        if mask is not None:
+            scores[:, ~mask[start:start + chunk_size]] = -np.inf
+        ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_ids = np.concatenate([best_ids, ids], axis=1)
+        if best_scores.shape[1] > k:
+            keep = np.argpartition(-best_scores, k, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    return [
+        [int(doc) for doc, score in zip(ids, scores) if score > -np.inf]
+        for ids, scores in zip(np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_scores, order, axis=1))
+    ]
+
+
+def measure_queries(user_id: str, query_vectors: List[List[float]], vectors: Optional[np.ndarray],
+                    buckets: np.ndarray, recall_queries: int) -> List[Dict[str, Any]]:
+    """
+    Latency percentiles and recall@k for every (selectivity, top_k) cell. Each
+    cell uses its own slice of queries, so the result cache never answers.
+    """
+    cells = []
+    per_cell = len(query_vectors) // (len(SELECTIVITIES) * len(TOP_KS))
+    max_k = max(TOP_KS)
+    cell_number = 0
+    for selectivity in SELECTIVITIES:
+        query_filter = _filter_for(selectivity)
+        mask = None if query_filter is None else buckets < query_filter["bucket"]["$lt"]
+        for top_k in TOP_KS:
+            cell_queries = query_vectors[cell_number * per_cell:(cell_number + 1) * per_cell]
+            cell_number += 1
+            latencies, returned = [], []
+            for query_vector in cell_queries:
+                start = time.perf_counter()
+                results = db.query_similar_any_thread(user_id, query_vector, metadata_filter=query_filter, top_k=top_k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                returned.append([int(doc_id.split("_")[1]) for doc_id in results["ids"][0]])
+            cell = {
+                "selectivity": selectivity,
+                "matching": int(mask.sum()) if mask is not None else len(buckets),
+                "topK": top_k,
+                "queries": len(cell_queries),
+                "latencyMs": _percentiles(latencies),
+            }
+            sample = min(recall_queries, len(cell_queries))
+            if vectors is not None and sample:
+                exact = exact_top_k(vectors, np.asarray(cell_queries[:sample], dtype=np.float32), mask, max(top_k, 1))
+                recalls = [len(set(found) & set(expected[:top_k])) / len(expected[:top_k])
+                           for found, expected in zip(returned, exact) if expected]
+                cell["recall"] = round(float(np.mean(recalls)), 4) if recalls else None
+            cells.append(cell)
+            logger.info("selectivity=%s top_k=%d: p50 %.2fms p95 %.2fms p99 %.2fms recall %s", selectivity, top_k,
+                        cell["latencyMs"]["p50"], cell["latencyMs"]["p95"], cell["latencyMs"]["p99"], cell.get("recall"))
+    return cells
+
+
+def run_size(label: str, size: int, corpus: Corpus, args: argparse.Namespace, dimensions: int) -> Dict[str, Any]:
+    user_id = f"bench_{label}"
+    logger.info("Benchmarking %s documents (%s)", label, user_id)
+    disk_before, rss_before = _directory_size(BENCHMARK_DATA_PATH), _rss_bytes()
+    vectors_path = os.path.join(BENCHMARK_DATA_PATH, f"{user_id}.vectors.npy") if args.recall_queries else None
+    ingest_stats, buckets, vectors = ingest(user_id, corpus, size, args.batch_size, vectors_path, dimensions)
+    disk_after = _directory_size(BENCHMARK_DATA_PATH) - (os.path.getsize(vectors_path) if vectors_path else 0)
+
+    query_count = args.queries * len(SELECTIVITIES) * len(TOP_KS)
+    query_vectors = generate_embeddings(corpus.queries(query_count + 1), use_cache=False, **db.embedding_spec_for(user_id))
+    # The first query loads the index; it is reported apart from the percentiles
+    start = time.perf_counter()
+    db.query_similar_any_thread(user_id, query_vectors.pop(), top_k=1)
+    cold_ms = (time.perf_counter() - start) * 1000
+    rss_after = _rss_bytes()
+
+    cells = measure_queries(user_id, query_vectors, vectors, buckets, args.recall_queries)
+    result = {
+        "size": size,
+        "userId": user_id,
+        "ingest": ingest_stats,
+        "coldQueryMs": round(cold_ms, 2),
+        "memory": {
+            "rawBytesPerVector": dimensions * 4,
+            "diskBytes": disk_after - disk_before,
+            "diskBytesPerVector": round((disk_after - disk_before) / size, 1),
+            "rssGrowthBytes": rss_after - rss_before,
+            "rssBytesPerVector": round((rss_after - rss_before) / size, 1),
+        },
+        "queries": cells,
+    }
+    if vectors is not None:
+        del vectors
+        os.remove(vectors_path)
+    return result
+
+
+def git_info() -> Dict[str, Any]:
+    def git(*command: str) -> Optional[str]:
+        try:
+            return subprocess.run(["git", *command], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+            "dirty": bool(status) if status is not None else None}
+
+
+def _prepare_data_path(path: str) -> None:
+    if os.path.isdir(path) and os.listdir(path):
+        if not os.path.exists(os.path.join(path, MARKER_NAME)):
+            raise SystemExit(f"{path} is not empty and was not created by benchmark.py; refusing to wipe it")
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+    open(os.path.join(path, MARKER_NAME), "w").close()
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Lines describing metrics that moved by more than threshold (relative) against baseline.
+    """
+    lines = []
+
+    def check(name: str, current: Optional[float], previous: Optional[float], higher_is_better: bool) -> None:
+        if current is None or not previous:
+            return
+        change = (current - previous) / previous
+        if abs(change) > threshold:
+            better = (change > 0) == higher_is_better
+            lines.append(f"{'improved' if better else 'REGRESSED'} {name}: {previous} -> {current} ({change:+.1%})")
+
+    previous_runs = {run["size"]: run for run in baseline.get("runs", [])}
+    for run in result["runs"]:
+        previous = previous_runs.get(run["size"])
+        if previous is None:
+            continue
+        size = run["size"]
+        check(f"{size} docs ingest docs/sec", run["ingest"]["docsPerSec"], previous["ingest"]["docsPerSec"], True)
+        check(f"{size} docs disk bytes/vector", run["memory"]["diskBytesPerVector"],
+              previous["memory"]["diskBytesPerVector"], False)
+        previous_cells = {(cell["selectivity"], cell["topK"]): cell for cell in previous["queries"]}
+        for cell in run["queries"]:
+            old = previous_cells.get((cell["selectivity"], cell["topK"]))
+            if old is None:
+                continue
+            name = f"{size} docs selectivity={cell['selectivity']} top_k={cell['topK']}"
+            check(f"{name} p95 ms", cell["latencyMs"]["p95"], old["latencyMs"]["p95"], False)
+            check(f"{name} recall", cell.get("recall"), old.get("recall"), True)
+    return lines
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    labels = [label.strip().lower() for label in args.sizes.split(",") if label.strip()]
+    unknown = [label for label in labels if label not in SIZES]
+    if unknown:
+        raise SystemExit(f"Unknown sizes {unknown}; choose from {', '.join(SIZES)}")
+    _prepare_data_path(BENCHMARK_DATA_PATH)
+    # Open the client up front so its start-up is not counted as memory of the first corpus
+    db.get_client()
+    dimensions = EMBEDDING_DIMENSIONS or NATIVE_DIMENSIONS.get(EMBEDDING_MODEL, 1536)
+    corpus = Corpus(args.seed)
+    started_at = datetime.utcnow()
+
+    result = {
+        "benchmark": "retrieval",
+        "version": 1,
+        "startedAt": started_at.isoformat() + "Z",
+        "git": git_info(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "chromadb": chromadb.__version__,
+            "numpy": np.__version__,
+        },
+        "config": {
+            "embeddingModel": model_label(),
+            "dimensions": dimensions,
+            "seed": args.seed,
+            "batchSize": args.batch_size,
+            "queriesPerCell": args.queries,
+            "recallQueries": args.recall_queries,
+            "topKs": TOP_KS,
+            "selectivities": SELECTIVITIES,
+        },
+        "runs": [run_size(label, SIZES[label], corpus, args, dimensions) for label in labels],
+    }
+    result["durationSeconds"] = round((datetime.utcnow() - started_at).total_seconds(), 1)
+
+    output = args.output
+    if not output:
+        commit = (result["git"]["commit"] or "nogit")[:10]
+        output = os.path.join(BENCHMARK_RESULTS_PATH, f"{started_at.strftime('%Y%m%dT%H%M%SZ')}-{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    logger.info("Benchmark results written to %s", output)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        lines = compare(result, baseline, args.threshold)
+        logger.info("Compared with %s (%s): %s", args.baseline, (baseline.get("git") or {}).get("commit"),
+                    "no change above threshold" if not lines else f"{len(lines)} changes")
+        for line in lines:
+            logger.info(line)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark with a deterministic fake embedder")
+    parser.add_argument("--sizes", default="1k,10k", help=f"Corpus sizes per user, from {', '.join(SIZES)}")
+    parser.add_argument("--queries", type=int, default=100, help="Timed queries per (selectivity, top_k) cell")
+    parser.add_argument("--recall-queries", type=int, default=20,
+                        help="Queries per cell checked against exact search (0 disables recall)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per embedding call and upsert")
+    parser.add_argument("--seed", type=int, default=42, help="Corpus and query seed")
+    parser.add_argument("--output", help="Result file (default: BENCHMARK_RESULTS_PATH/<time>-<commit>.json)")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported by --baseline")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import zlib
+import hashlib
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+from logging_config import setup_logging
+from result_cache import VersionedLRUCache
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; blobs fall back to zlib
+    zstandard = None
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+# Defaults to a directory next to the Chroma data (db.py imports this module)
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", os.path.join(os.getenv("CHROMA_PERSIST_PATH", "./chroma_persist"), "blobs"))
+BLOB_COMPRESSION_LEVEL = int(os.getenv("BLOB_COMPRESSION_LEVEL", "6"))
+BLOB_CACHE_SIZE = int(os.getenv("BLOB_CACHE_SIZE", "256"))
+
+REF_PREFIX = "sha256:"
+
+
+class BlobStore:
+    """
+    Content-addressed store for large text blobs (retrieval contexts).
+    Each distinct text is written once, compressed, under its SHA-256;
+    documents keep only the returned reference.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_PATH, level: int = BLOB_COMPRESSION_LEVEL,
+                 cache_size: int = BLOB_CACHE_SIZE):
+        self.root = root
+        self.level = level
+        self.cache = VersionedLRUCache(max_entries=cache_size)
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.root, digest[:2], digest + suffix)
+
+    def _compress(self, data: bytes) -> Tuple[bytes, str]:
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=self.level).compress(data), ".zst"
+        return zlib.compress(data, self.level), ".zz"
+
+    def put(self, text: str) -> str:
+        """
+        Stores text (if not already stored) and returns its reference.
+        """
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        if self._find(digest) is None:
+            payload, suffix = self._compress(data)
+            path = self._path(digest, suffix)
+            with self._lock:
+                if self._find(digest) is None:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(payload)
+                    os.replace(tmp_path, path)
+        return REF_PREFIX + digest
+
+    def _find(self, digest: str) -> Optional[str]:
+        for suffix in (".zst", ".zz"):
+            path = self._path(digest, suffix)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def path_for(self, ref: str) -> Optional[str]:
+        """
+        Returns the file holding a reference's blob, or None if it is missing.
+        """
+        if not ref.startswith(REF_PREFIX):
+            raise ValueError(f"Invalid blob reference: {ref}")
+        return self._find(ref[len(REF_PREFIX):])
+
+    def get(self, ref: str) -> Optional[str]:
+        """
+        Returns the text for a reference, or None if the blob is missing.
+        """
+        cached = self.cache.get(ref, 0)
+        if cached is not None:
+            return cached
+        path = self.path_for(ref)
+        if path is None:
+            logger.warning("Blob %s not found", ref)
+            return None
+        with open(path, "rb") as f:
+            payload = f.read()
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"Blob {ref} is zstd-compressed but zstandard is not installed")
+            data = zstandard.ZstdDecompressor().decompress(payload)
+        else:
+            data = zlib.decompress(payload)
+        text = data.decode("utf-8")
+        self.cache.put(ref, 0, text)
+        return text
+
+    def delete(self, ref: str) -> int:
+        """
+        Removes a blob and returns the bytes freed (0 if it did not exist).
+        """
+        path = self.path_for(ref) if ref.startswith(REF_PREFIX) else None
+        if path is None:
+            return 0
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+
+    def refs(self) -> Iterator[Tuple[str, int]]:
+        """
+        Yields (reference, stored bytes) for every blob.
+        """
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            for name in os.listdir(shard_dir):
+                if name.endswith((".zst", ".zz")):
+                    yield REF_PREFIX + name.rsplit(".", 1)[0], os.path.getsize(os.path.join(shard_dir, name))
+
+    def stats(self) -> Dict[str, int]:
+        count, size = 0, 0
+        for _, blob_size in self.refs():
+            count += 1
+            size += blob_size
+        return {"blobs": count, "bytes": size}
+
+
+blob_store = BlobStore()
@@ -0,0 +1,115 @@
+"""
+Rewrites existing collections into the compact storage layout (see db.compact_metadata):
+content is kept only as the Chroma document and contexts move to the blob store.
+
+ChromaDB merges metadata on update, so keys cannot be removed in place; each
+batch is deleted and re-added with its stored embeddings. The batch is
+journaled first, and an interrupted run replays the journal on restart.
+Run it while the service is stopped.
+
+    python compact_storage.py [--collection user_<id>_collection] [--vacuum]
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+from typing import Any, Dict, List
+import db
+from blob_store import blob_store
+from logging_config import setup_logging
+
+# Initialize logger
+logger = setup_logging("compact_storage")
+
+JOURNAL_PATH = os.path.join(db.persist_directory, "compact_storage.journal.json")
+
+
+def needs_compaction(metadata: Dict[str, Any]) -> bool:
+    return metadata is not None and ("content" in metadata or "context" in metadata)
+
+
+def _rewrite(collection, batch: Dict[str, List]) -> None:
+    with open(JOURNAL_PATH + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"collection": collection.name, **batch}, f)
+    os.replace(JOURNAL_PATH + ".tmp", JOURNAL_PATH)
+    collection.delete(ids=batch["ids"])
+    collection.add(**batch)
+    os.remove(JOURNAL_PATH)
+
+
+def replay_journal() -> None:
+    """
+    Finishes a batch that was deleted but not re-added when the last run stopped.
+    """
+    if not os.path.exists(JOURNAL_PATH):
+        return
+    with open(JOURNAL_PATH, "r", encoding="utf-8") as f:
+        batch = json.load(f)
+    collection = db.get_client().get_collection(batch.pop("collection"))
+    logger.info("Replaying interrupted batch of %d documents in %s", len(batch["ids"]), collection.name)
+    _rewrite(collection, batch)
+
+
+def compact_collection(collection, batch_size: int) -> Dict[str, int]:
+    ids = collection.get(include=[])["ids"]
+    rewritten, contexts = 0, 0
+    # Ids are listed up front: rewritten rows move to the end of the collection
+    for start in range(0, len(ids), batch_size):
+        page = collection.get(ids=ids[start:start + batch_size], include=["embeddings", "documents", "metadatas"])
+        batch = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+        for doc_id, embedding, document, metadata in zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"]):
+            if not needs_compaction(metadata):
+                continue
+            contexts += 1 if metadata.get("context") else 0
+            text, stored = db.compact_metadata({**metadata, "content": document if document is not None else metadata.get("content", "")})
+            batch["ids"].append(doc_id)
+            batch["embeddings"].append(embedding)
+            batch["documents"].append(text)
+            batch["metadatas"].append(stored)
+        if batch["ids"]:
+            _rewrite(collection, batch)
+            rewritten += len(batch["ids"])
+    return {"documents": len(ids), "rewritten": rewritten, "contextsExternalized": contexts}
+
+
+def _sqlite_size() -> int:
+    path = os.path.join(db.persist_directory, "chroma.sqlite3")
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate collections to the compact storage layout")
+    parser.add_argument("--collection", action="append", help="Collection to compact (default: all)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents rewritten per batch")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the Chroma SQLite file afterwards")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    size_before = _sqlite_size()
+    replay_journal()
+    names = args.collection or [collection.name for collection in db.get_client().list_collections()]
+    totals = {"documents": 0, "rewritten": 0, "contextsExternalized": 0}
+    for name in names:
+        result = compact_collection(db.get_client().get_collection(name), args.batch_size)
+        logger.info("Compacted %s: %s", name, result)
+        for key, value in result.items():
+            totals[key] += value
+
+    if args.vacuum:
+        conn = sqlite3.connect(os.path.join(db.persist_directory, "chroma.sqlite3"))
+        conn.execute("VACUUM")
+        conn.close()
+    summary = {
+        **totals,
+        "collections": len(names),
+        "sqliteBytesBefore": size_before,
+        "sqliteBytesAfter": _sqlite_size(),
+        "blobs": blob_store.stats(),
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+    logger.info("Compaction finished: %s", json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
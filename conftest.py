@@ -0,0 +1,15 @@
+"""
+pytest setup: tests run against a throwaway persist directory with the
+offline embedding provider and never wait on a MongoDB server.
+"""
+import os
+import tempfile
+
+os.environ["CHROMA_PERSIST_PATH"] = tempfile.mkdtemp(prefix="eoxs-test-")
+os.environ["EMBEDDING_PROVIDER"] = "fake"
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/?serverSelectionTimeoutMS=200")
+for _name in ("COLLECTION_ROUTES_PATH", "BLOB_STORE_PATH", "DEDUP_DB_PATH", "THREAD_LOG_PATH"):
+    os.environ.pop(_name, None)
+
+# Manual scripts that exercise a running server (python test_ai_memory.py)
+collect_ignore = ["test_ai_memory.py", "test_context_filtering.py", "test_shaurya_fix.py", "comprehensive_test.py", "simple_test.py"]
@@ -1,37 +1,489 @@
 import os
+import logging
+import re
+import json
+import hashlib
+import time
+import threading
+from array import array
+from contextlib import contextmanager
+import numpy as np
 import chromadb
 from chromadb.config import Settings
-from typing import List, Dict, Optional
-from logging_config import setup_logging
+from typing import Callable, List, Dict, Optional, Any, Tuple
+from logging_config import setup_logging, sample
+from result_cache import VersionedLRUCache
+from metrics import timed, vector_queries, vector_query_results, documents_written, documents_deleted
+from request_context import annotate_request
+from blob_store import blob_store
+from utils import to_epoch
 
 # Initialize logger
 logger = setup_logging(__name__)
 
-# Initialize ChromaDB client
+# ChromaDB client (created on first use)
 persist_directory = os.getenv("CHROMA_PERSIST_PATH", "./chroma_persist")
-logger.info(f"Initializing ChromaDB client with persist directory: {persist_directory}")
-client = chromadb.PersistentClient(path=persist_directory)
+_client = None
+_client_lock = threading.Lock()
 
 
-def get_or_create_collection(user_id: str):
+def get_client():
+    """
+    Returns the ChromaDB client, opening the persist directory on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                logger.info("Initializing ChromaDB client with persist directory: %s", persist_directory)
+                _client = chromadb.PersistentClient(path=persist_directory)
+    return _client
+
+# Retrieval-result cache, invalidated by per-user write versions.
+# Versions live in this process, which is the single writer for the persist
+# directory (a Chroma PersistentClient must not be shared across processes).
+result_cache = VersionedLRUCache(max_entries=int(os.getenv("RESULT_CACHE_SIZE", "2048")))
+_write_versions: Dict[str, int] = {}
+_versions_lock = threading.Lock()
+
+
+def get_write_version(user_id: str) -> int:
+    """
+    Returns the monotonically increasing write version of the user's collection.
+    """
+    return _write_versions.get(user_id, 0)
+
+
+def bump_write_version(user_id: str) -> int:
+    """
+    Marks the user's collection as changed, invalidating cached query results.
+    """
+    with _versions_lock:
+        version = _write_versions.get(user_id, 0) + 1
+        _write_versions[user_id] = version
+    return version
+
+
+# Per-user collection routes: which collection serves reads and writes, which
+# embedding model/dimensions its vectors come from, and an optional shadow
+# collection being rebuilt by a migration (see migration.py). Users without a
+# route use user_<id>_collection and the default embedding model.
+ROUTES_PATH = os.getenv("COLLECTION_ROUTES_PATH", os.path.join(persist_directory, "collection_routes.json"))
+_routes: Optional[Dict[str, Dict[str, Any]]] = None
+_routes_lock = threading.Lock()
+
+
+_COLLECTION_PATTERN = re.compile(r"^user_(.+)_collection$")
+
+
+def default_collection_name(user_id: str) -> str:
+    return f"user_{user_id}_collection"
+
+
+def list_user_ids() -> List[str]:
+    """
+    Users with a collection: default user_<id>_collection names plus routed users.
+    """
+    user_ids = set(_load_routes())
+    for collection in get_client().list_collections():
+        match = _COLLECTION_PATTERN.match(collection.name)
+        if match:
+            user_ids.add(match.group(1))
+    return sorted(user_ids)
+
+
+def users_with_collection(user_ids: List[str]) -> List[str]:
+    """
+    The given users whose active collection exists, in order; nothing is created.
+    """
+    names = {collection.name for collection in get_client().list_collections()}
+    return [user_id for user_id in user_ids if get_route(user_id)["collection"] in names]
+
+
+def _load_routes() -> Dict[str, Dict[str, Any]]:
+    global _routes
+    if _routes is None:
+        with _routes_lock:
+            if _routes is None:
+                try:
+                    with open(ROUTES_PATH, "r", encoding="utf-8") as f:
+                        _routes = json.load(f)
+                except FileNotFoundError:
+                    _routes = {}
+    return _routes
+
+
+def _save_routes(routes: Dict[str, Dict[str, Any]]) -> None:
+    # Write-then-rename so readers of the file never see a partial update
+    os.makedirs(os.path.dirname(ROUTES_PATH) or ".", exist_ok=True)
+    tmp_path = ROUTES_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(routes, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, ROUTES_PATH)
+
+
+def get_route(user_id: str) -> Dict[str, Any]:
+    """
+    Returns the user's route: collection, model, dimensions and shadow (None when unset).
+    """
+    route = _load_routes().get(user_id, {})
+    return {
+        "collection": route.get("collection") or default_collection_name(user_id),
+        "model": route.get("model"),
+        "dimensions": route.get("dimensions"),
+        "shadow": route.get("shadow"),
+        "deletedSinceRebuild": route.get("deletedSinceRebuild") or 0,
+    }
+
+
+def embedding_spec_for(user_id: str) -> Dict[str, Any]:
+    """
+    Embedding model and dimensions matching the user's active collection,
+    as keyword arguments for embedding.generate_embedding (None = service default).
+    """
+    route = _load_routes().get(user_id, {})
+    return {"model": route.get("model"), "dimensions": route.get("dimensions")}
+
+
+def update_route(user_id: str, **changes: Any) -> None:
+    """
+    Merges changes into the user's route and persists the route table.
+    """
+    routes = _load_routes()
+    with _routes_lock:
+        updated = dict(routes)
+        entry = dict(updated.get(user_id, {}))
+        entry.update(changes)
+        updated[user_id] = entry
+        _save_routes(updated)
+        routes.clear()
+        routes.update(updated)
+
+
+def set_shadow(user_id: str, collection: str, model: str, dimensions: Optional[int]) -> None:
+    """
+    Starts dual-writing the user's documents into a shadow collection.
+    """
+    update_route(user_id, shadow={"collection": collection, "model": model, "dimensions": dimensions})
+
+
+def clear_shadow(user_id: str) -> None:
+    update_route(user_id, shadow=None)
+
+
+def promote_shadow(user_id: str, keep_previous: bool = True) -> Dict[str, Any]:
+    """
+    Atomically switches the user's reads and writes to the shadow collection.
+    The previous collection is kept (recorded as previousCollection) for rollback
+    unless keep_previous is False, in which case the caller drops it. Callers
+    hold write_gate.paused() on the previous collection, so no write to it is
+    in flight or can miss its dual write to the shadow.
+    """
+    route = get_route(user_id)
+    shadow = route["shadow"]
+    if not shadow:
+        raise ValueError(f"User {user_id} has no shadow collection")
+    update_route(
+        user_id,
+        collection=shadow["collection"],
+        model=shadow["model"],
+        dimensions=shadow["dimensions"],
+        previousCollection=route["collection"] if keep_previous else None,
+        shadow=None,
+    )
+    bump_write_version(user_id)
+    logger.info("Switched user %s to collection %s (%s)", user_id, shadow["collection"], shadow["model"])
+    return get_route(user_id)
+
+
+# Called after every upsert with (user_id, doc_ids, metadatas, embeddings), e.g. for
+# dual writes, the thread log and the dedup index
+_write_hooks: List[Callable[[str, List[str], List[Dict], List[List[float]]], None]] = []
+
+
+def register_write_hook(hook: Callable[[str, List[str], List[Dict], List[List[float]]], None]) -> None:
+    _write_hooks.append(hook)
+
+
+def _run_write_hooks(user_id: str, doc_ids: List[str], metadatas: List[Dict], embeddings: List[List[float]]) -> None:
+    for hook in _write_hooks:
+        try:
+            hook(user_id, doc_ids, metadatas, embeddings)
+        except Exception as e:
+            logger.error(f"Write hook failed for user {user_id}: {e}", exc_info=True)
+
+
+# Called after deletes with (user_id, doc_ids), e.g. to drop them from the dedup index
+_delete_hooks: List[Callable[[str, List[str]], None]] = []
+
+
+def register_delete_hook(hook: Callable[[str, List[str]], None]) -> None:
+    _delete_hooks.append(hook)
+
+
+class WriteGate:
+    """
+    Lets a snapshot pause writes to one collection at a time: writers only
+    wait while their own collection is paused, and a pause waits for the
+    writes already running on that collection to finish. write_count() lets
+    a snapshot copy without pausing and detect writes that overlapped the copy.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active: Dict[str, int] = {}
+        self._paused: set = set()
+        self._started: Dict[str, int] = {}
+
+    def write_count(self, collection_name: str) -> Optional[int]:
+        """
+        Number of writes started on the collection, or None while one is running.
+        """
+        with self._cond:
+            if collection_name in self._active:
+                return None
+            return self._started.get(collection_name, 0)
+
+    @contextmanager
+    def writing(self, collection_name: str):
+        with self._cond:
+            self._cond.wait_for(lambda: collection_name not in self._paused)
+            self._active[collection_name] = self._active.get(collection_name, 0) + 1
+            self._started[collection_name] = self._started.get(collection_name, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[collection_name] -= 1
+                if not self._active[collection_name]:
+                    del self._active[collection_name]
+                self._cond.notify_all()
+
+    @contextmanager
+    def paused(self, collection_name: str, timeout: Optional[float] = None):
+        with self._cond:
+            self._paused.add(collection_name)
+            if not self._cond.wait_for(lambda: collection_name not in self._active, timeout):
+                self._paused.discard(collection_name)
+                self._cond.notify_all()
+                raise TimeoutError(f"Writes to {collection_name} did not drain within {timeout}s")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._paused.discard(collection_name)
+                self._cond.notify_all()
+
+
+# Every write to a collection goes through the gate (see snapshot.py)
+write_gate = WriteGate()
+# How long a collection switch (migration, rebuild) waits for in-flight writes to drain
+SWITCH_PAUSE_TIMEOUT = float(os.getenv("SWITCH_PAUSE_TIMEOUT", "30"))
+
+
+def compact_metadata(metadata: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Splits a document into its text and the metadata that is actually stored.
+    The text lives only in the Chroma document (not also as metadata["content"]),
+    a context string is moved to the blob store and replaced by contextRef,
+    None values are dropped (ChromaDB cannot store them) and createdAt is
+    mirrored as epoch seconds in createdAtTs so it can be range-filtered.
+    """
+    stored = {key: value for key, value in metadata.items() if key != "content" and value is not None}
+    if "createdAtTs" not in stored:
+        created_ts = to_epoch(stored.get("createdAt"))
+        if created_ts is not None:
+            stored["createdAtTs"] = created_ts
+    context = stored.pop("context", None)
+    if context:
+        stored["contextRef"] = blob_store.put(context)
+    return metadata["content"], stored
+
+
+def rehydrate(metadatas: Optional[List[Optional[Dict]]], documents: Optional[List[Optional[str]]]) -> None:
+    """
+    Restores metadata["content"] (and a None threadId) on rows read from a collection.
+    The document is authoritative: older rows may carry a stale content key.
+    """
+    if not metadatas:
+        return
+    for i, metadata in enumerate(metadatas):
+        if metadata is None:
+            continue
+        if documents and documents[i] is not None:
+            metadata["content"] = documents[i]
+        metadata.setdefault("threadId", None)
+
+
+def load_context(metadata: Dict[str, Any]) -> Optional[str]:
+    """
+    Returns a stored document's retrieval context, reading the blob only when asked.
+    """
+    if metadata.get("context"):
+        return metadata["context"]
+    ref = metadata.get("contextRef")
+    return blob_store.get(ref) if ref else None
+
+
+def compile_filter(metadata_filter: Optional[Dict[str, Any]], since: Optional[float] = None,
+                   until: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Compiles a flat {key: value} metadata filter into ChromaDB where syntax.
+    Values may also be operator dicts such as {"$gte": 3}. since/until (epoch
+    seconds) become range conditions on createdAtTs.
+    """
+    conditions = [{key: value} for key, value in (metadata_filter or {}).items()]
+    if since is not None:
+        conditions.append({"createdAtTs": {"$gte": since}})
+    if until is not None:
+        conditions.append({"createdAtTs": {"$lte": until}})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        # Single condition, no need for $and
+        return conditions[0]
+    # Multiple conditions need $and operator
+    return {"$and": conditions}
+
+
+# Recency-weighted ranking fetches this many times top_k candidates to rerank
+RECENCY_OVERFETCH = int(os.getenv("RECENCY_OVERFETCH", "4"))
+RECENCY_DEFAULT_WEIGHT = float(os.getenv("RECENCY_DEFAULT_WEIGHT", "0.3"))
+
+
+def rerank_by_recency(results: Dict[str, Any], top_k: int, half_life_days: float, weight: float,
+                      now: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Reorders query results by (1 - weight) * similarity + weight * 0.5 ** (age / half_life)
+    and keeps the top_k. Returns a new results dict whose distances are
+    1 - combined score; documents without createdAtTs count as infinitely old.
+    """
+    metadatas = results["metadatas"][0]
+    similarity = 1.0 - np.asarray(results["distances"][0], dtype=np.float64)
+    created = np.array([(metadata or {}).get("createdAtTs", -np.inf) for metadata in metadatas], dtype=np.float64)
+    age_days = np.maximum((now if now is not None else time.time()) - created, 0.0) / 86400
+    score = (1.0 - weight) * similarity + weight * np.exp2(-age_days / half_life_days)
+    order = np.argsort(-score, kind="stable")[:top_k]
+    reranked = {"ids": [[results["ids"][0][i] for i in order]], "distances": [(1.0 - score[order]).tolist()]}
+    for field in ("documents", "metadatas", "embeddings"):
+        if results.get(field):
+            reranked[field] = [[results[field][0][i] for i in order]]
+    return reranked
+
+
+# Fields returned by collection queries unless the caller asks for fewer
+DEFAULT_INCLUDE = ["metadatas", "documents", "distances"]
+
+
+def _embedding_hash(query_embedding: List[float]) -> str:
+    return hashlib.blake2b(array("d", query_embedding).tobytes(), digest_size=16).hexdigest()
+
+
+def _cached_query(user_id: str, query_embedding: List[float], query_filter: Optional[Dict[str, Any]], top_k: int,
+                  include: Optional[List[str]] = None):
+    """
+    Runs a collection query through the versioned result cache.
+    Only the fields in include are read from the store.
+    Callers must treat the returned results as read-only.
+    """
+    include = list(include) if include is not None else DEFAULT_INCLUDE
+    # Read the version before querying so a concurrent write makes this entry stale
+    version = get_write_version(user_id)
+    compiled = json.dumps(query_filter, sort_keys=True)
+    key = (user_id, compiled, _embedding_hash(query_embedding), top_k, tuple(include))
+    results = result_cache.get(key, version)
+    strategy = "result_cache" if results is not None else ("hnsw+metadata_filter" if query_filter else "hnsw")
+    annotate_request(search={"filter": compiled, "topK": top_k, "strategy": strategy})
+    if results is not None:
+        vector_queries.inc(cache="hit")
+        logger.debug("Result cache hit for user %s", user_id)
+        return results
+
+    collection = get_or_create_collection(user_id)
+    with timed("vector_query"):
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=top_k,
+            where=query_filter,
+            include=include
+        )
+    vector_queries.inc(cache="miss")
+    vector_query_results.inc(len(results["ids"][0]))
+    if results.get("metadatas"):
+        rehydrate(results["metadatas"][0], (results.get("documents") or [None])[0])
+    result_cache.put(key, version, results)
+    return results
+
+
+def collection_size(user_id: str) -> int:
+    """
+    Returns the number of documents in the user's collection.
+    """
+    return get_or_create_collection(user_id).count()
+
+
+def warm_collection(user_id: str) -> int:
+    """
+    Loads the user's collection and its vector index into memory by running a
+    one-result query with a stored vector. Returns the collection size.
+    """
+    # Only existing collections are warmed; a missing one raises
+    collection = get_client().get_collection(name=get_route(user_id)["collection"])
+    sample = collection.get(limit=1, include=["embeddings"])
+    if sample["ids"]:
+        collection.query(query_embeddings=sample["embeddings"], n_results=1, include=[])
+    return collection.count()
+
+
+def get_or_create_collection(user_id: str, collection_name: Optional[str] = None):
     """
     Retrieves or creates a ChromaDB collection for the given user_id.
+    Defaults to the user's active (routed) collection.
     """
-    collection_name = f"user_{user_id}_collection"
+    collection_name = collection_name or get_route(user_id)["collection"]
     try:
-        collection = client.get_collection(name=collection_name)
-        logger.debug(f"Retrieved existing collection: {collection_name}")
+        collection = get_client().get_collection(name=collection_name)
+        logger.debug("Retrieved existing collection: %s", collection_name)
     except Exception:
-        logger.debug(f"Collection {collection_name} not found. Creating new collection.")
-        collection = client.create_collection(name=collection_name)
+        logger.debug("Collection %s not found. Creating new collection.", collection_name)
+        collection = get_client().create_collection(name=collection_name)
     return collection
 
 
+@contextmanager
+def active_collection(user_id: str):
+    """
+    Yields the user's active collection while holding its write gate. A writer
+    that waited on a collection paused for a switch (promote_shadow) and finds
+    the route moved retries on the new active collection.
+    """
+    while True:
+        collection = get_or_create_collection(user_id)
+        with write_gate.writing(collection.name):
+            if get_route(user_id)["collection"] == collection.name:
+                yield collection
+                return
+
+
+def scan_pages(collection, where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None,
+               page_size: int = 1000):
+    """
+    Yields a collection's rows page by page (limit/offset), as collection.get() results.
+    """
+    offset = 0
+    while True:
+        page = collection.get(where=where, offset=offset, limit=page_size, include=include or [])
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+
 def add_document(user_id: str, doc_id: str, embedding: List[float], metadata: Dict):
     """
     Adds or updates a document in the user's collection with metadata support.
     """
-    logger.debug(f"Adding document to collection: user_id={user_id}, doc_id={doc_id}")
+    logger.debug("Adding document to collection: user_id=%s, doc_id=%s", user_id, doc_id)
     
     if "content" not in metadata:
         logger.error("Missing 'content' in metadata")
@@ -41,21 +493,101 @@ def add_document(user_id: str, doc_id: str, embedding: List[float], metadata: Di
     if "threadId" not in metadata:
         metadata["threadId"] = None
 
-    collection = get_or_create_collection(user_id)
-    collection.upsert(
-        documents=[metadata["content"]],
-        metadatas=[metadata],
-        ids=[doc_id],
-        embeddings=[embedding]
-    )
-    logger.info(f"Document {doc_id} upserted successfully for user {user_id}.")
+    document, stored = compact_metadata(metadata)
+    # Hooks run inside the gate so a switch waits for the dual write to the shadow
+    with active_collection(user_id) as collection:
+        with timed("vector_upsert"):
+            collection.upsert(
+                documents=[document],
+                metadatas=[stored],
+                ids=[doc_id],
+                embeddings=[embedding]
+            )
+        bump_write_version(user_id)
+        _run_write_hooks(user_id, [doc_id], [metadata], [embedding])
+    documents_written.inc(type=metadata.get("type") or "unknown")
+    logger.info("Document %s upserted successfully for user %s.", doc_id, user_id, extra=sample())
+
+
+def add_documents(user_id: str, doc_ids: List[str], embeddings: List[List[float]], metadatas: List[Dict]):
+    """
+    Adds or updates a batch of documents in the user's collection with a single upsert.
+    Every metadata dict must include 'content'.
+    """
+    if not (len(doc_ids) == len(embeddings) == len(metadatas)):
+        raise ValueError("doc_ids, embeddings and metadatas must have the same length")
+    if not doc_ids:
+        return
+    if any("content" not in metadata for metadata in metadatas):
+        logger.error("Missing 'content' in batch metadata")
+        raise ValueError("every metadata must include 'content' key")
+
+    compacted = [compact_metadata(metadata) for metadata in metadatas]
+    with active_collection(user_id) as collection:
+        with timed("vector_upsert"):
+            collection.upsert(
+                documents=[document for document, _ in compacted],
+                metadatas=[stored for _, stored in compacted],
+                ids=doc_ids,
+                embeddings=embeddings
+            )
+        bump_write_version(user_id)
+        _run_write_hooks(user_id, doc_ids, metadatas, embeddings)
+    by_type: Dict[str, int] = {}
+    for metadata in metadatas:
+        doc_type = metadata.get("type") or "unknown"
+        by_type[doc_type] = by_type.get(doc_type, 0) + 1
+    for doc_type, count in by_type.items():
+        documents_written.inc(count, type=doc_type)
+    logger.debug("Upserted %d documents for user %s", len(doc_ids), user_id)
+
+
+def delete_documents(user_id: str, doc_ids: List[str]) -> int:
+    """
+    Deletes documents from the user's collection (and its shadow while a
+    migration is running). Returns the number of ids deleted.
+    """
+    if not doc_ids:
+        return 0
+    with timed("vector_delete"), active_collection(user_id) as collection:
+        collection.delete(ids=doc_ids)
+        shadow = get_route(user_id)["shadow"]
+        if shadow:
+            with write_gate.writing(shadow["collection"]):
+                get_or_create_collection(user_id, shadow["collection"]).delete(ids=doc_ids)
+    bump_write_version(user_id)
+    for hook in _delete_hooks:
+        try:
+            hook(user_id, doc_ids)
+        except Exception as e:
+            logger.error(f"Delete hook failed for user {user_id}: {e}", exc_info=True)
+    documents_deleted.inc(len(doc_ids))
+    logger.info("Deleted %d documents for user %s", len(doc_ids), user_id)
+    return len(doc_ids)
+
+
+def _ranked_query(user_id: str, query_embedding: List[float], query_filter: Optional[Dict[str, Any]], top_k: int,
+                  include: Optional[List[str]], recency_half_life_days: Optional[float], recency_weight: Optional[float]):
+    if not recency_half_life_days:
+        return _cached_query(user_id, query_embedding, query_filter, top_k, include)
+    # Over-fetch by similarity, then blend in recency; the ranking needs distances and createdAtTs
+    include = sorted(set(include if include is not None else DEFAULT_INCLUDE) | {"metadatas", "distances"})
+    results = _cached_query(user_id, query_embedding, query_filter, top_k * RECENCY_OVERFETCH, include)
+    weight = RECENCY_DEFAULT_WEIGHT if recency_weight is None else recency_weight
+    with timed("recency_rerank"):
+        return rerank_by_recency(results, top_k, recency_half_life_days, weight)
 
 
-def query_similar(user_id: str, query_embedding: List[float], thread_id: str, metadata_filter: Optional[Dict[str, str]] = None, top_k: int = 5):
+def query_similar(user_id: str, query_embedding: List[float], thread_id: str, metadata_filter: Optional[Dict[str, str]] = None, top_k: int = 5,
+                  include: Optional[List[str]] = None, since: Optional[float] = None, until: Optional[float] = None,
+                  recency_half_life_days: Optional[float] = None, recency_weight: Optional[float] = None):
     """
     Queries for similar documents in the user's collection, filtered by threadId and optional metadata.
+    include selects the ChromaDB fields to return (documents, metadatas, distances; default all).
+    since/until (epoch seconds) restrict createdAtTs; with recency_half_life_days
+    the results are reranked by similarity blended with recency.
     """
-    logger.debug(f"query_similar called with user_id={user_id}, thread_id={thread_id}, metadata_filter={metadata_filter}, top_k={top_k}")
+    logger.debug("query_similar called with user_id=%s, thread_id=%s, metadata_filter=%s, top_k=%s", user_id, thread_id, metadata_filter, top_k)
 
     if not isinstance(user_id, str) or not user_id.strip():
         raise ValueError("user_id must be a non-empty string")
@@ -64,62 +596,39 @@ def query_similar(user_id: str, query_embedding: List[float], thread_id: str, me
     if not (hasattr(query_embedding, "__iter__") and all(isinstance(x, (float, int)) for x in query_embedding)):
         raise ValueError("query_embedding must be an iterable of floats")
 
-    collection = get_or_create_collection(user_id)
-    
     # Build query filter with proper ChromaDB syntax
-    if metadata_filter:
-        # Combine multiple conditions with $and operator
-        conditions = [{"threadId": thread_id}]
-        for key, value in metadata_filter.items():
-            conditions.append({key: value})
-        query_filter = {"$and": conditions}
-    else:
-        query_filter = {"threadId": thread_id}
-
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_k,
-        where=query_filter
-    )
+    query_filter = compile_filter({"threadId": thread_id, **(metadata_filter or {})}, since, until)
 
-    logger.info(f"Query returned {len(results.get('documents', [[]])[0])} documents.")
-    logger.debug(f"DB query results: {results}")
+    results = _ranked_query(user_id, query_embedding, query_filter, top_k, include, recency_half_life_days, recency_weight)
+
+    logger.info("Query returned %d documents.", len(results["ids"][0]), extra=sample())
+    # Results carry full documents and metadata: only format them when DEBUG is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("DB query results: ids=%s distances=%s", results["ids"], results.get("distances"))
     return results
 
 
-def query_similar_any_thread(user_id: str, query_embedding: List[float], metadata_filter: Optional[Dict[str, str]] = None, top_k: int = 5):
+def query_similar_any_thread(user_id: str, query_embedding: List[float], metadata_filter: Optional[Dict[str, str]] = None, top_k: int = 5,
+                             include: Optional[List[str]] = None, since: Optional[float] = None, until: Optional[float] = None,
+                             recency_half_life_days: Optional[float] = None, recency_weight: Optional[float] = None):
     """
     Queries for similar documents across all threads for the user, optionally filtered by metadata.
+    include selects the ChromaDB fields to return (documents, metadatas, distances; default all).
+    since/until and the recency options behave as in query_similar.
     """
-    logger.debug(f"query_similar_any_thread called with user_id={user_id}, metadata_filter={metadata_filter}, top_k={top_k}")
+    logger.debug("query_similar_any_thread called with user_id=%s, metadata_filter=%s, top_k=%s", user_id, metadata_filter, top_k)
 
     if not isinstance(user_id, str) or not user_id.strip():
         raise ValueError("user_id must be a non-empty string")
     if not (hasattr(query_embedding, "__iter__") and all(isinstance(x, (float, int)) for x in query_embedding)):
         raise ValueError("query_embedding must be an iterable of floats")
 
-    collection = get_or_create_collection(user_id)
-
     # Build query filter with proper ChromaDB syntax
-    if metadata_filter and len(metadata_filter) > 1:
-        # Multiple conditions need $and operator
-        conditions = []
-        for key, value in metadata_filter.items():
-            conditions.append({key: value})
-        query_filter = {"$and": conditions}
-    elif metadata_filter and len(metadata_filter) == 1:
-        # Single condition, no need for $and
-        key, value = list(metadata_filter.items())[0]
-        query_filter = {key: value}
-    else:
-        query_filter = None  # No filter
-
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_k,
-        where=query_filter
-    )
+    query_filter = compile_filter(metadata_filter, since, until)
+
+    results = _ranked_query(user_id, query_embedding, query_filter, top_k, include, recency_half_life_days, recency_weight)
 
-    logger.info(f"Global query returned {len(results.get('documents', [[]])[0])} documents.")
-    logger.debug(f"Global DB query results: {results}")
+    logger.info("Global query returned %d documents.", len(results["ids"][0]), extra=sample())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Global DB query results: ids=%s distances=%s", results["ids"], results.get("distances"))
     return results
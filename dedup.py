@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from db import persist_directory, register_write_hook, register_delete_hook
+from logging_config import setup_logging
+from metrics import REGISTRY, Counter
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH", os.path.join(persist_directory, "dedup.sqlite3"))
+# Cosine similarity at or above which a message counts as a near duplicate (unset = exact only)
+DEDUP_NEAR_THRESHOLD = float(os.getenv("DEDUP_NEAR_THRESHOLD", "0")) or None
+# Recent vectors kept per user for the near-duplicate check, and users kept in memory
+DEDUP_RECENT_VECTORS = int(os.getenv("DEDUP_RECENT_VECTORS", "256"))
+DEDUP_MAX_USERS = int(os.getenv("DEDUP_MAX_USERS", "1000"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+dedup_results = REGISTRY.register(Counter(
+    "eoxs_dedup_total", "Ingested documents by deduplication outcome", ["result"]))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS content_hashes (
+    user_id TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, scope, hash)
+);
+CREATE INDEX IF NOT EXISTS content_hashes_doc ON content_hashes (user_id, doc_id);
+CREATE TABLE IF NOT EXISTS dedup_refs (
+    user_id TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    canonical_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    similarity REAL,
+    metadata TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user_id, doc_id)
+);
+CREATE TABLE IF NOT EXISTS dedup_stats (
+    user_id TEXT PRIMARY KEY,
+    ingested INTEGER NOT NULL DEFAULT 0,
+    exact INTEGER NOT NULL DEFAULT 0,
+    near INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def content_hash(content: str) -> str:
+    """
+    Hash of the whitespace-normalized content, stored as contentHash metadata.
+    """
+    normalized = _WHITESPACE.sub(" ", content).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def dedup_scope(metadata: Dict[str, Any]) -> str:
+    """
+    Duplicates are only detected within the same document type and thread.
+    """
+    return f"{metadata.get('type') or ''}|{metadata.get('threadId') or ''}"
+
+
+class Deduplicator:
+    """
+    Ingest-side deduplication. An exact content-hash index (SQLite) is checked
+    before anything is embedded; optionally, new vectors are compared with the
+    user's recent vectors by cosine similarity. Duplicates are recorded as
+    references to the canonical document instead of being stored as vectors.
+    """
+
+    def __init__(self, path: str = DEDUP_DB_PATH, near_threshold: Optional[float] = DEDUP_NEAR_THRESHOLD,
+                 recent_vectors: int = DEDUP_RECENT_VECTORS, max_users: int = DEDUP_MAX_USERS):
+        self.path = path
+        self.near_threshold = near_threshold
+        self.recent_vectors = recent_vectors
+        self.max_users = max_users
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # user -> deque of (doc_id, scope, unit vector)
+        self._recent: "OrderedDict[str, deque]" = OrderedDict()
+
+    def _db(self) -> sqlite3.Connection:
+        # Callers hold self._lock
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _count(self, conn: sqlite3.Connection, user_id: str, column: str) -> None:
+        conn.execute(
+            f"INSERT INTO dedup_stats (user_id, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {column} = {column} + 1",
+            (user_id,),
+        )
+
+    def claim_exact(self, user_id: str, doc_id: str, metadata: Dict[str, Any]) -> Tuple[Optional[str], bool]:
+        """
+        Sets metadata["contentHash"] and returns (canonical id, reserved). The
+        canonical id is that of another document with the same content in the
+        same scope, else None. If no document had the hash, it is reserved for
+        doc_id (reserved is True), so a concurrent copy of the content resolves
+        to doc_id instead of being stored too; the caller then stores the
+        document or calls release().
+        """
+        metadata["contentHash"] = content_hash(metadata["content"])
+        key = (user_id, dedup_scope(metadata), metadata["contentHash"])
+        with self._lock:
+            conn = self._db()
+            reserved = conn.execute(
+                "INSERT OR IGNORE INTO content_hashes (user_id, scope, hash, doc_id) VALUES (?, ?, ?, ?)", key + (doc_id,)
+            ).rowcount == 1
+            winner = conn.execute(
+                "SELECT doc_id FROM content_hashes WHERE user_id = ? AND scope = ? AND hash = ?", key
+            ).fetchone()[0]
+        # Re-sending the same id is an idempotent upsert, not a duplicate
+        return (winner if winner != doc_id else None), reserved
+
+    def release(self, user_id: str, doc_id: str, metadata: Dict[str, Any]) -> None:
+        """
+        Drops the hash reserved by claim_exact() for a document that was not stored.
+        """
+        with self._lock:
+            self._db().execute(
+                "DELETE FROM content_hashes WHERE user_id = ? AND scope = ? AND hash = ? AND doc_id = ?",
+                (user_id, dedup_scope(metadata), metadata["contentHash"], doc_id),
+            )
+
+    def find_near(self, user_id: str, doc_id: str, metadata: Dict[str, Any],
+                  embedding: List[float]) -> Optional[Tuple[str, float]]:
+        """
+        Returns (canonical id, cosine similarity) of the most similar recent
+        vector in the same scope if it is over the near-duplicate threshold.
+        """
+        if not self.near_threshold:
+            return None
+        scope = dedup_scope(metadata)
+        with self._lock:
+            recent = [(other_id, vector) for other_id, other_scope, vector in self._recent.get(user_id, ())
+                      if other_scope == scope and other_id != doc_id]
+        if not recent:
+            return None
+        matrix = np.stack([vector for _, vector in recent])
+        similarities = matrix @ _unit(embedding)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.near_threshold:
+            return recent[best][0], float(similarities[best])
+        return None
+
+    def record_written(self, user_id: str, doc_ids: List[str], metadatas: List[Dict[str, Any]],
+                       embeddings: List[List[float]]) -> None:
+        """
+        db write hook: indexes stored (canonical) documents, whichever path wrote
+        them (API, bulk import, export import), so later copies are detected.
+        """
+        entries = [
+            (doc_id, dedup_scope(metadata), metadata.get("contentHash") or content_hash(metadata["content"]), embedding)
+            for doc_id, metadata, embedding in zip(doc_ids, metadatas, embeddings)
+            if metadata.get("content")
+        ]
+        if not entries:
+            return
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN")
+            try:
+                # An upsert with new content under the same id replaces its old hash
+                conn.executemany("DELETE FROM content_hashes WHERE user_id = ? AND doc_id = ?",
+                                 [(user_id, doc_id) for doc_id, _, _, _ in entries])
+                conn.executemany(
+                    "INSERT OR REPLACE INTO content_hashes (user_id, scope, hash, doc_id) VALUES (?, ?, ?, ?)",
+                    [(user_id, scope, digest, doc_id) for doc_id, scope, digest, _ in entries],
+                )
+                conn.execute(
+                    "INSERT INTO dedup_stats (user_id, ingested) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET ingested = ingested + excluded.ingested",
+                    (user_id, len(entries)),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if self.near_threshold:
+                recent = self._recent.get(user_id)
+                if recent is None:
+                    recent = self._recent[user_id] = deque(maxlen=self.recent_vectors)
+                    if len(self._recent) > self.max_users:
+                        self._recent.popitem(last=False)
+                self._recent.move_to_end(user_id)
+                recent.extend((doc_id, scope, _unit(embedding)) for doc_id, scope, _, embedding in entries)
+        dedup_results.inc(len(entries), result="stored")
+
+    def record_duplicate(self, user_id: str, doc_id: str, canonical_id: str, kind: str,
+                         metadata: Dict[str, Any], similarity: Optional[float] = None) -> None:
+        """
+        Stores a duplicate as a reference to its canonical document.
+        """
+        details = {key: value for key, value in metadata.items() if key not in ("content", "context")}
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO dedup_refs (user_id, doc_id, canonical_id, kind, similarity, metadata, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, doc_id, canonical_id, kind, similarity, json.dumps(details, default=str), time.time()),
+            )
+            self._count(conn, user_id, "ingested")
+            self._count(conn, user_id, kind)
+        dedup_results.inc(result=kind)
+        logger.info("Document %s of user %s is a%s duplicate of %s", doc_id, user_id,
+                    "n exact" if kind == "exact" else " near", canonical_id)
+
+    def resolve(self, user_id: str, doc_id: str) -> str:
+        """
+        Returns the canonical id for a document id (itself unless it was deduplicated).
+        """
+        with self._lock:
+            row = self._db().execute(
+                "SELECT canonical_id FROM dedup_refs WHERE user_id = ? AND doc_id = ?", (user_id, doc_id)
+            ).fetchone()
+        return row[0] if row else doc_id
+
+    def forget(self, user_id: str, doc_ids: List[str]) -> None:
+        """
+        Drops deleted documents from the hash index, the recent vectors and the
+        references that point at them.
+        """
+        rows = [(user_id, doc_id) for doc_id in doc_ids]
+        with self._lock:
+            conn = self._db()
+            conn.executemany("DELETE FROM content_hashes WHERE user_id = ? AND doc_id = ?", rows)
+            conn.executemany("DELETE FROM dedup_refs WHERE user_id = ? AND canonical_id = ?", rows)
+            recent = self._recent.get(user_id)
+            if recent:
+                removed = set(doc_ids)
+                kept = [entry for entry in recent if entry[0] not in removed]
+                recent.clear()
+                recent.extend(kept)
+
+    def stats(self, user_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Per-user dedup counters and ratio, for one user or the users with the highest ratio.
+        """
+        query = "SELECT user_id, ingested, exact, near FROM dedup_stats"
+        if user_id is not None:
+            params: tuple = (user_id,)
+            query += " WHERE user_id = ?"
+        else:
+            params = (limit,)
+            query += " ORDER BY CAST(exact + near AS REAL) / MAX(ingested, 1) DESC, ingested DESC LIMIT ?"
+        with self._lock:
+            rows = self._db().execute(query, params).fetchall()
+        return [
+            {
+                "userId": row[0],
+                "ingested": row[1],
+                "exactDuplicates": row[2],
+                "nearDuplicates": row[3],
+                "dedupRatio": round((row[2] + row[3]) / row[1], 4) if row[1] else 0.0,
+            }
+            for row in rows
+        ]
+
+
+def _unit(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+deduplicator = Deduplicator()
+if DEDUP_ENABLED:
+    register_write_hook(deduplicator.record_written)
+register_delete_hook(deduplicator.forget)
@@ -1,40 +1,186 @@
 import os
+import re
+import hashlib
+import threading
+from functools import lru_cache
+from types import SimpleNamespace
+import numpy as np
 from openai import OpenAI, OpenAIError
 from dotenv import load_dotenv
 from logging_config import setup_logging
-from typing import List, Optional, Dict
+from metrics import timed, embedding_tokens, embedding_cache_requests, provider_errors
+from result_cache import VersionedLRUCache
+from typing import List, Optional, Dict, Iterable
 
 # Initialize logger for this module
 logger = setup_logging(__name__)
 
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.error("Missing OPENAI_API_KEY environment variable")
-    raise ValueError("Missing OPENAI_API_KEY environment variable")
+# Default model for users whose collection has no route (see db.get_route);
+# EMBEDDING_DIMENSIONS shortens text-embedding-3 vectors (unset = native size)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+# "openai", or "fake" for a deterministic offline provider (benchmarks, local runs)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+# Vector size of each model when no dimensions are requested
+NATIVE_DIMENSIONS = {"text-embedding-3-large": 3072, "text-embedding-3-small": 1536, "text-embedding-ada-002": 1536}
 
-# Use the new OpenAI v1 client
-client = OpenAI(api_key=OPENAI_API_KEY)
-logger.info("OpenAI client initialized for embeddings")
+# Recently generated embeddings, keyed by (model, text hash); see prime_embeddings()
+embedding_cache = VersionedLRUCache(max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")))
 
+# Use the new OpenAI v1 client (created on first use)
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
 
-def generate_embedding(text: str, metadata: Optional[Dict[str, str]] = None) -> List[float]:
+
+def get_client() -> OpenAI:
+    """
+    Returns the OpenAI client used for embeddings, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    logger.error("Missing OPENAI_API_KEY environment variable")
+                    raise ValueError("Missing OPENAI_API_KEY environment variable")
+                _client = OpenAI(api_key=api_key)
+                logger.info("OpenAI client initialized for embeddings")
+    return _client
+
+
+def model_label(model: Optional[str] = None, dimensions: Optional[int] = None) -> str:
+    """
+    Identifies the model that produced a vector, stored as embeddingModel metadata.
+    """
+    model = model or EMBEDDING_MODEL
+    dimensions = dimensions or EMBEDDING_DIMENSIONS
+    return f"{model}@{dimensions}" if dimensions else model
+
+
+def _cache_key(text: str, model: Optional[str] = None, dimensions: Optional[int] = None):
+    return (model_label(model, dimensions), hashlib.sha1(text.encode("utf-8")).hexdigest())
+
+
+@lru_cache(maxsize=4096)
+def _token_vector(model: str, dimensions: int, token: str) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(f"{model}\0{token}".encode("utf-8"), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+
+
+def fake_embedding(text: str, model: Optional[str] = None, dimensions: Optional[int] = None) -> np.ndarray:
+    """
+    Deterministic unit-length vector for text: the sum of a fixed random vector
+    per lowercased word, so texts sharing words are close. No network access.
+    """
+    model = model or EMBEDDING_MODEL
+    dimensions = dimensions or EMBEDDING_DIMENSIONS or NATIVE_DIMENSIONS.get(model, 1536)
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for token in re.findall(r"\w+", text.lower()) or [text]:
+        vector += _token_vector(model, dimensions, token)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _create_fake(texts, model: str, dimensions: Optional[int]):
+    # Same shape as an OpenAI embeddings response
+    inputs = [texts] if isinstance(texts, str) else texts
+    with timed("embedding"):
+        data = [SimpleNamespace(index=i, embedding=fake_embedding(text, model, dimensions).tolist())
+                for i, text in enumerate(inputs)]
+    return SimpleNamespace(data=data, usage=None)
+
+
+def _create(texts, model: Optional[str], dimensions: Optional[int]):
+    model = model or EMBEDDING_MODEL
+    dimensions = dimensions or EMBEDDING_DIMENSIONS
+    if EMBEDDING_PROVIDER == "fake":
+        return _create_fake(texts, model, dimensions)
+    # The pinned client predates the dimensions argument; send it in the body
+    extra_body = {"dimensions": dimensions} if dimensions else None
+    with timed("embedding"):
+        response = get_client().embeddings.create(model=model, input=texts, extra_body=extra_body)
+    if response.usage is not None:
+        embedding_tokens.inc(response.usage.total_tokens, model=model)
+    return response
+
+
+def generate_embedding(text: str, metadata: Optional[Dict[str, str]] = None,
+                       model: Optional[str] = None, dimensions: Optional[int] = None) -> List[float]:
     """
-    Generate an embedding vector for a given text.
+    Generate an embedding vector for a given text, with the default model
+    unless model/dimensions are given (see db.embedding_spec_for).
     Metadata is accepted for downstream compatibility but not used here.
+    Returned vectors may be shared through the cache and must not be mutated.
     """
+    key = _cache_key(text, model, dimensions)
+    cached = embedding_cache.get(key, 0)
+    if cached is not None:
+        embedding_cache_requests.inc(cache="hit")
+        return cached
+    embedding_cache_requests.inc(cache="miss")
+
     try:
-        response = client.embeddings.create(
-            model="text-embedding-3-large",
-            input=text
-        )
+        response = _create(text, model, dimensions)
         embedding_vector = response.data[0].embedding
-        logger.debug(f"Generated embedding vector of length {len(embedding_vector)}")
+        logger.debug("Generated embedding vector of length %d", len(embedding_vector))
+        embedding_cache.put(key, 0, embedding_vector)
         return embedding_vector
     except OpenAIError as e:
+        provider_errors.inc(operation="embedding")
         logger.error(f"OpenAI API error: {e}", exc_info=True)
         raise
     except Exception as e:
         logger.error(f"Unexpected error: {e}", exc_info=True)
         raise
+
+
+def generate_embeddings(texts: List[str], use_cache: bool = True,
+                        model: Optional[str] = None, dimensions: Optional[int] = None) -> List[List[float]]:
+    """
+    Generate embeddings for a batch of texts with a single provider call.
+    Cached texts are not re-sent; bulk jobs pass use_cache=False so they
+    neither read nor evict the request-path cache.
+    """
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+    missing = []
+    for i, text in enumerate(texts):
+        cached = embedding_cache.get(_cache_key(text, model, dimensions), 0) if use_cache else None
+        if cached is not None:
+            vectors[i] = cached
+        else:
+            missing.append(i)
+    if use_cache:
+        embedding_cache_requests.inc(len(texts) - len(missing), cache="hit")
+        embedding_cache_requests.inc(len(missing), cache="miss")
+    if not missing:
+        return vectors
+
+    try:
+        response = _create([texts[i] for i in missing], model, dimensions)
+    except OpenAIError as e:
+        provider_errors.inc(operation="embedding")
+        logger.error(f"OpenAI API error for batch of {len(missing)}: {e}")
+        raise
+    # Results carry the index of their input; don't rely on response order
+    for item in response.data:
+        i = missing[item.index]
+        vectors[i] = item.embedding
+        if use_cache:
+            embedding_cache.put(_cache_key(texts[i], model, dimensions), 0, item.embedding)
+    return vectors
+
+
+def prime_embeddings(texts: Iterable[str], model: Optional[str] = None, dimensions: Optional[int] = None) -> int:
+    """
+    Embeds texts ahead of time with the given model so later requests hit the
+    embedding cache. Returns how many texts were embedded (cache hits are skipped).
+    """
+    primed = 0
+    for text in texts:
+        if embedding_cache.get(_cache_key(text, model, dimensions), 0) is None:
+            generate_embedding(text, model=model, dimensions=dimensions)
+            primed += 1
+    return primed
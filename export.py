@@ -0,0 +1,271 @@
+"""
+Streaming export and import of a user's memory.
+
+An export is a tar stream (or a directory with the same files):
+
+    manifest.json          format, version, userId, embeddingModel, exportedAt
+    part-00000.ndjson      one {"id", "content", "metadata"} object per line
+    part-00000.npy         float32 vectors of those rows, in the same order
+    part-00001.ndjson ...
+
+The collection is read one page at a time, so memory use is bounded by the
+page size. Contexts are inlined from the blob store unless --no-context;
+such an export keeps contextRef and only imports on a node whose blob store
+already holds those blobs (e.g. the same node).
+
+    python export.py export <user_id> <out.tar | out_dir> [--page-size N] [--no-context]
+    python export.py import <user_id> <in.tar | in_dir> [--force]
+"""
+import io
+import os
+import json
+import time
+import tarfile
+import argparse
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import db
+import thread_log  # noqa: F401  (imports also fill the thread log)
+import dedup  # noqa: F401  (imported documents are indexed for deduplication)
+from blob_store import blob_store
+from embedding import generate_embeddings, model_label
+from logging_config import setup_logging
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+EXPORT_FORMAT = "eoxs-memory-export"
+EXPORT_VERSION = 1
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+MANIFEST_NAME = "manifest.json"
+
+
+def _manifest(user_id: str) -> Dict[str, Any]:
+    return {
+        "format": EXPORT_FORMAT,
+        "version": EXPORT_VERSION,
+        "userId": user_id,
+        "collection": db.get_route(user_id)["collection"],
+        "embeddingModel": model_label(**db.embedding_spec_for(user_id)),
+        "exportedAt": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+def export_parts(user_id: str, page_size: int = EXPORT_PAGE_SIZE,
+                 include_context: bool = True) -> Iterator[Tuple[str, bytes, bytes]]:
+    """
+    Yields (part name, NDJSON bytes, .npy bytes) for each page of the user's collection.
+    """
+    collection = db.get_or_create_collection(user_id)
+    pages = db.scan_pages(collection, include=["embeddings", "documents", "metadatas"], page_size=page_size)
+    for number, page in enumerate(pages):
+        lines = []
+        for doc_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            metadata = dict(metadata or {})
+            if include_context and metadata.get("contextRef"):
+                context = db.load_context(metadata)
+                if context is not None:
+                    metadata.pop("contextRef")
+                    metadata["context"] = context
+            lines.append(json.dumps({"id": doc_id, "content": document, "metadata": metadata},
+                                    ensure_ascii=False, separators=(",", ":")))
+        vectors = io.BytesIO()
+        np.save(vectors, np.asarray(page["embeddings"], dtype=np.float32), allow_pickle=False)
+        yield f"part-{number:05d}", ("\n".join(lines) + "\n").encode("utf-8"), vectors.getvalue()
+
+
+class _Chunks:
+    """
+    Write-only file object collecting what tarfile writes until it is drained.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def iter_export_tar(user_id: str, page_size: int = EXPORT_PAGE_SIZE, include_context: bool = True,
+                    stats: Optional[Dict[str, int]] = None) -> Iterator[bytes]:
+    """
+    Yields the export as a tar stream, one chunk per page. Counts go into stats if given.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(documents=0, parts=0)
+    chunks = _Chunks()
+    tar = tarfile.open(fileobj=chunks, mode="w|")
+    _add_member(tar, MANIFEST_NAME, json.dumps(_manifest(user_id), indent=2).encode("utf-8"))
+    for name, ndjson, vectors in export_parts(user_id, page_size, include_context):
+        _add_member(tar, name + ".ndjson", ndjson)
+        _add_member(tar, name + ".npy", vectors)
+        stats["documents"] += ndjson.count(b"\n")
+        stats["parts"] += 1
+        yield chunks.drain()
+    tar.close()
+    yield chunks.drain()
+    logger.info("Exported %d documents of user %s", stats["documents"], user_id)
+
+
+def export_to_path(user_id: str, path: str, page_size: int = EXPORT_PAGE_SIZE,
+                   include_context: bool = True) -> Dict[str, Any]:
+    """
+    Writes the export to a .tar file or, for any other path, a directory.
+    """
+    if path.endswith(".tar"):
+        stats: Dict[str, int] = {}
+        with open(path, "wb") as f:
+            for chunk in iter_export_tar(user_id, page_size, include_context, stats):
+                f.write(chunk)
+        return stats
+    rows, parts = 0, 0
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(_manifest(user_id), f, indent=2)
+    for name, ndjson, vectors in export_parts(user_id, page_size, include_context):
+        with open(os.path.join(path, name + ".ndjson"), "wb") as f:
+            f.write(ndjson)
+        with open(os.path.join(path, name + ".npy"), "wb") as f:
+            f.write(vectors)
+        rows += ndjson.count(b"\n")
+        parts += 1
+    return {"documents": rows, "parts": parts}
+
+
+def _import_part(user_id: str, ndjson: bytes, vectors: bytes, reembed: bool = False) -> int:
+    records = [json.loads(line) for line in ndjson.decode("utf-8").splitlines() if line.strip()]
+    embeddings = np.load(io.BytesIO(vectors), allow_pickle=False)
+    if len(records) != len(embeddings):
+        raise ValueError(f"{len(records)} rows but {len(embeddings)} vectors")
+    spec = db.embedding_spec_for(user_id)
+    label = model_label(**spec)
+    metadatas, missing = [], []
+    for record in records:
+        metadata = {**record["metadata"], "content": record["content"], "embeddingModel": label}
+        if metadata.get("context"):
+            # Re-stored in this node's blob store by add_documents
+            metadata.pop("contextRef", None)
+        elif metadata.get("contextRef") and blob_store.path_for(metadata["contextRef"]) is None:
+            missing.append(record["id"])
+        metadatas.append(metadata)
+    if missing:
+        # Storing the reference would leave the context silently unreadable
+        raise ValueError(f"{len(missing)} rows (e.g. {missing[0]}) reference contexts missing from this "
+                         f"node's blob store; export with contexts included (without --no-context)")
+    if reembed:
+        # Vectors from another model cannot share the collection; embed the text again
+        vectors_out = generate_embeddings([record["content"] for record in records], use_cache=False, **spec)
+    else:
+        vectors_out = embeddings.tolist()
+    db.add_documents(user_id, [record["id"] for record in records], vectors_out, metadatas)
+    return len(records)
+
+
+def _check_manifest(user_id: str, manifest: Dict[str, Any], force: bool) -> bool:
+    """
+    Validates the manifest; returns True when the rows must be re-embedded
+    because the export's model differs from the user's (only with force).
+    """
+    if manifest.get("format") != EXPORT_FORMAT or manifest.get("version") != EXPORT_VERSION:
+        raise ValueError("Not a supported memory export")
+    target = model_label(**db.embedding_spec_for(user_id))
+    if manifest.get("embeddingModel") == target:
+        return False
+    if not force:
+        raise ValueError(f"Export was embedded with {manifest.get('embeddingModel')}, "
+                         f"but user {user_id} uses {target} (force re-embeds it)")
+    logger.info("Re-embedding import for user %s: export uses %s, collection uses %s",
+                user_id, manifest.get("embeddingModel"), target)
+    return True
+
+
+def import_stream(user_id: str, fileobj: BinaryIO, force: bool = False) -> Dict[str, Any]:
+    """
+    Imports a tar export read sequentially from fileobj (no seeking needed).
+    """
+    imported, pending, reembed = 0, {}, False
+    manifest: Optional[Dict[str, Any]] = None
+    try:
+        tar = tarfile.open(fileobj=fileobj, mode="r|")
+    except tarfile.TarError as e:
+        raise ValueError(f"Invalid export archive: {e}")
+    with tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            data = tar.extractfile(member).read()
+            if member.name == MANIFEST_NAME:
+                manifest = json.loads(data)
+                reembed = _check_manifest(user_id, manifest, force)
+                continue
+            if manifest is None:
+                raise ValueError(f"{MANIFEST_NAME} must come first")
+            name, _, suffix = member.name.rpartition(".")
+            pending.setdefault(name, {})[suffix] = data
+            if len(pending[name]) == 2:
+                part = pending.pop(name)
+                imported += _import_part(user_id, part["ndjson"], part["npy"], reembed)
+    if pending:
+        raise ValueError(f"Incomplete parts: {sorted(pending)}")
+    logger.info("Imported %d documents for user %s", imported, user_id)
+    return {"documents": imported, "source": manifest.get("userId") if manifest else None}
+
+
+def import_from_path(user_id: str, path: str, force: bool = False) -> Dict[str, Any]:
+    if not os.path.isdir(path):
+        with open(path, "rb") as f:
+            return import_stream(user_id, f, force)
+    with open(os.path.join(path, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    reembed = _check_manifest(user_id, manifest, force)
+    imported = 0
+    for name in sorted(entry[:-len(".ndjson")] for entry in os.listdir(path) if entry.endswith(".ndjson")):
+        with open(os.path.join(path, name + ".ndjson"), "rb") as f:
+            ndjson = f.read()
+        with open(os.path.join(path, name + ".npy"), "rb") as f:
+            vectors = f.read()
+        imported += _import_part(user_id, ndjson, vectors, reembed)
+    logger.info("Imported %d documents for user %s", imported, user_id)
+    return {"documents": imported, "source": manifest.get("userId")}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export or import a user's memory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Export a user's collection")
+    export_parser.add_argument("user_id")
+    export_parser.add_argument("path", help="Output .tar file or directory")
+    export_parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE, help="Documents per part")
+    export_parser.add_argument("--no-context", action="store_true", help="Keep contextRef instead of inlining contexts")
+    import_parser = commands.add_parser("import", help="Import an export into a user's collection")
+    import_parser.add_argument("user_id")
+    import_parser.add_argument("path", help="Input .tar file or directory")
+    import_parser.add_argument("--force", action="store_true", help="Re-embed the rows if the embedding model differs")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "export":
+        result = export_to_path(args.user_id, args.path, args.page_size, not args.no_context)
+    else:
+        result = import_from_path(args.user_id, args.path, args.force)
+    elapsed = time.perf_counter() - start
+    logger.info("%s finished: %s in %.1fs (%.0f docs/sec)", args.command.capitalize(), result, elapsed,
+                result["documents"] / elapsed if elapsed else 0)
+
+
+if __name__ == "__main__":
+    main()
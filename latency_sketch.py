@@ -0,0 +1,100 @@
+import math
+from typing import Any, Dict, Iterable, Optional
+
+# Relative accuracy of reported quantiles (1% => p99 of 200ms is within 198-202ms)
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# Values below this (in ms) are counted in a single zero bucket
+MIN_TRACKED_VALUE = 1e-3
+
+
+class LatencySketch:
+    """
+    Mergeable latency histogram with logarithmic buckets (DDSketch style).
+
+    Each bucket covers [gamma^(i-1), gamma^i), so any quantile is reported with
+    a bounded relative error. Two sketches with the same accuracy are merged by
+    adding bucket counts, which makes per-minute rollups combinable over any
+    time window.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float) -> None:
+        if value < MIN_TRACKED_VALUE:
+            self.zero_count += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "LatencySketch") -> None:
+        if other.count == 0:
+            return
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        # Nearest-rank: the smallest value with at least q * count observations at or below it
+        rank = max(1, math.ceil(q * self.count))
+        seen = self.zero_count
+        if rank <= seen:
+            return self.min
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, quantiles: Iterable[float] = (0.5, 0.9, 0.99)) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            "count": self.count,
+            "avgLatency": round(self.sum / self.count, 2) if self.count else None,
+            "minLatency": self.min,
+            "maxLatency": self.max,
+        }
+        for q in quantiles:
+            value = self.quantile(q)
+            result[f"p{round(q * 100):d}"] = round(value, 2) if value is not None else None
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "relativeAccuracy": self.relative_accuracy,
+            "buckets": {str(index): count for index, count in self.buckets.items()},
+            "zeroCount": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencySketch":
+        sketch = cls(data.get("relativeAccuracy", DEFAULT_RELATIVE_ACCURACY))
+        sketch.buckets = {int(index): count for index, count in data.get("buckets", {}).items()}
+        sketch.zero_count = data.get("zeroCount", 0)
+        sketch.count = data.get("count", 0)
+        sketch.sum = data.get("sum", 0.0)
+        sketch.min = data.get("min")
+        sketch.max = data.get("max")
+        return sketch
@@ -1,12 +1,16 @@
+import atexit
+import json
 import logging
 import logging.handlers
 import os
+import queue
+import random
+import threading
 from pathlib import Path
 from datetime import datetime
+from typing import Any, Dict, Optional
 
-# Create logs directory if it doesn't exist
 LOGS_DIR = Path("logs")
-LOGS_DIR.mkdir(exist_ok=True)
 
 # Log file paths
 LOG_FILE = LOGS_DIR / "app.log"
@@ -16,45 +20,99 @@ ERROR_LOG_FILE = LOGS_DIR / "error.log"
 LOG_FORMAT = "%(asctime)s | %(levelname)-8s | %(name)s:%(funcName)s:%(lineno)d | %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
-def setup_logging(name: str = None) -> logging.Logger:
+# Level for loggers and the file handler; DEBUG only when explicitly requested
+LOG_LEVEL = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+# File handlers write one JSON object per line unless LOG_FILE_FORMAT=text
+LOG_FILE_FORMAT = os.getenv("LOG_FILE_FORMAT", "json").lower()
+# Fraction of high-volume (per-request) lines that are kept, see sample()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# Attributes present on every LogRecord; anything else came in through extra=
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample_rate"}
+
+
+class JSONFormatter(logging.Formatter):
     """
-    Set up and return a logger with the specified name.
-    If no name is provided, returns the root logger.
-    
-    Args:
-        name (str, optional): The name of the logger. Defaults to None (root logger).
-    
-    Returns:
-        logging.Logger: Configured logger instance
+    Formats records as single-line JSON objects, including any extra= fields.
     """
-    logger = logging.getLogger(name)
-    
-    # Don't add handlers if they already exist
-    if logger.handlers:
-        return logger
-    
-    logger.setLevel(logging.DEBUG)
-    
-    # Create formatters
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "line": record.lineno,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a record marked with a sample_rate (see sample()) with that probability.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        return rate is None or rate >= 1.0 or random.random() < rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records for the background listener. Only the %-style message is
+    merged on the calling thread; line formatting and I/O happen on the listener.
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Handlers (and the logs directory) are created by the first record, not on import
+        if _listener is None:
+            start_logging()
+        super().emit(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Render tracebacks now so frames are not kept alive in the queue
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+def _build_handlers():
+    # Create logs directory if it doesn't exist
+    LOGS_DIR.mkdir(exist_ok=True)
     formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
-    
+    file_formatter = JSONFormatter() if LOG_FILE_FORMAT == "json" else formatter
+
     # Console Handler (INFO and above)
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
-    # File Handler (DEBUG and above)
+
+    # File Handler (LOG_LEVEL and above)
     file_handler = logging.handlers.RotatingFileHandler(
         LOG_FILE,
         maxBytes=10*1024*1024,  # 10MB
         backupCount=5,
         encoding='utf-8'
     )
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-    
+    file_handler.setLevel(LOG_LEVEL)
+    file_handler.setFormatter(file_formatter)
+
     # Error File Handler (ERROR and above)
     error_file_handler = logging.handlers.RotatingFileHandler(
         ERROR_LOG_FILE,
@@ -63,17 +121,77 @@ def setup_logging(name: str = None) -> logging.Logger:
         encoding='utf-8'
     )
     error_file_handler.setLevel(logging.ERROR)
-    error_file_handler.setFormatter(formatter)
-    logger.addHandler(error_file_handler)
-    
+    error_file_handler.setFormatter(file_formatter)
+    return console_handler, file_handler, error_file_handler
+
+
+def start_logging() -> None:
+    """
+    Creates the console and file handlers and starts the background log writer.
+    Called from the application lifespan; otherwise the first record does it.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        _listener = logging.handlers.QueueListener(_queue, *_build_handlers(), respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+    logger.info("Logging system initialized")
+
+
+def stop_logging() -> None:
+    """
+    Flushes queued records and stops the background log writer.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def sample(rate: Optional[float] = None) -> Dict[str, float]:
+    """
+    extra= payload marking a high-volume line for sampling, e.g.
+    logger.info("Query returned %d documents", n, extra=sample()).
+    Defaults to LOG_SAMPLE_RATE.
+    """
+    return {"sample_rate": LOG_SAMPLE_RATE if rate is None else rate}
+
+
+def setup_logging(name: str = None) -> logging.Logger:
+    """
+    Set up and return a logger with the specified name.
+    If no name is provided, returns the root logger.
+
+    Records go through a queue to a background thread that owns the console
+    and rotating file handlers, so logging never blocks on I/O. Nothing is
+    opened until start_logging() or the first record.
+
+    Args:
+        name (str, optional): The name of the logger. Defaults to None (root logger).
+
+    Returns:
+        logging.Logger: Configured logger instance
+    """
+    logger = logging.getLogger(name)
+
+    # Don't add handlers if they already exist
+    if logger.handlers:
+        return logger
+
+    logger.setLevel(LOG_LEVEL)
+
+    queue_handler = _QueueHandler(_queue)
+    queue_handler.addFilter(SamplingFilter())
+    logger.addHandler(queue_handler)
+
     # Prevent propagation to root logger if this is not the root logger
     if name is not None:
         logger.propagate = False
-    
+
     return logger
 
 # Create a default logger instance
 logger = setup_logging(__name__)
-
-# Log startup message
-logger.info("Logging system initialized") 
\ No newline at end of file
@@ -0,0 +1,260 @@
+import os
+import time
+import random
+import hashlib
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import db
+from embedding import generate_embeddings, model_label
+from logging_config import setup_logging
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+# Re-embedding throttle and verification defaults
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "100"))
+MIGRATION_MAX_DOCS_PER_SEC = float(os.getenv("MIGRATION_MAX_DOCS_PER_SEC", "50"))
+MIGRATION_SAMPLE_SIZE = int(os.getenv("MIGRATION_SAMPLE_SIZE", "50"))
+MIGRATION_MIN_RECALL = float(os.getenv("MIGRATION_MIN_RECALL", "0.7"))
+RECALL_TOP_K = 10
+
+
+class MigrationRunning(Exception):
+    """
+    Raised when a migration is started while another one is running.
+    """
+
+
+def shadow_collection_name(user_id: str, model: str, dimensions: Optional[int]) -> str:
+    suffix = hashlib.blake2b(model_label(model, dimensions).encode("utf-8"), digest_size=4).hexdigest()
+    return f"{db.default_collection_name(user_id)}_m{suffix}"
+
+
+def dual_write(user_id: str, doc_ids: List[str], metadatas: List[Dict], embeddings: List[List[float]]) -> None:
+    """
+    db write hook: mirrors writes into the user's shadow collection while a
+    migration is copying it, embedded with the target model. A shadow on the
+    source's own model (a retention rebuild) reuses the written embeddings.
+    """
+    route = db.get_route(user_id)
+    shadow = route["shadow"]
+    if not shadow:
+        return
+    label = model_label(shadow["model"], shadow["dimensions"])
+    compacted = [db.compact_metadata({**metadata, "embeddingModel": label}) for metadata in metadatas]
+    texts = [document for document, _ in compacted]
+    same_model = (shadow["model"], shadow["dimensions"]) == (route["model"], route["dimensions"])
+    if not (same_model and embeddings):
+        embeddings = generate_embeddings(texts, use_cache=False, model=shadow["model"], dimensions=shadow["dimensions"])
+    collection = db.get_or_create_collection(user_id, shadow["collection"])
+    with db.write_gate.writing(collection.name):
+        collection.upsert(
+            ids=doc_ids,
+            documents=texts,
+            metadatas=[stored for _, stored in compacted],
+            embeddings=embeddings,
+        )
+
+
+db.register_write_hook(dual_write)
+
+
+def sample_recall(source, shadow, sample_size: int, top_k: int = RECALL_TOP_K) -> Optional[float]:
+    """
+    Mean overlap@k between the neighbours of sampled documents in the source
+    collection and in the shadow collection, each queried with the document's
+    own stored vector.
+    """
+    ids = source.get(include=[])["ids"]
+    if not ids:
+        return None
+    sample_ids = random.sample(ids, min(sample_size, len(ids)))
+    k = min(top_k, len(ids))
+    source_vectors = source.get(ids=sample_ids, include=["embeddings"])
+    shadow_vectors = shadow.get(ids=sample_ids, include=["embeddings"])
+    shadow_by_id = dict(zip(shadow_vectors["ids"], shadow_vectors["embeddings"]))
+
+    overlaps = []
+    for doc_id, source_vector in zip(source_vectors["ids"], source_vectors["embeddings"]):
+        shadow_vector = shadow_by_id.get(doc_id)
+        if shadow_vector is None:
+            overlaps.append(0.0)
+            continue
+        expected = set(source.query(query_embeddings=[source_vector], n_results=k, include=[])["ids"][0])
+        found = set(shadow.query(query_embeddings=[shadow_vector], n_results=k, include=[])["ids"][0])
+        overlaps.append(len(expected & found) / k)
+    return sum(overlaps) / len(overlaps)
+
+
+class MigrationJob:
+    """
+    Re-embeds users' documents with a new model into shadow collections,
+    verifies them and switches reads over, one user at a time:
+
+    1. route new writes to both collections (dual write),
+    2. copy every document in throttled batches,
+    3. compare counts and sample neighbour recall,
+    4. atomically switch the user's route to the shadow collection.
+
+    A user failing verification keeps reading the old collection.
+    """
+
+    def __init__(self, user_ids: List[str], model: str, dimensions: Optional[int] = None,
+                 batch_size: int = MIGRATION_BATCH_SIZE, max_docs_per_sec: float = MIGRATION_MAX_DOCS_PER_SEC,
+                 sample_size: int = MIGRATION_SAMPLE_SIZE, min_recall: float = MIGRATION_MIN_RECALL):
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.max_docs_per_sec = max_docs_per_sec
+        self.sample_size = sample_size
+        self.min_recall = min_recall
+        self.users: Dict[str, Dict[str, Any]] = {user_id: {"status": "pending"} for user_id in user_ids}
+        self.status = "pending"
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.docs_total = 0
+        self.docs_done = 0
+        self.error: Optional[str] = None
+        self._cancel = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="embedding-migration", daemon=True)
+        self._thread.start()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self) -> None:
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            for user_id in self.users:
+                try:
+                    self.docs_total += db.get_or_create_collection(user_id).count()
+                except Exception as e:
+                    self.users[user_id] = {"status": "failed", "error": str(e)}
+            for user_id, progress in self.users.items():
+                if self._cancel.is_set():
+                    break
+                if progress["status"] == "pending":
+                    self._migrate_user(user_id, progress)
+            self.status = "cancelled" if self._cancel.is_set() else "finished"
+        except Exception as e:
+            logger.error(f"Embedding migration failed: {e}", exc_info=True)
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+
+    def _throttle(self, copied: int, user_start: float) -> None:
+        if self.max_docs_per_sec > 0:
+            ahead = copied / self.max_docs_per_sec - (time.perf_counter() - user_start)
+            if ahead > 0:
+                self._cancel.wait(ahead)
+
+    def _migrate_user(self, user_id: str, progress: Dict[str, Any]) -> None:
+        source = db.get_or_create_collection(user_id)
+        shadow_name = shadow_collection_name(user_id, self.model, self.dimensions)
+        if shadow_name == source.name:
+            progress.update(status="skipped", reason="already on this model")
+            return
+        label = model_label(self.model, self.dimensions)
+        shadow = db.get_or_create_collection(user_id, shadow_name)
+        # Dual writes start before the copy so nothing written meanwhile is missed
+        db.set_shadow(user_id, shadow_name, self.model, self.dimensions)
+        total = source.count()
+        progress.update(status="copying", collection=shadow_name, total=total, done=0)
+        logger.info("Migrating user %s: %d documents into %s (%s)", user_id, total, shadow_name, label)
+
+        user_start = time.perf_counter()
+        offset = 0
+        try:
+            while not self._cancel.is_set():
+                page = source.get(offset=offset, limit=self.batch_size, include=["documents", "metadatas"])
+                if not page["ids"]:
+                    break
+                texts = list(page["documents"])
+                embeddings = generate_embeddings(texts, use_cache=False, model=self.model, dimensions=self.dimensions)
+                # add() skips ids that already exist: rows dual-written meanwhile are newer
+                with db.write_gate.writing(shadow.name):
+                    shadow.add(
+                        ids=page["ids"],
+                        documents=texts,
+                        metadatas=[{**(metadata or {}), "embeddingModel": label} for metadata in page["metadatas"]],
+                        embeddings=embeddings,
+                    )
+                offset += len(page["ids"])
+                progress["done"] = offset
+                self.docs_done += len(page["ids"])
+                self._throttle(offset, user_start)
+
+            if self._cancel.is_set():
+                db.clear_shadow(user_id)
+                progress["status"] = "cancelled"
+                return
+
+            progress["status"] = "verifying"
+            recall = sample_recall(source, shadow, self.sample_size)
+            # Writes to the source wait while the counts are compared and the
+            # route switches, then retry on the promoted collection
+            with db.write_gate.paused(source.name, db.SWITCH_PAUSE_TIMEOUT):
+                source_count, shadow_count = source.count(), shadow.count()
+                progress.update(sourceCount=source_count, shadowCount=shadow_count,
+                                recall=round(recall, 3) if recall is not None else None)
+                if shadow_count < source_count or (recall is not None and recall < self.min_recall):
+                    # Keep the shadow collection for inspection; reads stay on the source
+                    db.clear_shadow(user_id)
+                    progress["status"] = "failed_verification"
+                    logger.warning("Migration of user %s failed verification: %s", user_id, progress)
+                    return
+                db.promote_shadow(user_id)
+            progress["status"] = "switched"
+            progress["seconds"] = round(time.perf_counter() - user_start, 1)
+        except Exception as e:
+            db.clear_shadow(user_id)
+            progress.update(status="failed", error=str(e))
+            logger.error(f"Migration of user {user_id} failed: {e}", exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        rate = self.docs_done / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.docs_total - self.docs_done, 0)
+        return {
+            "status": self.status,
+            "model": model_label(self.model, self.dimensions),
+            "startedAt": datetime.utcfromtimestamp(self.started_at).isoformat() + "Z" if self.started_at else None,
+            "docsTotal": self.docs_total,
+            "docsDone": self.docs_done,
+            "docsPerSec": round(rate, 1),
+            "etaSeconds": round(remaining / rate) if rate > 0 and self.status == "running" else None,
+            "error": self.error,
+            "users": self.users,
+        }
+
+
+_current: Optional[MigrationJob] = None
+_current_lock = threading.Lock()
+
+
+def start_migration(user_ids: Optional[List[str]], model: str, dimensions: Optional[int] = None,
+                    **options: Any) -> MigrationJob:
+    """
+    Starts a background migration for the given users (default: every user with a collection).
+    """
+    global _current
+    with _current_lock:
+        if _current is not None and _current.running:
+            raise MigrationRunning("An embedding migration is already running")
+        _current = MigrationJob(user_ids or db.list_user_ids(), model, dimensions, **options)
+        _current.start()
+        return _current
+
+
+def current_migration() -> Optional[MigrationJob]:
+    return _current
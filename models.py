@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel, Field
 from typing import Optional, Union, List, Dict, Any
 
@@ -26,26 +27,105 @@ class AIResponseRequest(BaseModel):
     )
 
 
-class QueryRequest(BaseModel):
+class BaseQueryRequest(BaseModel):
     userId: str = Field(..., description="User identifier")
     threadId: Optional[str] = Field(None, description="Thread or conversation ID")
     query: Union[str, List[str]] = Field(..., description="Query text or list of queries")
     filters: Optional[Dict[str, Any]] = Field(None, description="Optional metadata filters for querying")
+    include: Optional[List[str]] = Field(
+        default=None,
+        description="Fields returned per match: content, score, metadata or metadata.<key> (default: all)"
+    )
+    since: Optional[datetime] = Field(None, description="Only match documents created at or after this time")
+    until: Optional[datetime] = Field(None, description="Only match documents created at or before this time")
+    recencyHalfLifeDays: Optional[float] = Field(
+        None, gt=0, description="Blend recency into the ranking; a document's recency term halves every N days"
+    )
+    recencyWeight: Optional[float] = Field(
+        None, ge=0, le=1, description="Weight of the recency term against similarity (default RECENCY_DEFAULT_WEIGHT)"
+    )
+
+
+class QueryRequest(BaseQueryRequest):
+    rerank: bool = Field(False, description="rag-context/rag-generate: rerank candidates with the cross-encoder")
+    rerankTopK: Optional[int] = Field(None, ge=1, le=50, description="Documents kept after reranking (default RERANK_TOP_K)")
+    latencyBudgetMs: Optional[float] = Field(
+        None, gt=0, description="Request budget; reranking is skipped if it would exceed it (default RERANK_BUDGET_MS)"
+    )
+    recentMessages: Optional[int] = Field(
+        None, ge=0, le=200, description="rag-generate: also include the thread's last N messages (requires threadId)"
+    )
+
+
+class GroupedQueryRequest(BaseQueryRequest):
+    types: List[str] = Field(
+        default_factory=lambda: ["user_message", "ai_response"], min_length=1, description="Document types to group by"
+    )
+    topK: int = Field(5, ge=1, le=50, description="Matches per group")
+    groupByThread: bool = Field(False, description="Also group each type's matches by threadId")
+
+
+class MultiUserQueryRequest(BaseModel):
+    callerId: Optional[str] = Field(None, description="Caller admitted against its per-user limits (default: the group, else the first user)")
+    userIds: Optional[List[str]] = Field(None, description="Users whose collections are searched")
+    group: Optional[str] = Field(None, description="Named group of users (USER_GROUPS)")
+    query: str = Field(..., description="Query text")
+    filters: Optional[Dict[str, Any]] = Field(None, description="Optional metadata filters for querying")
+    topK: int = Field(10, ge=1, le=100, description="Matches returned across all users")
+    timeoutMs: Optional[float] = Field(None, gt=0, description="Deadline for each collection search")
+    include: Optional[List[str]] = Field(None, description="Fields returned per match, as in QueryRequest")
+    since: Optional[datetime] = Field(None, description="Only match documents created at or after this time")
+    until: Optional[datetime] = Field(None, description="Only match documents created at or before this time")
+
+
+class MigrationRequest(BaseModel):
+    model: str = Field(..., description="Target embedding model")
+    dimensions: Optional[int] = Field(None, description="Target vector size (text-embedding-3 models only)")
+    userIds: Optional[List[str]] = Field(None, description="Users to migrate (default: all users)")
+    batchSize: Optional[int] = Field(None, description="Documents re-embedded per batch")
+    maxDocsPerSec: Optional[float] = Field(None, description="Throttle for the re-embedding job")
+    minRecall: Optional[float] = Field(None, description="Minimum sampled neighbour recall before switching")
+
 
 class EmbedResponse(BaseModel):
     status: str = "success"
+    duplicateOf: Optional[str] = None  # Canonical message id when the content was already stored
 
 
 class AIResponseResponse(BaseModel):
     status: str = "success"
+    duplicateOf: Optional[str] = None  # Canonical response id when the content was already stored
 
 
 class QueryMatch(BaseModel):
-    content: str
-    score: float
-    metadata: Dict[str, str]  # Be explicit with key/value types
+    # Only the fields requested through QueryRequest.include are present
+    content: Optional[str] = None
+    score: Optional[float] = None
+    metadata: Optional[Dict[str, Any]] = None  # Values may be None (e.g. threadId)
 
 
 class QueryResponse(BaseModel):
     status: str = "success"
     matches: List[QueryMatch]
+
+
+class GroupedQueryResponse(BaseModel):
+    status: str = "success"
+    # type -> matches, or type -> threadId -> matches with groupByThread
+    groups: Dict[str, Any]
+    candidates: int  # Documents fetched by the search, over all passes
+
+
+class MultiUserMatch(QueryMatch):
+    userId: str
+    id: str
+
+
+class MultiUserQueryResponse(BaseModel):
+    status: str = "success"
+    matches: List[MultiUserMatch]
+    partial: bool = False  # Some collections timed out or failed
+    searched: int
+    timedOut: List[str] = []
+    failed: List[str] = []
+    missing: List[str] = []  # Users without a collection, not searched
@@ -1,20 +1,292 @@
 import os
 import time
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
 import logging
-from pymongo import MongoClient
+from bson import ObjectId
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from logging_config import setup_logging
+from latency_sketch import LatencySketch
+from utils import to_naive_utc
 
 # Initialize logger
 logger = setup_logging(__name__)
 
-# MongoDB connection
+# MongoDB connection (created on first use)
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-client = MongoClient(mongo_uri)
-db = client.get_database("eoxs_monitoring")
-api_calls_collection = db.get_collection("api_calls")
-latency_collection = db.get_collection("latency")
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+# Collection names
+API_CALLS = "api_calls"
+LATENCY = "latency"
+LATENCY_ROLLUPS = "latency_rollups"
+SLOW_REQUESTS = "slow_requests"
+
+
+def get_db():
+    """
+    Returns the monitoring database, creating the MongoClient on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(mongo_uri)
+    return _client.get_database("eoxs_monitoring")
+
+
+def _collection(name: str):
+    return get_db().get_collection(name)
+
+# Buffered writer configuration
+BUFFER_SIZE = int(os.getenv("MONITORING_BUFFER_SIZE", "10000"))
+BATCH_SIZE = int(os.getenv("MONITORING_BATCH_SIZE", "500"))
+FLUSH_INTERVAL_SECONDS = float(os.getenv("MONITORING_FLUSH_INTERVAL", "1.0"))
+# What to do when the buffer is full: drop_newest, drop_oldest or sample
+OVERFLOW_POLICY = os.getenv("MONITORING_OVERFLOW_POLICY", "drop_oldest")
+# With the sample policy, keep one of every N events that arrive while full
+OVERFLOW_SAMPLE_EVERY = int(os.getenv("MONITORING_OVERFLOW_SAMPLE_EVERY", "10"))
+# Raw api_calls/latency events expire after this many days; rollups are kept longer
+RAW_EVENT_TTL_DAYS = float(os.getenv("MONITORING_RAW_TTL_DAYS", "30"))
+ROLLUP_TTL_DAYS = float(os.getenv("MONITORING_ROLLUP_TTL_DAYS", "400"))
+MAX_STATS_PAGE_SIZE = 1000
+# Fields returned by get_api_stats unless the caller asks for others
+DEFAULT_STATS_FIELDS = ("timestamp", "endpoint", "userId", "threadId", "messageId", "durationMs", "status", "error")
+STATS_FIELDS = DEFAULT_STATS_FIELDS + ("query", "timings")
+# Requests slower than this go to the capped slow_requests collection
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "2000"))
+SLOW_REQUEST_LOG_BYTES = int(os.getenv("SLOW_REQUEST_LOG_BYTES", str(64 * 1024 * 1024)))
+
+def _ensure_ttl_index(collection, field: str, days: float) -> None:
+    """
+    Creates (or updates the expiry of) a TTL index on a date field.
+    """
+    seconds = int(days * 86400)
+    try:
+        collection.create_index([(field, ASCENDING)], name=f"{field}_ttl", expireAfterSeconds=seconds)
+    except OperationFailure:
+        # The index exists with a different expiry: change it in place
+        get_db().command("collMod", collection.name, index={"name": f"{field}_ttl", "expireAfterSeconds": seconds})
+
+
+def ensure_indexes() -> None:
+    """
+    Creates the monitoring indexes: compound indexes matching the stats filters
+    and sort order, TTL expiry for raw events and rollups, and the capped
+    slow-request collection. Safe to call repeatedly.
+    """
+    try:
+        for keys in (
+            [("endpoint", ASCENDING), ("userId", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            [("userId", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            [("endpoint", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            [("timestamp", DESCENDING), ("_id", DESCENDING)],
+        ):
+            _collection(API_CALLS).create_index(keys)
+        _collection(LATENCY).create_index(
+            [("endpoint", ASCENDING), ("userId", ASCENDING), ("status", ASCENDING), ("timestamp", DESCENDING)])
+        _ensure_ttl_index(_collection(API_CALLS), "timestamp", RAW_EVENT_TTL_DAYS)
+        _ensure_ttl_index(_collection(LATENCY), "timestamp", RAW_EVENT_TTL_DAYS)
+
+        _collection(LATENCY_ROLLUPS).create_index([("minute", ASCENDING), ("endpoint", ASCENDING)])
+        _ensure_ttl_index(_collection(LATENCY_ROLLUPS), "minute", ROLLUP_TTL_DAYS)
+
+        if SLOW_REQUESTS not in get_db().list_collection_names():
+            get_db().create_collection(SLOW_REQUESTS, capped=True, size=SLOW_REQUEST_LOG_BYTES)
+    except Exception as e:
+        logger.error(f"Failed to prepare monitoring indexes: {e}", exc_info=True)
+
+
+class LatencyRollups:
+    """
+    In-process latency sketches per (minute, endpoint, status, stage).
+
+    Completed minutes are flushed as rollup documents, so percentile queries
+    read a handful of small documents per minute of the requested window
+    instead of scanning every raw latency row.
+    """
+
+    def __init__(self):
+        self._sketches: Dict[Tuple[int, str, str, str], LatencySketch] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, status: str, stage: str, duration_ms: float) -> None:
+        minute = int(time.time() // 60 * 60)
+        key = (minute, endpoint, status, stage)
+        with self._lock:
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = LatencySketch()
+            sketch.add(duration_ms)
+
+    def drain(self, include_current: bool = False) -> List[Dict[str, Any]]:
+        """
+        Removes and returns rollup documents for completed minutes (or all minutes).
+        """
+        current_minute = int(time.time() // 60 * 60)
+        with self._lock:
+            keys = [key for key in self._sketches if include_current or key[0] < current_minute]
+            drained = [(key, self._sketches.pop(key)) for key in keys]
+        return [
+            {
+                "minute": datetime.utcfromtimestamp(minute),
+                "endpoint": endpoint,
+                "status": status,
+                "stage": stage,
+                **sketch.to_dict(),
+            }
+            for (minute, endpoint, status, stage), sketch in drained
+        ]
+
+    def pending(self, since: datetime, until: datetime) -> List[Dict[str, Any]]:
+        """
+        Returns not-yet-flushed rollups inside the window, for fresh reads.
+        """
+        since, until = to_naive_utc(since), to_naive_utc(until)
+        with self._lock:
+            items = list(self._sketches.items())
+        return [
+            {"endpoint": endpoint, "status": status, "stage": stage, **sketch.to_dict()}
+            for (minute, endpoint, status, stage), sketch in items
+            if since <= datetime.utcfromtimestamp(minute) <= until
+        ]
+
+
+latency_rollups = LatencyRollups()
+
+
+def record_latency(endpoint: str, status: str, stage: str, duration_ms: float) -> None:
+    """
+    Adds one latency observation to the current minute's rollup.
+    """
+    latency_rollups.record(endpoint, status, stage, duration_ms)
+
+
+class MonitoringBuffer:
+    """
+    Bounded in-memory ring buffer of monitoring events drained by a background
+    thread with insert_many, so the request path never waits on MongoDB.
+    """
+
+    def __init__(self, capacity: int, batch_size: int, flush_interval: float,
+                 overflow_policy: str = "drop_oldest", sample_every: int = 10):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.sample_every = max(1, sample_every)
+        self._events: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._overflow_seen = 0
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    def put(self, event: Tuple[str, Dict[str, Any]]) -> None:
+        with self._cond:
+            if self._thread is None:
+                self._start_locked()
+            if len(self._events) >= self.capacity:
+                self._overflow_seen += 1
+                keep = (
+                    self.overflow_policy == "drop_oldest"
+                    or (self.overflow_policy == "sample" and self._overflow_seen % self.sample_every == 0)
+                )
+                self.dropped += 1
+                if not keep:
+                    return
+                self._events.popleft()
+            self._events.append(event)
+            self.enqueued += 1
+            if len(self._events) >= self.batch_size:
+                self._cond.notify()
+
+    def _start_locked(self) -> None:
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="monitoring-writer", daemon=True)
+        self._thread.start()
+
+    def _take_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._cond:
+            if len(self._events) < self.batch_size and not self._stopping:
+                self._cond.wait(timeout=self.flush_interval)
+            count = min(len(self._events), self.batch_size)
+            return [self._events.popleft() for _ in range(count)]
+
+    def _run(self) -> None:
+        ensure_indexes()
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            self._flush_rollups(include_current=self._stopping)
+            if not batch and self._stopping:
+                return
+
+    def _flush_rollups(self, include_current: bool = False) -> None:
+        rollups = latency_rollups.drain(include_current=include_current)
+        if not rollups:
+            return
+        try:
+            _collection(LATENCY_ROLLUPS).insert_many(rollups, ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to write {len(rollups)} latency rollups: {e}")
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        by_collection: Dict[str, List[Dict[str, Any]]] = {}
+        for name, doc in batch:
+            by_collection.setdefault(name, []).append(doc)
+        for name, docs in by_collection.items():
+            try:
+                _collection(name).insert_many(docs, ordered=False)
+                self.written += len(docs)
+            except Exception as e:
+                self.failed_batches += 1
+                self.dropped += len(docs)
+                logger.error(f"Failed to write {len(docs)} monitoring events to {name}: {e}")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Flushes buffered events and stops the writer thread.
+        """
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join(timeout=timeout)
+        with self._cond:
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            buffered = len(self._events)
+        return {
+            "buffered": buffered,
+            "capacity": self.capacity,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failedBatches": self.failed_batches,
+            "overflowPolicy": self.overflow_policy,
+        }
+
+
+event_buffer = MonitoringBuffer(
+    capacity=BUFFER_SIZE,
+    batch_size=BATCH_SIZE,
+    flush_interval=FLUSH_INTERVAL_SECONDS,
+    overflow_policy=OVERFLOW_POLICY,
+    sample_every=OVERFLOW_SAMPLE_EVERY,
+)
+
 
 def log_api_call(
     endpoint: str,
@@ -24,63 +296,134 @@ def log_api_call(
     query: Optional[str] = None,
     duration_ms: float = 0.0,
     status: str = "success",
-    error: Optional[str] = None
+    error: Optional[str] = None,
+    timings: Optional[Dict[str, float]] = None
 ) -> None:
     """
-    Log API call details to MongoDB for monitoring
+    Queue API call details for batched insertion into MongoDB.
+    Never blocks on the database; the background writer flushes the buffer.
     """
-    try:
-        log_entry = {
-            "timestamp": datetime.utcnow(),
-            "endpoint": endpoint,
-            "userId": user_id,
-            "messageId": message_id,
-            "threadId": thread_id,
-            "query": query,
-            "durationMs": duration_ms,
-            "status": status,
-            "error": error
-        }
-        
-        # Insert into MongoDB
-        api_calls_collection.insert_one(log_entry)
-        
-        # Also log to latency collection for performance tracking
-        latency_entry = {
-            "timestamp": datetime.utcnow(),
-            "endpoint": endpoint,
-            "userId": user_id,
-            "durationMs": duration_ms,
-            "status": status
-        }
-        latency_collection.insert_one(latency_entry)
-        
-        logger.info(f"📊 API Call logged: {endpoint} | Status: {status} | Duration: {duration_ms}ms")
-        
-    except Exception as e:
-        logger.error(f"Failed to log API call: {e}", exc_info=True)
+    timestamp = datetime.utcnow()
+    log_entry = {
+        "timestamp": timestamp,
+        "endpoint": endpoint,
+        "userId": user_id,
+        "messageId": message_id,
+        "threadId": thread_id,
+        "query": query,
+        "durationMs": duration_ms,
+        "status": status,
+        "error": error,
+        "timings": timings
+    }
+    # Also log to latency collection for performance tracking
+    latency_entry = {
+        "timestamp": timestamp,
+        "endpoint": endpoint,
+        "userId": user_id,
+        "durationMs": duration_ms,
+        "status": status
+    }
+    event_buffer.put((API_CALLS, log_entry))
+    event_buffer.put((LATENCY, latency_entry))
+
+
+def log_slow_request(
+    endpoint: str,
+    user_id: Optional[str],
+    duration_ms: float,
+    timings: Optional[Dict[str, float]] = None,
+    search: Optional[Dict[str, Any]] = None,
+    collection_size: Optional[int] = None
+) -> None:
+    """
+    Queue a request that exceeded SLOW_REQUEST_MS for the capped slow_requests log,
+    with the search parameters needed to explain it.
+    """
+    search = search or {}
+    event_buffer.put((SLOW_REQUESTS, {
+        "timestamp": datetime.utcnow(),
+        "endpoint": endpoint,
+        "userId": user_id,
+        "durationMs": duration_ms,
+        "timings": timings,
+        "filter": search.get("filter"),
+        "topK": search.get("topK"),
+        "strategy": search.get("strategy"),
+        "collectionSize": collection_size,
+    }))
+
+
+def shutdown() -> None:
+    """
+    Flushes pending monitoring events; called on application shutdown.
+    """
+    event_buffer.stop()
+
+def _encode_cursor(doc: Dict[str, Any]) -> str:
+    return f"{doc['timestamp'].isoformat()}_{doc['_id']}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    timestamp, _, object_id = cursor.rpartition("_")
+    return datetime.fromisoformat(timestamp), ObjectId(object_id)
+
 
 def get_api_stats(
     endpoint: Optional[str] = None,
     user_id: Optional[str] = None,
-    limit: int = 100
-) -> List[Dict[str, Any]]:
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
     """
-    Get API call statistics from MongoDB
+    Get one page of API calls from MongoDB, newest first.
+    Returns the page (projected to the requested fields) and the cursor for the next page.
+    Raises ValueError for an invalid cursor or field name.
     """
+    fields = list(fields or DEFAULT_STATS_FIELDS)
+    unknown = set(fields) - set(STATS_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    limit = max(1, min(limit, MAX_STATS_PAGE_SIZE))
+
+    filter_query: Dict[str, Any] = {}
+    if endpoint:
+        filter_query["endpoint"] = endpoint
+    if user_id:
+        filter_query["userId"] = user_id
+    if cursor:
+        try:
+            after_timestamp, after_id = _decode_cursor(cursor)
+        except Exception:
+            raise ValueError("Invalid cursor")
+        # Keyset pagination: strictly after the last row of the previous page
+        filter_query["$or"] = [
+            {"timestamp": {"$lt": after_timestamp}},
+            {"timestamp": after_timestamp, "_id": {"$lt": after_id}},
+        ]
+
     try:
-        filter_query = {}
-        if endpoint:
-            filter_query["endpoint"] = endpoint
-        if user_id:
-            filter_query["userId"] = user_id
-            
-        cursor = api_calls_collection.find(filter_query).sort("timestamp", -1).limit(limit)
-        return list(cursor)
-        
+        # Timestamp and _id are always fetched to build the next cursor
+        projection = {field: 1 for field in fields}
+        projection["timestamp"] = 1
+        rows = list(
+            _collection(API_CALLS).find(filter_query, projection)
+            .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit)
+        )
     except Exception as e:
         logger.error(f"Failed to get API stats: {e}", exc_info=True)
-        return []
+        return [], None
+
+    next_cursor = _encode_cursor(rows[-1]) if len(rows) == limit else None
+    page = []
+    for row in rows:
+        item = {field: row.get(field) for field in fields}
+        if "timestamp" in item:
+            item["timestamp"] = row["timestamp"].isoformat() + "Z"
+        page.append(item)
+    return page, next_cursor
 
 def get_average_latency(
     endpoint: Optional[str] = None,
@@ -107,11 +450,91 @@ def get_average_latency(
             }}
         ]
         
-        result = list(latency_collection.aggregate(pipeline))
+        result = list(_collection(LATENCY).aggregate(pipeline))
         if result:
             return result[0]
         return None
         
     except Exception as e:
         logger.error(f"Failed to get latency stats: {e}", exc_info=True)
-        return None 
\ No newline at end of file
+        return None 
+
+
+def get_latency_percentiles(
+    endpoint: Optional[str] = None,
+    status: Optional[str] = "success",
+    stage: str = "total",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Get p50/p90/p99 latency per endpoint over a time window from the per-minute rollups.
+    Defaults to the last hour.
+    """
+    # Query parameters with Z or an offset are aware; rollup minutes are naive UTC
+    until = to_naive_utc(until) or datetime.utcnow()
+    since = to_naive_utc(since) or until - timedelta(hours=1)
+    try:
+        filter_query: Dict[str, Any] = {"minute": {"$gte": since, "$lte": until}, "stage": stage}
+        if endpoint:
+            filter_query["endpoint"] = endpoint
+        if status:
+            filter_query["status"] = status
+
+        rollups = list(_collection(LATENCY_ROLLUPS).find(filter_query, {"_id": 0, "minute": 0}))
+        rollups.extend(
+            rollup for rollup in latency_rollups.pending(since, until)
+            if rollup["stage"] == stage
+            and (not endpoint or rollup["endpoint"] == endpoint)
+            and (not status or rollup["status"] == status)
+        )
+
+        merged: Dict[str, LatencySketch] = {}
+        for rollup in rollups:
+            sketch = merged.get(rollup["endpoint"])
+            if sketch is None:
+                sketch = merged[rollup["endpoint"]] = LatencySketch(rollup["relativeAccuracy"])
+            sketch.merge(LatencySketch.from_dict(rollup))
+        return {name: sketch.summary() for name, sketch in merged.items()}
+
+    except Exception as e:
+        logger.error(f"Failed to get latency percentiles: {e}", exc_info=True)
+        return {}
+
+
+def get_hot_users(limit: int = 10, hours: float = 24) -> List[str]:
+    """
+    Returns the user ids with the most API calls in the last hours, busiest first.
+    """
+    since = datetime.utcnow() - timedelta(hours=hours)
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": since}, "userId": {"$ne": None}}},
+        {"$group": {"_id": "$userId", "calls": {"$sum": 1}}},
+        {"$sort": {"calls": -1}},
+        {"$limit": limit},
+    ]
+    try:
+        return [row["_id"] for row in _collection(API_CALLS).aggregate(pipeline)]
+    except Exception as e:
+        logger.error(f"Failed to get hot users: {e}", exc_info=True)
+        return []
+
+
+def get_frequent_queries(user_ids: List[str], limit: int = 50, hours: float = 24) -> List[str]:
+    """
+    Returns the most frequent query texts of the given users in the last hours.
+    """
+    if not user_ids:
+        return []
+    since = datetime.utcnow() - timedelta(hours=hours)
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": since}, "userId": {"$in": user_ids}, "query": {"$type": "string"}}},
+        {"$group": {"_id": "$query", "calls": {"$sum": 1}}},
+        {"$sort": {"calls": -1}},
+        {"$limit": limit},
+    ]
+    try:
+        return [row["_id"] for row in _collection(API_CALLS).aggregate(pipeline)]
+    except Exception as e:
+        logger.error(f"Failed to get frequent queries: {e}", exc_info=True)
+        return []
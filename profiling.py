@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List
+from logging_config import setup_logging
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+# Profiling endpoints are disabled unless explicitly enabled
+PROFILING_ENABLED = os.getenv("ENABLE_PROFILING", "false").lower() in ("1", "true", "yes")
+MAX_PROFILE_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+MIN_SAMPLE_INTERVAL_MS = 5.0
+MAX_STACK_DEPTH = 64
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "5"))
+
+# Leaf functions of threads that are blocked rather than using CPU
+IDLE_FUNCTIONS = {"wait", "select", "poll", "epoll", "sleep", "accept", "_recv_into", "recv", "get", "_wait_for_tstate_lock"}
+
+# Only one profile (CPU or memory) runs at a time
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """
+    Raised when a profile is requested while another one is running.
+    """
+
+
+def _clamp_seconds(seconds: float) -> float:
+    return max(0.1, min(float(seconds), MAX_PROFILE_SECONDS))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_cpu(seconds: float = 10.0, interval_ms: float = 10.0, include_idle: bool = False) -> Dict[str, Any]:
+    """
+    Samples the stacks of all other threads for the given duration and returns
+    them in collapsed-stack format ("thread;outer;...;inner count"), ready for
+    flamegraph.pl or speedscope.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        seconds = _clamp_seconds(seconds)
+        interval = max(interval_ms, MIN_SAMPLE_INTERVAL_MS) / 1000
+        sampler_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                if not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                labels: List[str] = []
+                while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+        logger.info(f"CPU profile finished: {samples} samples over {seconds}s")
+        return {
+            "seconds": seconds,
+            "intervalMs": interval * 1000,
+            "samples": samples,
+            "collapsed": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+        }
+    finally:
+        _profile_lock.release()
+
+
+def allocation_diff(seconds: float = 10.0, top: int = 25, group_by: str = "lineno") -> Dict[str, Any]:
+    """
+    Takes two tracemalloc snapshots the given number of seconds apart and
+    returns the top allocation sites and their growth in between.
+    Tracing is only switched on for the duration of the call unless it was already running.
+    """
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise ValueError("group_by must be one of lineno, filename, traceback")
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    started_tracing = False
+    try:
+        seconds = _clamp_seconds(seconds)
+        top = max(1, min(int(top), 200))
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            started_tracing = True
+        ignore = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+        first = tracemalloc.take_snapshot().filter_traces(ignore)
+        time.sleep(seconds)
+        second = tracemalloc.take_snapshot().filter_traces(ignore)
+
+        def site(stat) -> str:
+            if group_by == "traceback":
+                return " <- ".join(f"{frame.filename}:{frame.lineno}" for frame in stat.traceback)
+            frame = stat.traceback[0]
+            return frame.filename if group_by == "filename" else f"{frame.filename}:{frame.lineno}"
+
+        growth = [
+            {
+                "site": site(stat),
+                "sizeKb": round(stat.size / 1024, 1),
+                "sizeDiffKb": round(stat.size_diff / 1024, 1),
+                "count": stat.count,
+                "countDiff": stat.count_diff,
+            }
+            for stat in second.compare_to(first, group_by)[:top]
+        ]
+        largest = [
+            {"site": site(stat), "sizeKb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in second.statistics(group_by)[:top]
+        ]
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+        return {
+            "seconds": seconds,
+            "groupBy": group_by,
+            "tracedCurrentKb": round(traced_current / 1024, 1),
+            "tracedPeakKb": round(traced_peak / 1024, 1),
+            "topGrowth": growth,
+            "topAllocations": largest,
+        }
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _profile_lock.release()
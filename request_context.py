@@ -0,0 +1,55 @@
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# Per-request monitoring fields and stage timeline, shared between the
+# monitoring middleware and the handler (including threadpool work it starts)
+_request_info: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_info", default=None)
+
+
+def begin_request() -> Dict[str, Any]:
+    """
+    Starts collecting monitoring fields for the current request.
+    The returned dict is shared with the handler through a context variable.
+    """
+    info: Dict[str, Any] = {"_start": time.perf_counter(), "timings": {}}
+    _request_info.set(info)
+    return info
+
+
+def current_request() -> Optional[Dict[str, Any]]:
+    return _request_info.get()
+
+
+def annotate_request(**fields: Any) -> None:
+    """
+    Records identifiers (user_id, thread_id, message_id, query, ...) for the current request.
+    The first call from a handler also closes the body-parse stage of the timeline.
+    Does nothing outside a monitored request.
+    """
+    info = _request_info.get()
+    if info is None:
+        return
+    timings = info["timings"]
+    if "parse" not in timings:
+        timings["parse"] = (time.perf_counter() - info["_start"]) * 1000
+    info.update(fields)
+
+
+def record_stage(stage: str, duration_ms: float) -> None:
+    """
+    Adds time spent in a stage to the current request's timeline (summed per stage).
+    """
+    info = _request_info.get()
+    if info is not None:
+        timings = info["timings"]
+        timings[stage] = timings.get(stage, 0.0) + duration_ms
+
+
+def server_timing_header(timings: Dict[str, float], total_ms: float) -> str:
+    """
+    Formats a stage timeline as a Server-Timing header value.
+    """
+    entries = [f"{stage};dur={duration:.2f}" for stage, duration in timings.items()]
+    entries.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(entries)
@@ -0,0 +1,152 @@
+import os
+import time
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from logging_config import setup_logging
+from metrics import REGISTRY, Counter, timed
+from request_context import current_request
+from result_cache import VersionedLRUCache
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched from the vector search and scored by the cross-encoder
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+# Documents kept after reranking unless the request asks for another number
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "5"))
+# Default end-to-end budget of a request using the reranker
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "800"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))
+
+rerank_results = REGISTRY.register(Counter(
+    "eoxs_rerank_total", "Rerank requests by outcome", ["outcome"]))
+
+
+class Reranker:
+    """
+    Second-stage cross-encoder (sentence-transformers, on CPU) that rescores
+    the vector-search candidates of a query in one batched forward pass.
+
+    The model is loaded in the background on first use. Scores are cached
+    per (query, document) hash. The stage is skipped, keeping the vector
+    order, while the model is loading or when the estimated scoring time
+    (EWMA per scored pair) would overrun the request's latency budget.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, cache_size: int = RERANK_CACHE_SIZE,
+                 max_length: int = RERANK_MAX_LENGTH):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.cache = VersionedLRUCache(max_entries=cache_size)
+        self._model = None
+        self._load_error: Optional[str] = None
+        self._loading = False
+        self._lock = threading.Lock()
+        # Smoothed scoring cost per (query, document) pair, used to predict a pass
+        self.ms_per_pair: Optional[float] = None
+        self.alpha = 0.2
+
+    def _load(self) -> None:
+        try:
+            from sentence_transformers import CrossEncoder
+            start = time.perf_counter()
+            model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+            # Warm-up pass so the first real request is not charged for lazy initialization
+            model.predict([("warm up", "warm up")])
+            self._model = model
+            logger.info("Loaded reranker %s in %.1fs", self.model_name, time.perf_counter() - start)
+        except Exception as e:
+            self._load_error = str(e)
+            logger.error(f"Failed to load reranker {self.model_name}: {e}", exc_info=True)
+        finally:
+            self._loading = False
+
+    def _ensure_loading(self) -> bool:
+        """
+        Returns True when the model is ready; otherwise starts loading it once.
+        """
+        if self._model is not None:
+            return True
+        with self._lock:
+            if self._model is None and not self._loading and self._load_error is None:
+                self._loading = True
+                threading.Thread(target=self._load, name="reranker-load", daemon=True).start()
+        return False
+
+    def _estimate_ms(self, pairs: int) -> float:
+        return self.ms_per_pair * pairs if self.ms_per_pair is not None else 0.0
+
+    def _observe(self, pairs: int, elapsed_ms: float) -> None:
+        per_pair = elapsed_ms / pairs
+        if self.ms_per_pair is None:
+            self.ms_per_pair = per_pair
+        else:
+            self.ms_per_pair += self.alpha * (per_pair - self.ms_per_pair)
+
+    @staticmethod
+    def _key(query: str, document: str) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(query.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(document.encode("utf-8"))
+        return digest.hexdigest()
+
+    def rerank(self, query: str, documents: List[str], top_k: int = RERANK_TOP_K,
+               budget_ms: Optional[float] = None) -> Tuple[List[int], Optional[List[float]], str]:
+        """
+        Orders documents by cross-encoder relevance to the query.
+        Returns (indexes of the kept documents, their scores, outcome). When the
+        stage is skipped the first top_k indexes are returned in vector order with
+        no scores; outcome says why ("reranked", "loading", "unavailable", "budget").
+        """
+        fallback = list(range(min(top_k, len(documents))))
+        if not documents:
+            return fallback, None, "reranked"
+        if self._load_error is not None:
+            rerank_results.inc(outcome="unavailable")
+            return fallback, None, "unavailable"
+        if not self._ensure_loading():
+            rerank_results.inc(outcome="loading")
+            return fallback, None, "loading"
+
+        keys = [self._key(query, document) for document in documents]
+        scores: List[Optional[float]] = [self.cache.get(key, 0) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing:
+            budget_ms = RERANK_BUDGET_MS if budget_ms is None else budget_ms
+            info = current_request()
+            spent_ms = (time.perf_counter() - info["_start"]) * 1000 if info else 0.0
+            if spent_ms + self._estimate_ms(len(missing)) > budget_ms:
+                rerank_results.inc(outcome="budget")
+                logger.info("Skipping rerank: %.0fms spent, %.0fms estimated, budget %.0fms",
+                            spent_ms, self._estimate_ms(len(missing)), budget_ms)
+                return fallback, None, "budget"
+            start = time.perf_counter()
+            with timed("rerank"):
+                # One batch: all uncached pairs go through a single forward pass
+                predicted = self._model.predict([(query, documents[i]) for i in missing], batch_size=len(missing))
+            self._observe(len(missing), (time.perf_counter() - start) * 1000)
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+                self.cache.put(keys[i], 0, scores[i])
+
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)[:top_k]
+        rerank_results.inc(outcome="reranked")
+        return order, [scores[i] for i in order], "reranked"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "loaded": self._model is not None,
+            "loading": self._loading,
+            "error": self._load_error,
+            "msPerPair": round(self.ms_per_pair, 3) if self.ms_per_pair is not None else None,
+            "cache": self.cache.stats(),
+        }
+
+
+reranker = Reranker()
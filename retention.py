@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import db
+from blob_store import blob_store
+from logging_config import setup_logging
+from utils import to_epoch
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "false").lower() in ("1", "true", "yes")
+# JSON list of policies, inline or in a file, e.g.
+# [{"userId": "*", "type": "user_message", "maxAgeDays": 365, "maxCount": 50000},
+#  {"userId": "user_123", "type": "ai_response", "keepSummarizedOnly": true}]
+RETENTION_POLICIES = os.getenv("RETENTION_POLICIES", "")
+RETENTION_POLICIES_PATH = os.getenv("RETENTION_POLICIES_PATH", "")
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.5"))
+# Rebuild a collection once this fraction of its vectors was deleted since the last rebuild
+RETENTION_REBUILD_RATIO = float(os.getenv("RETENTION_REBUILD_RATIO", "0.2"))
+# Unreferenced blobs younger than this are kept (they may belong to a write in flight)
+BLOB_SWEEP_MIN_AGE_SECONDS = float(os.getenv("BLOB_SWEEP_MIN_AGE_SECONDS", "3600"))
+# Seconds a rebuilt collection's predecessor stays readable after the switch, for
+# queries that resolved the old route just before it
+REBUILD_DROP_DELAY_SECONDS = float(os.getenv("REBUILD_DROP_DELAY_SECONDS", "5"))
+
+POLICY_KEYS = {"userId", "type", "maxAgeDays", "maxCount", "keepSummarizedOnly"}
+COPY_BATCH_SIZE = 500
+SCAN_PAGE_SIZE = 1000
+
+
+def load_policies() -> List[Dict[str, Any]]:
+    """
+    Reads and validates retention policies from RETENTION_POLICIES(_PATH).
+    """
+    raw = RETENTION_POLICIES
+    if RETENTION_POLICIES_PATH:
+        with open(RETENTION_POLICIES_PATH, "r", encoding="utf-8") as f:
+            raw = f.read()
+    policies = json.loads(raw) if raw.strip() else []
+    for policy in policies:
+        unknown = set(policy) - POLICY_KEYS
+        if unknown:
+            raise ValueError(f"Unknown retention policy keys: {sorted(unknown)}")
+        policy.setdefault("userId", "*")
+        policy.setdefault("type", "*")
+    return policies
+
+
+def policies_for(user_id: str, policies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Policies that apply to a user; a user-specific policy replaces the "*" one for the same type.
+    """
+    by_type: Dict[str, Dict[str, Any]] = {}
+    for policy in policies:
+        if policy["userId"] == "*":
+            by_type.setdefault(policy["type"], policy)
+    for policy in policies:
+        if policy["userId"] == user_id:
+            by_type[policy["type"]] = policy
+    return list(by_type.values())
+
+
+def _created_ts(metadata: Dict[str, Any]) -> float:
+    # Rows written before createdAtTs existed fall back to parsing createdAt
+    if "createdAtTs" in metadata:
+        return metadata["createdAtTs"]
+    return to_epoch(metadata.get("createdAt")) or 0.0
+
+
+def select_expired(ids: List[str], metadatas: List[Dict[str, Any]], policy: Dict[str, Any],
+                   now: float) -> List[str]:
+    """
+    Ids of documents (all of one type) that the policy removes. Documents with
+    no parseable createdAt count as oldest.
+    """
+    expired = set()
+    rows = [(doc_id, metadata or {}, _created_ts(metadata or {})) for doc_id, metadata in zip(ids, metadatas)]
+    if policy.get("maxAgeDays"):
+        cutoff = now - policy["maxAgeDays"] * 86400
+        expired.update(doc_id for doc_id, _, ts in rows if ts < cutoff)
+    if policy.get("keepSummarizedOnly"):
+        # Documents folded into a summary only survive as that summary
+        expired.update(doc_id for doc_id, metadata, _ in rows if metadata.get("summaryId"))
+    if policy.get("maxCount") is not None:
+        remaining = sorted((row for row in rows if row[0] not in expired), key=lambda row: row[2], reverse=True)
+        expired.update(doc_id for doc_id, _, _ in remaining[policy["maxCount"]:])
+    return [doc_id for doc_id in ids if doc_id in expired]
+
+
+def expired_in(collection, policy: Dict[str, Any], now: float) -> List[str]:
+    """
+    Ids the policy removes from a collection. Metadatas are read in pages; only
+    (id, timestamp) of the surviving rows is kept to apply maxCount at the end.
+    """
+    where = None if policy["type"] == "*" else {"type": policy["type"]}
+    per_page = {**policy, "maxCount": None}
+    expired: List[str] = []
+    survivors = []
+    for page in db.scan_pages(collection, where, ["metadatas"], SCAN_PAGE_SIZE):
+        page_expired = set(select_expired(page["ids"], page["metadatas"], per_page, now))
+        expired.extend(doc_id for doc_id in page["ids"] if doc_id in page_expired)
+        survivors.extend((doc_id, _created_ts(metadata or {}))
+                         for doc_id, metadata in zip(page["ids"], page["metadatas"]) if doc_id not in page_expired)
+    if policy.get("maxCount") is not None:
+        survivors.sort(key=lambda row: row[1], reverse=True)
+        expired.extend(doc_id for doc_id, _ in survivors[policy["maxCount"]:])
+    return expired
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def rebuild_collection(user_id: str) -> Dict[str, Any]:
+    """
+    Copies the user's live vectors into a fresh collection, switches the route
+    to it and drops the old one, so deleted entries stop occupying the index.
+    Writes made during the copy go to both collections; writes to the old one
+    are paused across the switch and again while it is dropped.
+    """
+    route = db.get_route(user_id)
+    if route["shadow"]:
+        return {"skipped": "migration in progress"}
+    source = db.get_or_create_collection(user_id)
+    target_name = f"{db.default_collection_name(user_id)}_r{int(time.time())}"
+    target = db.get_or_create_collection(user_id, target_name)
+    db.set_shadow(user_id, target_name, route["model"], route["dimensions"])
+    copied = 0
+    try:
+        for page in db.scan_pages(source, include=["embeddings", "documents", "metadatas"], page_size=COPY_BATCH_SIZE):
+            # add() skips ids that already exist: rows dual-written meanwhile are newer
+            with db.write_gate.writing(target_name):
+                target.add(ids=page["ids"], embeddings=page["embeddings"], documents=page["documents"],
+                           metadatas=page["metadatas"])
+            copied += len(page["ids"])
+        with db.write_gate.paused(source.name, db.SWITCH_PAUSE_TIMEOUT):
+            if target.count() < source.count():
+                raise RuntimeError(f"copied {target.count()} of {source.count()} documents")
+            db.promote_shadow(user_id, keep_previous=False)
+    except Exception:
+        db.clear_shadow(user_id)
+        db.get_client().delete_collection(target_name)
+        raise
+    time.sleep(REBUILD_DROP_DELAY_SECONDS)
+    # Writers that still held the old collection have drained; later ones re-route
+    with db.write_gate.paused(source.name, db.SWITCH_PAUSE_TIMEOUT):
+        db.get_client().delete_collection(source.name)
+    db.update_route(user_id, deletedSinceRebuild=0)
+    logger.info("Rebuilt collection of user %s: %s -> %s (%d vectors)", user_id, source.name, target_name, copied)
+    return {"from": source.name, "to": target_name, "vectors": copied}
+
+
+def sweep_blobs(min_age_seconds: float = BLOB_SWEEP_MIN_AGE_SECONDS) -> Dict[str, int]:
+    """
+    Deletes context blobs no longer referenced by any collection.
+    """
+    referenced = set()
+    for collection in db.get_client().list_collections():
+        for page in db.scan_pages(collection, {"contextRef": {"$ne": ""}}, ["metadatas"], SCAN_PAGE_SIZE):
+            referenced.update(metadata["contextRef"] for metadata in page["metadatas"])
+    cutoff = time.time() - min_age_seconds
+    removed, freed = 0, 0
+    for ref, _ in list(blob_store.refs()):
+        if ref in referenced:
+            continue
+        path = blob_store.path_for(ref)
+        if path and os.path.getmtime(path) < cutoff:
+            freed += blob_store.delete(ref)
+            removed += 1
+    return {"blobsDeleted": removed, "blobBytesReclaimed": freed}
+
+
+class Compactor:
+    """
+    Background retention: applies the policies in throttled delete batches,
+    rebuilds collections that accumulated many deletions and sweeps unused blobs.
+    """
+
+    def __init__(self, interval: float = RETENTION_INTERVAL_SECONDS, batch_size: int = RETENTION_BATCH_SIZE,
+                 batch_pause: float = RETENTION_BATCH_PAUSE, rebuild_ratio: float = RETENTION_REBUILD_RATIO):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.rebuild_ratio = rebuild_ratio
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _apply_user(self, user_id: str, policies: List[Dict[str, Any]], now: float) -> Dict[str, Any]:
+        collection = db.get_or_create_collection(user_id)
+        deleted = 0
+        for policy in policies_for(user_id, policies):
+            expired = expired_in(collection, policy, now)
+            for start in range(0, len(expired), self.batch_size):
+                if self._stop.is_set():
+                    return {"deleted": deleted}
+                deleted += db.delete_documents(user_id, expired[start:start + self.batch_size])
+                self._stop.wait(self.batch_pause)
+
+        result: Dict[str, Any] = {"deleted": deleted}
+        if deleted:
+            since_rebuild = db.get_route(user_id)["deletedSinceRebuild"] + deleted
+            db.update_route(user_id, deletedSinceRebuild=since_rebuild)
+            remaining = collection.count()
+            if since_rebuild / max(remaining + since_rebuild, 1) >= self.rebuild_ratio:
+                result["rebuild"] = rebuild_collection(user_id)
+        return result
+
+    def run_once(self, user_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Runs one retention pass and returns what was reclaimed.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            raise RuntimeError("A retention pass is already running")
+        try:
+            start = time.perf_counter()
+            policies = load_policies()
+            bytes_before = directory_size(db.persist_directory)
+            now = time.time()
+            users: Dict[str, Any] = {}
+            for user_id in user_ids or db.list_user_ids():
+                try:
+                    result = self._apply_user(user_id, policies, now)
+                    if result["deleted"] or "rebuild" in result:
+                        users[user_id] = result
+                except Exception as e:
+                    logger.error(f"Retention failed for user {user_id}: {e}", exc_info=True)
+                    users[user_id] = {"error": str(e)}
+            blobs = sweep_blobs()
+            bytes_after = directory_size(db.persist_directory)
+            self.last_report = {
+                "finishedAt": datetime.utcnow().isoformat() + "Z",
+                "seconds": round(time.perf_counter() - start, 1),
+                "vectorsDeleted": sum(result.get("deleted", 0) for result in users.values()),
+                "collectionsRebuilt": sum(1 for result in users.values() if "to" in result.get("rebuild", {})),
+                # Net change of the persist directory. SQLite reuses freed pages
+                # instead of shrinking, so deletions alone rarely lower it.
+                "persistBytesBefore": bytes_before,
+                "persistBytesAfter": bytes_after,
+                "persistBytesDelta": bytes_after - bytes_before,
+                **blobs,
+                "users": users,
+            }
+            logger.info("Retention pass finished: %s", {k: v for k, v in self.last_report.items() if k != "users"})
+            return self.last_report
+        finally:
+            self._run_lock.release()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Retention pass failed: {e}", exc_info=True)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="retention-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": RETENTION_ENABLED,
+            "running": self._run_lock.locked(),
+            "intervalSeconds": self.interval,
+            "policies": load_policies(),
+            "lastRun": self.last_report,
+        }
+
+
+compactor = Compactor()
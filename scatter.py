@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import heapq
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+from db import query_similar_any_thread
+from logging_config import setup_logging
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+SCATTER_WORKERS = int(os.getenv("SCATTER_WORKERS", "16"))
+SCATTER_TIMEOUT_MS = float(os.getenv("SCATTER_TIMEOUT_MS", "2000"))
+SCATTER_MAX_USERS = int(os.getenv("SCATTER_MAX_USERS", "200"))
+# Workers one multi-user search may occupy at a time, so one request cannot starve the others
+SCATTER_MAX_PER_REQUEST = int(os.getenv("SCATTER_MAX_PER_REQUEST", str(max(1, SCATTER_WORKERS // 4))))
+# Named groups of users, as JSON {"team-a": ["user_1", "user_2"]}, inline or in a file
+USER_GROUPS = os.getenv("USER_GROUPS", "")
+USER_GROUPS_PATH = os.getenv("USER_GROUPS_PATH", "")
+
+# Shared by all multi-user searches so fan-out is bounded process-wide
+_executor = ThreadPoolExecutor(max_workers=SCATTER_WORKERS, thread_name_prefix="scatter")
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised by a collection search that was still queued when its deadline passed.
+    """
+
+
+def load_groups() -> Dict[str, List[str]]:
+    raw = USER_GROUPS
+    if USER_GROUPS_PATH:
+        with open(USER_GROUPS_PATH, "r", encoding="utf-8") as f:
+            raw = f.read()
+    return json.loads(raw) if raw.strip() else {}
+
+
+def resolve_users(user_ids: Optional[List[str]], group: Optional[str]) -> List[str]:
+    """
+    The users a multi-user search covers: explicit ids plus the members of a group.
+    Raises ValueError for an unknown group, no users or too many users.
+    """
+    users = list(user_ids or [])
+    if group:
+        groups = load_groups()
+        if group not in groups:
+            raise ValueError(f"Unknown group: {group}")
+        users.extend(groups[group])
+    users = list(dict.fromkeys(users))
+    if not users:
+        raise ValueError("Provide userIds or a group")
+    if len(users) > SCATTER_MAX_USERS:
+        raise ValueError(f"At most {SCATTER_MAX_USERS} users can be searched at once")
+    return users
+
+
+def _search_one(user_id: str, embedding: List[float], deadline: float, **query: Any) -> Dict[str, Any]:
+    # Searches that only start after the deadline would be discarded anyway
+    if time.perf_counter() >= deadline:
+        raise DeadlineExceeded(user_id)
+    return query_similar_any_thread(user_id, embedding, **query)
+
+
+def scatter_search(embeddings: Dict[str, List[float]], top_k: int, timeout_ms: float = SCATTER_TIMEOUT_MS,
+                   max_parallel: int = SCATTER_MAX_PER_REQUEST, **query: Any) -> Dict[str, Any]:
+    """
+    Searches every user's collection in parallel (embeddings maps user id to
+    the query vector for that user's model) and merges the hits into a global
+    top_k with a bounded heap. At most max_parallel searches of one call are
+    on the shared pool at a time; the rest are submitted as those finish.
+    Collections that miss the deadline or fail are reported and left out, so
+    the result may be partial.
+    query holds the keyword arguments of db.query_similar_any_thread; include
+    must contain distances.
+    """
+    deadline = time.perf_counter() + timeout_ms / 1000
+    queued = list(embeddings.items())
+    futures: Dict[Any, str] = {}
+    running: set = set()
+    done: set = set()
+    while queued or running:
+        while queued and len(running) < max_parallel:
+            user_id, embedding = queued.pop(0)
+            future = _executor.submit(_search_one, user_id, embedding, deadline, top_k=top_k, **query)
+            futures[future] = user_id
+            running.add(future)
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        finished, running = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+        done |= finished
+    # A search already inside ChromaDB cannot be interrupted; it holds one of
+    # this call's max_parallel workers until it returns and its result is dropped
+    for future in running:
+        future.cancel()
+    timed_out = sorted([futures[future] for future in running] + [user_id for user_id, _ in queued])
+
+    # Min-heap of the best top_k hits: (score, tiebreak, hit)
+    heap: List[tuple] = []
+    failed = []
+    for future in done:
+        user_id = futures[future]
+        try:
+            results = future.result()
+        except DeadlineExceeded:
+            timed_out.append(user_id)
+            continue
+        except Exception as e:
+            logger.warning("Multi-user search failed for user %s: %s", user_id, e)
+            failed.append(user_id)
+            continue
+        documents = (results.get("documents") or [None])[0]
+        metadatas = (results.get("metadatas") or [None])[0]
+        for i, (doc_id, distance) in enumerate(zip(results["ids"][0], results["distances"][0])):
+            hit = {
+                "userId": user_id,
+                "id": doc_id,
+                "score": 1 - distance,
+                "document": documents[i] if documents else None,
+                "metadata": metadatas[i] if metadatas else None,
+            }
+            entry = (hit["score"], f"{user_id}\0{doc_id}", hit)
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    if timed_out or failed:
+        logger.info("Multi-user search partial: %d timed out, %d failed of %d", len(timed_out), len(failed), len(embeddings))
+    return {
+        "hits": [entry[2] for entry in sorted(heap, key=lambda entry: entry[:2], reverse=True)],
+        "searched": len(embeddings) - len(timed_out) - len(failed),
+        "timedOut": sorted(timed_out),
+        "failed": sorted(failed),
+    }
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+from logging_config import setup_logging
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+
+def make_key(*parts: Any) -> Tuple[str, ...]:
+    """
+    Builds a hashable coalescing key from request parts (dicts and lists included).
+    """
+    return tuple(
+        part if isinstance(part, str) else json.dumps(part, sort_keys=True, default=str)
+        for part in parts
+    )
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one in-flight computation.
+
+    The first caller for a key starts the computation as its own task; callers
+    arriving while it is still running await the same task and receive the same
+    result (or exception). Cancelling one waiter never cancels the shared work.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._started: Dict[str, int] = {}
+        self._coalesced: Dict[str, int] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs fn() once for all concurrent callers with the same key.
+        The first element of the key is used as the counter label (the endpoint).
+        """
+        label = key[0] if isinstance(key, tuple) and key else str(key)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+            self._count(self._started, label)
+        else:
+            self._count(self._coalesced, label)
+            logger.debug("Coalesced request onto in-flight computation for %s", label)
+        return await asyncio.shield(task)
+
+    def _count(self, counters: Dict[str, int], label: str) -> None:
+        with self._lock:
+            counters[label] = counters.get(label, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns executed vs coalesced counters, overall and per endpoint.
+        """
+        with self._lock:
+            started = dict(self._started)
+            coalesced = dict(self._coalesced)
+        total_started = sum(started.values())
+        total_coalesced = sum(coalesced.values())
+        total = total_started + total_coalesced
+        return {
+            "executed": total_started,
+            "coalesced": total_coalesced,
+            "coalescedRatio": round(total_coalesced / total, 4) if total else 0.0,
+            "inFlight": len(self._inflight),
+            "byEndpoint": {
+                endpoint: {
+                    "executed": started.get(endpoint, 0),
+                    "coalesced": coalesced.get(endpoint, 0),
+                }
+                for endpoint in sorted(set(started) | set(coalesced))
+            },
+        }
+
+
+# Shared instance used in front of the query endpoints
+query_flight = SingleFlight()
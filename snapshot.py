@@ -0,0 +1,303 @@
+"""
+Online snapshots of CHROMA_PERSIST_PATH and restore from them.
+
+A snapshot is taken while the service keeps serving:
+
+1. each collection's HNSW segment directory is copied without blocking
+   writers and the copy is kept only if no write to that collection overlapped
+   it (db.write_gate.write_count); after SNAPSHOT_COPY_ATTEMPTS busy attempts
+   writes to that one collection are paused for the copy, so no index file is
+   copied mid-flush;
+2. chroma.sqlite3 and the other SQLite files are copied with the SQLite
+   backup API. Chroma replays the embeddings log past each index's saved
+   position on load, so writes made after step 1 are not lost;
+3. blobs (immutable, content-addressed) are hardlinked, JSON state is copied;
+4. manifest.json records the files, sizes, the blob store's location and how
+   long each collection was paused.
+
+Restore (with the service stopped) copies a snapshot into place:
+
+    python snapshot.py create [--dest ./snapshots]
+    python snapshot.py list
+    python snapshot.py restore ./snapshots/snapshot-20250101T000000Z [--force]
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import db
+from blob_store import blob_store
+from logging_config import setup_logging
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "./snapshots")
+# Snapshots kept when a new one is taken (0 keeps all)
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "7"))
+# How long a snapshot waits for in-flight writes to one collection to drain
+SNAPSHOT_PAUSE_TIMEOUT = float(os.getenv("SNAPSHOT_PAUSE_TIMEOUT", "30"))
+# Copies of a collection's index attempted without pausing before writes to it are paused
+SNAPSHOT_COPY_ATTEMPTS = int(os.getenv("SNAPSHOT_COPY_ATTEMPTS", "3"))
+
+MANIFEST_NAME = "manifest.json"
+CHROMA_SQLITE = "chroma.sqlite3"
+
+_snapshot_lock = threading.Lock()
+
+
+class SnapshotRunning(Exception):
+    """
+    Raised when a snapshot is requested while another one is being taken.
+    """
+
+
+def _vector_segments(sqlite_path: str) -> Dict[str, str]:
+    """
+    Maps collection name to the id (directory name) of its HNSW segment.
+    """
+    conn = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT c.name, s.id FROM segments s JOIN collections c ON s.collection = c.id WHERE s.scope = 'VECTOR'"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {name: segment_id for name, segment_id in rows}
+
+
+def _backup_sqlite(source: str, target: str) -> int:
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        with dst:
+            src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return os.path.getsize(target)
+
+
+def _link_tree(source: str, target: str) -> int:
+    """
+    Hardlinks every file of source into target (copies across filesystems); returns bytes.
+    """
+    size = 0
+    for root, _, files in os.walk(source):
+        relative = os.path.relpath(root, source)
+        os.makedirs(os.path.join(target, relative), exist_ok=True)
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            src, dst = os.path.join(root, name), os.path.join(target, relative, name)
+            if os.path.exists(dst):
+                # Content-addressed: an existing file already holds the same bytes
+                size += os.path.getsize(dst)
+                continue
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+            size += os.path.getsize(dst)
+    return size
+
+
+def _copy_segment(collection_name: str, segment_dir: str, target: str, attempts: int,
+                  pause_timeout: float) -> Dict[str, Any]:
+    """
+    Copies a collection's index directory once no write overlapped the copy,
+    pausing writes to the collection only when every attempt was disturbed.
+    """
+    for attempt in range(attempts):
+        before = db.write_gate.write_count(collection_name)
+        if before is not None:
+            # Index files are rewritten in place, so they are copied rather than linked
+            shutil.copytree(segment_dir, target)
+            if db.write_gate.write_count(collection_name) == before:
+                return {"attempts": attempt + 1, "pausedMs": 0.0}
+            shutil.rmtree(target)
+        time.sleep(0.05 * (attempt + 1))
+    with db.write_gate.paused(collection_name, pause_timeout):
+        paused_at = time.perf_counter()
+        shutil.copytree(segment_dir, target)
+        return {"attempts": attempts + 1, "pausedMs": round((time.perf_counter() - paused_at) * 1000, 1)}
+
+
+def _snapshot_name(dest: str) -> str:
+    base = "snapshot-" + datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    name, suffix = base, 1
+    while os.path.exists(os.path.join(dest, name)) or os.path.exists(os.path.join(dest, name + ".partial")):
+        name = f"{base}-{suffix}"
+        suffix += 1
+    return name
+
+
+def create_snapshot(dest: str = SNAPSHOT_PATH, keep: int = SNAPSHOT_KEEP,
+                    pause_timeout: float = SNAPSHOT_PAUSE_TIMEOUT,
+                    copy_attempts: int = SNAPSHOT_COPY_ATTEMPTS) -> Dict[str, Any]:
+    """
+    Takes a consistent snapshot of the persist directory and returns its manifest.
+    """
+    if not _snapshot_lock.acquire(blocking=False):
+        raise SnapshotRunning("A snapshot is already being taken")
+    try:
+        start = time.perf_counter()
+        source = db.persist_directory
+        name = _snapshot_name(dest)
+        partial = os.path.join(dest, name + ".partial")
+        os.makedirs(partial)
+        # Make sure the client (and its schema) exists before reading the segments table
+        db.get_client()
+
+        collections = []
+        for collection_name, segment_id in sorted(_vector_segments(os.path.join(source, CHROMA_SQLITE)).items()):
+            segment_dir = os.path.join(source, segment_id)
+            entry: Dict[str, Any] = {"name": collection_name, "segment": segment_id, "bytes": 0, "pausedMs": 0.0}
+            if os.path.isdir(segment_dir):
+                entry.update(_copy_segment(collection_name, segment_dir, os.path.join(partial, segment_id),
+                                           copy_attempts, pause_timeout))
+                entry["bytes"] = sum(os.path.getsize(os.path.join(partial, segment_id, f))
+                                     for f in os.listdir(os.path.join(partial, segment_id)))
+            collections.append(entry)
+
+        sqlite_files = {}
+        for file_name in sorted(os.listdir(source)):
+            if file_name.endswith(".sqlite3"):
+                sqlite_files[file_name] = _backup_sqlite(os.path.join(source, file_name), os.path.join(partial, file_name))
+            elif file_name.endswith(".json"):
+                shutil.copy2(os.path.join(source, file_name), os.path.join(partial, file_name))
+
+        # Blobs are restored where the snapshot found them: relative to the
+        # persist directory when they live inside it, else to the same absolute root
+        blobs: Dict[str, Any] = {"path": None, "root": os.path.abspath(blob_store.root), "relative": None, "bytes": 0}
+        if os.path.isdir(blob_store.root):
+            relative = os.path.relpath(blob_store.root, source)
+            if not relative.startswith(".."):
+                blobs["relative"] = relative
+            blobs["path"] = relative if blobs["relative"] else "blobs"
+            blobs["bytes"] = _link_tree(blob_store.root, os.path.join(partial, blobs["path"]))
+        blobs_bytes = blobs["bytes"]
+
+        total = sum(entry["bytes"] for entry in collections) + sum(sqlite_files.values()) + blobs_bytes
+        manifest = {
+            "name": name,
+            "createdAt": datetime.utcnow().isoformat() + "Z",
+            "source": os.path.abspath(source),
+            "collections": collections,
+            "sqlite": sqlite_files,
+            "blobs": blobs,
+            "bytes": total,
+            "maxPausedMs": max((entry["pausedMs"] for entry in collections), default=0.0),
+            "durationSeconds": round(time.perf_counter() - start, 2),
+        }
+        with open(os.path.join(partial, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(partial, os.path.join(dest, name))
+        logger.info("Snapshot %s: %d collections, %d bytes in %ss", name, len(collections), total,
+                    manifest["durationSeconds"])
+        if keep:
+            for old in list_snapshots(dest)[keep:]:
+                shutil.rmtree(os.path.join(dest, old["name"]), ignore_errors=True)
+        return manifest
+    finally:
+        _snapshot_lock.release()
+
+
+def list_snapshots(dest: str = SNAPSHOT_PATH) -> List[Dict[str, Any]]:
+    """
+    Manifests of the complete snapshots in dest, newest first.
+    """
+    if not os.path.isdir(dest):
+        return []
+    manifests = []
+    for name in os.listdir(dest):
+        if name.endswith(".partial"):
+            continue
+        path = os.path.join(dest, name, MANIFEST_NAME)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            manifests.append({key: manifest.get(key) for key in ("name", "createdAt", "bytes", "durationSeconds")})
+    return sorted(manifests, key=lambda manifest: manifest["name"], reverse=True)
+
+
+def restore_snapshot(snapshot: str, target: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+    """
+    Copies a snapshot into the persist directory. The service must be stopped.
+    An existing persist directory is moved aside unless it is empty; force is
+    required to do that. Blobs kept outside the persist directory are merged
+    back into their recorded root.
+    """
+    start = time.perf_counter()
+    target = target or db.persist_directory
+    with open(os.path.join(snapshot, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    blobs = manifest["blobs"]
+    blobs_target = None
+    if blobs["path"]:
+        # Manifests without a root predate it and always kept blobs under the target
+        relative = blobs.get("relative") if "root" in blobs else blobs["path"]
+        blobs_target = os.path.join(target, relative) if relative else blobs["root"]
+    previous = None
+    if os.path.isdir(target) and os.listdir(target):
+        if not force:
+            raise ValueError(f"{target} is not empty (use --force to move it aside)")
+        previous = f"{target.rstrip(os.sep)}.before-{manifest['name']}"
+        os.replace(target, previous)
+    # Blobs are immutable and can be shared with the snapshot; Chroma and
+    # SQLite files are written in place, so they are copied
+    os.makedirs(target, exist_ok=True)
+    if blobs_target:
+        _link_tree(os.path.join(snapshot, blobs["path"]), blobs_target)
+    blobs_entry = blobs["path"] and blobs["path"].split(os.sep)[0]
+    for entry in os.listdir(snapshot):
+        src, dst = os.path.join(snapshot, entry), os.path.join(target, entry)
+        if entry in (MANIFEST_NAME, blobs_entry):
+            continue
+        if os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy2(src, dst)
+    result = {
+        "snapshot": manifest["name"],
+        "target": os.path.abspath(target),
+        "previous": previous,
+        "blobs": blobs_target and os.path.abspath(blobs_target),
+        "bytes": manifest["bytes"],
+        "durationSeconds": round(time.perf_counter() - start, 2),
+    }
+    logger.info("Restored %s", result)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Snapshot or restore the Chroma persist directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create_parser = commands.add_parser("create", help="Take a snapshot")
+    create_parser.add_argument("--dest", default=SNAPSHOT_PATH, help="Directory holding snapshots")
+    create_parser.add_argument("--keep", type=int, default=SNAPSHOT_KEEP, help="Snapshots to keep (0 = all)")
+    list_parser = commands.add_parser("list", help="List snapshots")
+    list_parser.add_argument("--dest", default=SNAPSHOT_PATH, help="Directory holding snapshots")
+    restore_parser = commands.add_parser("restore", help="Restore a snapshot (service stopped)")
+    restore_parser.add_argument("snapshot", help="Snapshot directory")
+    restore_parser.add_argument("--target", help="Persist directory (default: CHROMA_PERSIST_PATH)")
+    restore_parser.add_argument("--force", action="store_true", help="Move a non-empty target aside")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        manifest = create_snapshot(args.dest, args.keep)
+        logger.info("Snapshot written: %s", json.dumps({key: manifest[key] for key in ("name", "bytes", "maxPausedMs", "durationSeconds")}))
+    elif args.command == "list":
+        for manifest in list_snapshots(args.dest):
+            print(json.dumps(manifest))
+    else:
+        restore_snapshot(args.snapshot, args.target, args.force)
+
+
+if __name__ == "__main__":
+    main()
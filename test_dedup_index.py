@@ -0,0 +1,85 @@
+"""
+The dedup index follows every write path, concurrent copies store one vector,
+and rag-generate reports the stored answer when its response is deduplicated.
+Run with: python -m pytest test_dedup_index.py
+"""
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from fastapi.testclient import TestClient
+import app as service
+import db
+from dedup import deduplicator
+
+
+def test_bulk_writes_are_indexed_for_exact_dedup():
+    content = "Quarterly steel order for plant 7"
+    embedding = service.generate_embedding(content)
+    db.add_documents("bulk_user", ["imported_1"], [embedding],
+                     [{"content": content, "type": "user_message", "threadId": "t1"}])
+
+    with TestClient(service.app) as client:
+        response = client.post("/embed", json={
+            "userId": "bulk_user", "messageId": "api_1", "threadId": "t1", "content": content,
+        })
+    assert response.status_code == 200
+    assert response.json()["duplicateOf"] == "imported_1"
+    assert deduplicator.resolve("bulk_user", "api_1") == "imported_1"
+
+
+class _FakeChat:
+    def __init__(self, answer):
+        reply = SimpleNamespace(message=SimpleNamespace(content=answer))
+        self.completions = SimpleNamespace(create=lambda **kwargs: SimpleNamespace(choices=[reply], usage=None))
+
+
+def test_rag_generate_returns_canonical_id_for_duplicate_answer(monkeypatch):
+    monkeypatch.setattr(service, "get_chat_client", lambda: SimpleNamespace(chat=_FakeChat("Plant 7 ships on Friday.")))
+    request = {"userId": "rag_user", "threadId": "t1", "query": "when does plant 7 ship"}
+    with TestClient(service.app) as client:
+        first = client.post("/rag-generate", json=request).json()
+        second = client.post("/rag-generate", json={**request, "query": "plant 7 shipping day"}).json()
+
+    assert first["duplicateOf"] is None
+    assert second["duplicateOf"] == first["responseId"]
+    assert second["responseId"] == first["responseId"]
+    stored = db.get_or_create_collection("rag_user").get(ids=[second["responseId"]])
+    assert stored["ids"] == [first["responseId"]]
+
+
+def test_concurrent_identical_writes_store_one_vector(monkeypatch):
+    embed = service.generate_embedding
+
+    def slow_embedding(text, **kwargs):
+        time.sleep(0.2)
+        return embed(text, **kwargs)
+
+    monkeypatch.setattr(service, "generate_embedding", slow_embedding)
+    metadata = {"content": "Coil 4411 delayed to Monday", "type": "user_message", "threadId": "t1"}
+    results = {}
+    writers = [threading.Thread(target=lambda doc_id=doc_id: results.__setitem__(
+        doc_id, service._store_document("race_user", doc_id, dict(metadata), {}))) for doc_id in ("race_a", "race_b")]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(5)
+
+    stored = [doc_id for doc_id, canonical in results.items() if canonical is None]
+    assert len(stored) == 1
+    assert db.get_or_create_collection("race_user").count() == 1
+    duplicate = next(doc_id for doc_id in results if doc_id not in stored)
+    assert results[duplicate] == stored[0]
+
+
+def test_failed_write_releases_its_hash(monkeypatch):
+    def failing_embedding(text, **kwargs):
+        raise RuntimeError("provider down")
+
+    metadata = {"content": "Ship the slit coils first", "type": "user_message", "threadId": "t1"}
+    with monkeypatch.context() as patch:
+        patch.setattr(service, "generate_embedding", failing_embedding)
+        with pytest.raises(RuntimeError):
+            service._store_document("release_user", "first", dict(metadata), {})
+
+    assert service._store_document("release_user", "second", dict(metadata), {}) is None
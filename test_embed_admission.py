@@ -0,0 +1,30 @@
+"""
+/embed must not block the event loop, or the load shedder's loop-lag check
+rejects every other request. Run with: python -m pytest test_embed_admission.py
+"""
+import time
+from fastapi.testclient import TestClient
+import app as service
+from admission import load_shedder
+
+
+def test_slow_embed_does_not_trip_loop_lag(monkeypatch):
+    real_embedding = service.generate_embedding
+
+    def slow_embedding(text, **spec):
+        # Well above MAX_LOOP_LAG_MS if it ran on the event loop
+        time.sleep(load_shedder.max_loop_lag_ms * 2 / 1000)
+        return real_embedding(text, **spec)
+
+    monkeypatch.setattr(service, "generate_embedding", slow_embedding)
+    with TestClient(service.app) as client:
+        statuses = []
+        for i in range(3):
+            response = client.post("/embed", json={
+                "userId": "shedder_user", "messageId": f"m{i}", "threadId": "t1", "content": f"slow message {i}",
+            })
+            statuses.append(response.status_code)
+            statuses.append(client.post("/query", json={"userId": "shedder_user", "threadId": "t1",
+                                                       "query": "slow message"}).status_code)
+        assert statuses == [200] * 6
+        assert load_shedder.loop_lag_ms < load_shedder.max_loop_lag_ms
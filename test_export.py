@@ -0,0 +1,57 @@
+"""
+Exports read the collection in pages, round-trip through an import and do not
+import context references this node cannot resolve.
+Run with: python -m pytest test_export.py
+"""
+import io
+import pytest
+import export
+import db
+from blob_store import blob_store
+from embedding import generate_embeddings
+
+
+def _ingest(user_id, count):
+    contents = [f"mill certificate {i}" for i in range(count)]
+    db.add_documents(user_id, [f"e{i}" for i in range(count)], generate_embeddings(contents),
+                     [{"content": c, "type": "user_message", "threadId": "t1"} for c in contents])
+
+
+def test_export_reads_bounded_pages(monkeypatch):
+    _ingest("export_pages", 25)
+    collection = db.get_or_create_collection("export_pages")
+    calls = []
+    get = type(collection).get
+
+    def spy(self, *args, **kwargs):
+        calls.append(kwargs.get("limit"))
+        return get(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(collection), "get", spy)
+    parts = list(export.export_parts("export_pages", page_size=10))
+
+    assert [ndjson.count(b"\n") for _, ndjson, _ in parts] == [10, 10, 5]
+    assert calls and all(limit == 10 for limit in calls)
+
+
+def test_export_round_trip():
+    _ingest("export_source", 12)
+    archive = io.BytesIO(b"".join(export.iter_export_tar("export_source", page_size=5)))
+    result = export.import_stream("export_target", archive)
+
+    assert result["documents"] == 12
+    assert db.collection_size("export_target") == 12
+
+
+def test_import_rejects_context_refs_missing_here(monkeypatch, tmp_path):
+    db.add_document("export_refs", "ai_1", generate_embeddings(["answer"])[0], {
+        "content": "answer", "type": "ai_response", "threadId": "t1", "context": "retrieved context " * 20,
+    })
+    archive = b"".join(export.iter_export_tar("export_refs", include_context=False))
+    # Same node: the referenced blob exists
+    assert export.import_stream("export_refs_copy", io.BytesIO(archive))["documents"] == 1
+
+    monkeypatch.setattr(blob_store, "root", str(tmp_path / "other_node_blobs"))
+    with pytest.raises(ValueError, match="missing from this node's blob store"):
+        export.import_stream("export_refs_elsewhere", io.BytesIO(archive))
+    assert db.collection_size("export_refs_elsewhere") == 0
@@ -0,0 +1,42 @@
+"""
+Percentile queries over the latency rollups with timezone-aware windows
+(as FastAPI parses ?since=...Z). Run with: python -m pytest test_latency_rollups.py
+"""
+from datetime import datetime, timedelta, timezone
+import monitoring
+
+
+class _FakeRollupCollection:
+    def __init__(self):
+        self.filters = []
+
+    def find(self, filter_query, projection=None):
+        self.filters.append(filter_query)
+        return []
+
+
+def test_percentiles_accept_aware_window(monkeypatch):
+    collection = _FakeRollupCollection()
+    monkeypatch.setattr(monitoring, "_collection", lambda name: collection)
+    rollups = monitoring.LatencyRollups()
+    monkeypatch.setattr(monitoring, "latency_rollups", rollups)
+    for duration in (10.0, 20.0, 30.0):
+        rollups.record("/query", "success", "total", duration)
+
+    now = datetime.now(timezone.utc)
+    since = datetime.fromisoformat((now - timedelta(minutes=5)).strftime("%Y-%m-%dT%H:%M:%S") + "+00:00")
+    result = monitoring.get_latency_percentiles(since=since, until=now + timedelta(minutes=1))
+
+    assert result["/query"]["count"] == 3
+    window = collection.filters[0]["minute"]
+    assert window["$gte"].tzinfo is None and window["$lte"].tzinfo is None
+    assert window["$gte"] == since.replace(tzinfo=None)
+
+
+def test_pending_converts_offsets_to_utc():
+    rollups = monitoring.LatencyRollups()
+    rollups.record("/embed", "success", "total", 5.0)
+    # The same instant written with a +02:00 offset
+    now = datetime.now(timezone(timedelta(hours=2)))
+    assert len(rollups.pending(now - timedelta(minutes=2), now + timedelta(minutes=1))) == 1
+    assert rollups.pending(now + timedelta(minutes=2), now + timedelta(minutes=3)) == []
@@ -0,0 +1,64 @@
+"""
+Writes racing a collection switch end up in the promoted collection.
+Run with: python -m pytest test_migration_switch.py
+"""
+import threading
+import db
+import migration  # noqa: F401  (registers the dual-write hook)
+from embedding import generate_embedding
+
+
+def _start_shadow(user_id):
+    db.add_document(user_id, "seed", generate_embedding("seed"), {"content": "seed", "type": "user_message"})
+    route = db.get_route(user_id)
+    shadow_name = db.default_collection_name(user_id) + "_switch"
+    db.get_or_create_collection(user_id, shadow_name)
+    db.set_shadow(user_id, shadow_name, route["model"], route["dimensions"])
+    return route["collection"], shadow_name
+
+
+def _switch(source_name, user_id):
+    with db.write_gate.paused(source_name, 5):
+        db.promote_shadow(user_id)
+
+
+def test_promote_waits_for_a_write_to_reach_the_shadow(monkeypatch):
+    user_id = "switch_inflight"
+    source_name, shadow_name = _start_shadow(user_id)
+    in_hook, release = threading.Event(), threading.Event()
+
+    def slow_hook(*args):
+        in_hook.set()
+        release.wait(5)
+
+    monkeypatch.setattr(db, "_write_hooks", [slow_hook] + db._write_hooks)
+    writer = threading.Thread(target=db.add_document, args=(
+        user_id, "late", generate_embedding("late"), {"content": "late", "type": "user_message"}))
+    writer.start()
+    assert in_hook.wait(5)
+    switcher = threading.Thread(target=_switch, args=(source_name, user_id))
+    switcher.start()
+    switcher.join(0.2)
+    assert db.get_route(user_id)["collection"] == source_name
+    release.set()
+    writer.join(5)
+    switcher.join(5)
+
+    assert db.get_route(user_id)["collection"] == shadow_name
+    assert db.get_or_create_collection(user_id, shadow_name).get(ids=["late"])["ids"] == ["late"]
+
+
+def test_write_blocked_by_the_switch_goes_to_the_new_collection():
+    user_id = "switch_blocked"
+    source_name, shadow_name = _start_shadow(user_id)
+    with db.write_gate.paused(source_name, 5):
+        writer = threading.Thread(target=db.add_document, args=(
+            user_id, "blocked", generate_embedding("blocked"), {"content": "blocked", "type": "user_message"}))
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+        db.promote_shadow(user_id)
+    writer.join(5)
+
+    assert db.get_or_create_collection(user_id, shadow_name).get(ids=["blocked"])["ids"] == ["blocked"]
+    assert db.get_or_create_collection(user_id, source_name).get(ids=["blocked"])["ids"] == []
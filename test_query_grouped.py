@@ -0,0 +1,34 @@
+"""
+Grouped retrieval only accepts the options it honours and never fetches more
+than GROUPED_MAX_CANDIDATES in its shared search. Run with: python -m pytest test_query_grouped.py
+"""
+from fastapi.testclient import TestClient
+import app as service
+import db
+from models import GroupedQueryRequest
+
+
+def test_grouped_request_has_no_rag_options():
+    fields = set(GroupedQueryRequest.model_fields)
+    assert not fields & {"rerank", "rerankTopK", "latencyBudgetMs", "recentMessages"}
+
+
+def test_first_fetch_is_capped(monkeypatch):
+    contents = [f"coil order {i}" for i in range(30)]
+    db.add_documents("grouped_user", [f"g{i}" for i in range(30)], [service.generate_embedding(c) for c in contents],
+                     [{"content": c, "type": "user_message", "threadId": "t1"} for c in contents])
+    fetched = []
+    query = service.query_similar_any_thread
+
+    def spy(*args, **kwargs):
+        fetched.append(kwargs["top_k"])
+        return query(*args, **kwargs)
+
+    monkeypatch.setattr(service, "query_similar_any_thread", spy)
+    monkeypatch.setattr(service, "GROUPED_MAX_CANDIDATES", 12)
+    with TestClient(service.app) as client:
+        response = client.post("/query-grouped", json={"userId": "grouped_user", "query": "coil order", "topK": 10})
+
+    assert response.status_code == 200
+    assert fetched[0] == 12
+    assert len(response.json()["groups"]["user_message"]) == 10
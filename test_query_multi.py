@@ -0,0 +1,54 @@
+"""
+Multi-user search: per-request share of the scatter pool, unknown users and
+per-caller admission. Run with: python -m pytest test_query_multi.py
+"""
+import threading
+import time
+from fastapi.testclient import TestClient
+import app as service
+import db
+import scatter
+from admission import user_limiter
+
+
+def test_one_search_holds_at_most_its_share_of_the_pool(monkeypatch):
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def search(user_id, embedding, **query):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.02)
+        with lock:
+            state["running"] -= 1
+        return {"ids": [[f"{user_id}_doc"]], "distances": [[0.5]]}
+
+    monkeypatch.setattr(scatter, "query_similar_any_thread", search)
+    merged = scatter.scatter_search({f"user_{i}": [1.0] for i in range(12)}, top_k=3, max_parallel=3)
+
+    assert state["peak"] == 3
+    assert merged["searched"] == 12 and len(merged["hits"]) == 3
+
+
+def test_unknown_users_are_reported_not_created():
+    content = "Invoice for the rolled coil shipment"
+    db.add_document("multi_known", "m1", service.generate_embedding(content),
+                    {"content": content, "type": "user_message", "threadId": "t1"})
+
+    with TestClient(service.app) as client:
+        response = client.post("/query-multi", json={"userIds": ["multi_known", "multi_ghost"], "query": content})
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["missing"] == ["multi_ghost"] and body["searched"] == 1
+    assert "multi_ghost" not in db.list_user_ids()
+
+
+def test_caller_is_admitted_against_its_limits(monkeypatch):
+    monkeypatch.setattr(user_limiter, "max_concurrency", 0)
+    with TestClient(service.app) as client:
+        response = client.post("/query-multi", json={"userIds": ["multi_known"], "query": "x", "callerId": "team_bot"})
+
+    assert response.status_code == 429
+    assert "team_bot" in [user["userId"] for user in user_limiter.stats()["topRejectedUsers"]]
@@ -0,0 +1,84 @@
+"""
+Retention reads collections in pages, and a rebuild's dual writes reuse the
+written embeddings. Run with: python -m pytest test_retention.py
+"""
+import threading
+from datetime import datetime, timedelta
+import db
+import migration
+import retention
+from embedding import generate_embeddings
+
+
+def _ingest(user_id, count):
+    now = datetime.utcnow()
+    ids = [f"{user_id}_{i}" for i in range(count)]
+    metadatas = [{"content": f"note {i} for {user_id}", "type": "user_message", "threadId": "t1",
+                  "createdAt": (now - timedelta(minutes=count - i)).isoformat() + "Z"} for i in range(count)]
+    db.add_documents(user_id, ids, generate_embeddings([m["content"] for m in metadatas]), metadatas)
+    return ids
+
+
+def test_max_count_is_applied_across_pages(monkeypatch):
+    monkeypatch.setattr(retention, "SCAN_PAGE_SIZE", 7)
+    ids = _ingest("retention_pages", 40)
+    collection = db.get_or_create_collection("retention_pages")
+    policy = {"userId": "*", "type": "user_message", "maxCount": 15}
+
+    expired = retention.expired_in(collection, policy, datetime.utcnow().timestamp())
+
+    assert sorted(expired) == sorted(ids[:25])
+
+
+def test_rebuild_dual_write_reuses_embeddings(monkeypatch):
+    _ingest("retention_shadow", 3)
+    dimensions = len(generate_embeddings(["probe"])[0])
+    route = db.get_route("retention_shadow")
+    shadow_name = db.default_collection_name("retention_shadow") + "_rtest"
+    db.set_shadow("retention_shadow", shadow_name, route["model"], route["dimensions"])
+
+    def no_embedding(*args, **kwargs):
+        raise AssertionError("a same-model shadow must not re-embed")
+
+    monkeypatch.setattr(migration, "generate_embeddings", no_embedding)
+    try:
+        embedding = [0.0] * (dimensions - 1) + [1.0]
+        db.add_document("retention_shadow", "late_write", embedding,
+                        {"content": "written during the rebuild", "type": "user_message", "threadId": "t1"})
+        shadow = db.get_or_create_collection("retention_shadow", shadow_name)
+        stored = shadow.get(ids=["late_write"], include=["embeddings"])
+        assert list(stored["embeddings"][0]) == embedding
+    finally:
+        db.clear_shadow("retention_shadow")
+
+
+def test_rebuild_keeps_a_write_racing_the_switch(monkeypatch):
+    _ingest("retention_switch", 5)
+    in_hook, release = threading.Event(), threading.Event()
+
+    def slow_hook(user_id, doc_ids, *args):
+        if doc_ids == ["late_write"]:
+            in_hook.set()
+            release.wait(5)
+
+    writer = threading.Thread(target=db.add_document, args=(
+        "retention_switch", "late_write", generate_embeddings(["late"])[0],
+        {"content": "late", "type": "user_message", "threadId": "t1"}))
+    scan_pages = db.scan_pages
+
+    def scan_then_write(*args, **kwargs):
+        yield from scan_pages(*args, **kwargs)
+        # Upserted into the old collection after the copy, dual write still pending
+        writer.start()
+        assert in_hook.wait(5)
+        threading.Timer(0.3, release.set).start()
+
+    monkeypatch.setattr(db, "_write_hooks", [slow_hook] + db._write_hooks)
+    monkeypatch.setattr(db, "scan_pages", scan_then_write)
+    monkeypatch.setattr(retention, "REBUILD_DROP_DELAY_SECONDS", 0)
+    result = retention.rebuild_collection("retention_switch")
+    writer.join(5)
+
+    rebuilt = db.get_or_create_collection("retention_switch")
+    assert rebuilt.name == result["to"]
+    assert rebuilt.get(ids=["late_write"])["ids"] == ["late_write"]
@@ -0,0 +1,29 @@
+"""
+Snapshots taken in the same second and restores of a blob store kept outside
+the persist directory. Run with: python -m pytest test_snapshot.py
+"""
+import os
+import shutil
+import db
+import snapshot
+from blob_store import blob_store
+
+
+def test_snapshots_in_the_same_second_restore_external_blobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "root", str(tmp_path / "external_blobs"))
+    db.add_document("snapshot_user", "ai_1", [0.0] * 3071 + [1.0], {
+        "content": "answer", "type": "ai_response", "threadId": "t1", "context": "retrieved context " * 20,
+    })
+    ref = db.get_or_create_collection("snapshot_user").get(ids=["ai_1"], include=["metadatas"])["metadatas"][0]["contextRef"]
+
+    first = snapshot.create_snapshot(str(tmp_path / "snapshots"), keep=0)
+    second = snapshot.create_snapshot(str(tmp_path / "snapshots"), keep=0)
+    assert first["name"] != second["name"]
+    assert second["blobs"]["root"] == str(tmp_path / "external_blobs")
+
+    shutil.rmtree(blob_store.root)
+    result = snapshot.restore_snapshot(str(tmp_path / "snapshots" / second["name"]), str(tmp_path / "restored"))
+    assert result["blobs"] == str(tmp_path / "external_blobs")
+    assert not os.path.exists(tmp_path / "restored" / "blobs")
+    restored_files = [name for _, _, files in os.walk(blob_store.root) for name in files]
+    assert any(name.startswith(ref.split(":", 1)[1]) for name in restored_files)
@@ -0,0 +1,36 @@
+"""
+Startup with the offline embedding provider and warm-up priming with each
+user's embedding model. Run with: python -m pytest test_startup.py
+"""
+import time
+from fastapi.testclient import TestClient
+import app as service
+import db
+import monitoring
+from embedding import _cache_key, embedding_cache
+
+
+def test_fake_provider_starts_without_openai_key(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(service, "_chat_client", None)
+    with TestClient(service.app) as client:
+        for _ in range(50):
+            ready = client.get("/health/ready")
+            if service.readiness["status"] != "starting":
+                break
+            time.sleep(0.1)
+    assert service.readiness["status"] == "ready", service.readiness
+    assert ready.status_code == 200
+
+
+def test_warm_up_primes_with_the_routed_model(monkeypatch):
+    db.update_route("warm_routed", model="text-embedding-3-small", dimensions=256)
+    monkeypatch.setattr(service, "WARMUP_USER_IDS", ["warm_routed", "warm_default"])
+    queries = {("warm_routed",): ["routed question"], ("warm_default",): ["default question"]}
+    monkeypatch.setattr(monitoring, "get_frequent_queries", lambda users, limit: queries[tuple(users)])
+
+    summary = service._warm_up()
+
+    assert summary["embeddingsPrimed"] == 2
+    assert embedding_cache.get(_cache_key("routed question", "text-embedding-3-small", 256), 0) is not None
+    assert embedding_cache.get(_cache_key("default question"), 0) is not None
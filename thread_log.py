@@ -0,0 +1,132 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from db import persist_directory, register_write_hook, register_delete_hook
+from logging_config import setup_logging
+from utils import to_epoch
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+THREAD_LOG_PATH = os.getenv("THREAD_LOG_PATH", os.path.join(persist_directory, "thread_log.sqlite3"))
+MAX_RECENT_PAGE_SIZE = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thread_messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    type TEXT,
+    created_at REAL NOT NULL,
+    content TEXT NOT NULL,
+    metadata TEXT,
+    UNIQUE (user_id, doc_id)
+);
+CREATE INDEX IF NOT EXISTS thread_messages_recent ON thread_messages (user_id, thread_id, created_at, seq);
+"""
+
+
+def _encode_cursor(row: Tuple) -> str:
+    return f"{row[0]!r}_{row[1]}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, int]:
+    created_at, _, seq = cursor.rpartition("_")
+    return float(created_at), int(seq)
+
+
+class ThreadLog:
+    """
+    Ordered per-thread message log kept next to the vector store, so the last
+    N messages of a thread are an index range scan instead of a vector search.
+    Messages are upserted by document id and ordered by creation time.
+    """
+
+    def __init__(self, path: str = THREAD_LOG_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # Callers hold self._lock
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def append(self, user_id: str, doc_ids: List[str], metadatas: List[Dict[str, Any]],
+               embeddings: Optional[List[List[float]]] = None) -> None:
+        """
+        Records documents that belong to a thread; others are ignored.
+        db write hook, also called for deduplicated messages that are not stored as vectors.
+        """
+        rows = []
+        for doc_id, metadata in zip(doc_ids, metadatas):
+            if not metadata.get("threadId"):
+                continue
+            created_at = metadata.get("createdAtTs") or to_epoch(metadata.get("createdAt")) or 0.0
+            details = {key: value for key, value in metadata.items()
+                       if key not in ("content", "context") and value is not None}
+            rows.append((user_id, metadata["threadId"], doc_id, metadata.get("type"), created_at,
+                         metadata.get("content") or "", json.dumps(details, default=str)))
+        if not rows:
+            return
+        with self._lock:
+            self._db().executemany(
+                "INSERT INTO thread_messages (user_id, thread_id, doc_id, type, created_at, content, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id, doc_id) DO UPDATE SET thread_id = excluded.thread_id, type = excluded.type, "
+                "content = excluded.content, metadata = excluded.metadata",
+                rows,
+            )
+
+    def forget(self, user_id: str, doc_ids: List[str]) -> None:
+        """
+        db delete hook: drops deleted documents from the log.
+        """
+        with self._lock:
+            self._db().executemany("DELETE FROM thread_messages WHERE user_id = ? AND doc_id = ?",
+                                   [(user_id, doc_id) for doc_id in doc_ids])
+
+    def recent(self, user_id: str, thread_id: str, limit: int = 20, cursor: Optional[str] = None,
+               types: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of a thread's messages, newest first, and the cursor for the next
+        (older) page. Raises ValueError for an invalid cursor.
+        """
+        limit = max(1, min(limit, MAX_RECENT_PAGE_SIZE))
+        query = ("SELECT created_at, seq, doc_id, type, content, metadata FROM thread_messages "
+                 "WHERE user_id = ? AND thread_id = ?")
+        params: List[Any] = [user_id, thread_id]
+        if types:
+            query += f" AND type IN ({', '.join('?' * len(types))})"
+            params.extend(types)
+        if cursor:
+            try:
+                after_created, after_seq = _decode_cursor(cursor)
+            except ValueError:
+                raise ValueError("Invalid cursor")
+            # Keyset pagination: strictly older than the last row of the previous page
+            query += " AND (created_at < ? OR (created_at = ? AND seq < ?))"
+            params.extend([after_created, after_created, after_seq])
+        query += " ORDER BY created_at DESC, seq DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db().execute(query, params).fetchall()
+
+        next_cursor = _encode_cursor(rows[-1]) if len(rows) == limit else None
+        messages = [
+            {"id": row[2], "type": row[3], "content": row[4], "metadata": json.loads(row[5]) if row[5] else {}}
+            for row in rows
+        ]
+        return messages, next_cursor
+
+
+thread_log = ThreadLog()
+register_write_hook(thread_log.append)
+register_delete_hook(thread_log.forget)
@@ -1,4 +1,30 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional, Union
 
 def current_utc_timestamp() -> str:
     return datetime.utcnow().isoformat() + "Z"
+
+def to_epoch(value: Union[str, datetime, None]) -> Optional[float]:
+    """
+    Converts an ISO timestamp (as written by current_utc_timestamp) or a datetime
+    to epoch seconds. Naive values are taken as UTC; unparseable ones give None.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    Converts an aware datetime to naive UTC, the form stored in MongoDB and
+    compared against utcfromtimestamp(); naive values are returned as is.
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)